@@ -0,0 +1,85 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+"""
+Benchmarks for the workflow tool's hot paths. Everything runs offline against generated data.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --compare results.json git config
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+from serverworkflowtool.utils.log import get_logger
+
+from benchmarks import bench_build, bench_config, bench_format, bench_git, bench_startup  # noqa: F401, registers benchmarks
+from benchmarks.fixtures import Fixtures, SCALES
+from benchmarks.harness import BENCHMARKS, compare, load_results, run_benchmarks, save_results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='Benchmarks or groups to run. Defaults to all of them.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='default', help='Size of the generated data.')
+    parser.add_argument('--repeat', type=int, default=5, help='Minimum number of timed runs per benchmark.')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds to spend per benchmark.')
+    parser.add_argument('--output', help='Write the results as JSON to this path.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against results from an earlier run.')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks and exit.')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, (group, _) in BENCHMARKS.items():
+            print(f'{group:<10} {name}')
+        return 0
+
+    groups = {group for group, _ in BENCHMARKS.values()}
+    unknown = [n for n in args.names if n not in BENCHMARKS and n not in groups]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    # The code under test logs progress we don't want in the results.
+    get_logger(logging.ERROR)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='workflow-bench-') as temp_dir:
+        try:
+            results = run_benchmarks(Fixtures(temp_dir, args.scale), args.names, args.repeat, args.min_time)
+        finally:
+            os.chdir(cwd)
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        if baseline['scale'] != results['scale']:
+            print(f'Warning: comparing against results for scale "{baseline["scale"]}"', file=sys.stderr)
+        print()
+        print(f'{"benchmark":<40} {"baseline":>12} {"current":>12} {"ratio":>7}')
+        for name, base, current, ratio, flag in compare(baseline, results):
+            print(f'{name:<40} {base * 1000:9.3f} ms {current * 1000:9.3f} ms {ratio:7.2f} {flag}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+from serverworkflowtool.utils import ninja_log
+
+from benchmarks.harness import benchmark
+
+BUILDS = 10
+
+
+def _write_log(path, targets):
+    """
+    Write a log of BUILDS full builds of targets objects spread over 8 parallel jobs.
+    """
+    with open(str(path), 'w') as fh:
+        fh.write('# ninja log v5\n')
+        for _ in range(BUILDS):
+            for i in range(targets):
+                end = (i // 8 + 1) * 1000
+                fh.write(f'{end - 900 - i % 7}\t{end}\t0\tbuild/opt/mongo/dir{i % 50}/file{i}.o\t{i:016x}\n')
+
+
+@benchmark('build')
+def build_stats_latest_run(fixtures):
+    path = fixtures.root / '.ninja_log'
+    _write_log(path, fixtures.sizes['files'])
+    return lambda: ninja_log.analyze(path)
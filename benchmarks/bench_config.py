@@ -0,0 +1,84 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import itertools
+
+from serverworkflowtool import config
+
+from benchmarks.harness import benchmark
+
+
+def _ticket(i):
+    ticket = config.TicketConfig()
+    ticket.base_branch = 'master'
+    ticket.ticket_summary = f'Summary of ticket {i}'
+    ticket.patch_ids = [f'{i:024x}']
+    ticket.commits = [f'{i:040x}']
+    return ticket
+
+
+def _use_config_file(fixtures, name, tickets):
+    """
+    Point the config module at a new database holding the given number of tickets.
+    """
+    config.CONFIG_FILE = fixtures.root / 'config' / name / 'config.db'
+    config.LEGACY_CONFIG_FILE = fixtures.root / 'config' / name / 'config.pickle'
+    conf = config.reload_config()
+    for i in range(tickets):
+        conf.in_progress_tickets[f'SERVER-{i}'] = _ticket(i)
+    conf.dump()
+
+
+@benchmark('config')
+def config_load(fixtures):
+    _use_config_file(fixtures, 'load', fixtures.sizes['tickets'])
+
+    def load():
+        return config.reload_config().in_progress_tickets.get('SERVER-1')
+    return load
+
+
+@benchmark('config')
+def config_load_all_tickets(fixtures):
+    _use_config_file(fixtures, 'load_all', fixtures.sizes['tickets'])
+    return lambda: list(config.reload_config().in_progress_tickets.values())
+
+
+@benchmark('config')
+def config_dump_one_ticket(fixtures):
+    _use_config_file(fixtures, 'dump_one', fixtures.sizes['tickets'])
+    counter = itertools.count()
+
+    def dump():
+        conf = config.reload_config()
+        conf.in_progress_tickets['SERVER-1'].commits.append(f'{next(counter):040x}')
+        conf.dump()
+    return dump
+
+
+@benchmark('config')
+def config_dump_all_tickets(fixtures):
+    counter = itertools.count()
+
+    def dump():
+        config.CONFIG_FILE = fixtures.root / 'config' / f'dump_all{next(counter)}' / 'config.db'
+        conf = config.reload_config()
+        for i in range(fixtures.sizes['tickets']):
+            conf.in_progress_tickets[f'SERVER-{i}'] = _ticket(i)
+        conf.dump()
+    return dump
@@ -0,0 +1,97 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import json
+import os
+
+from serverworkflowtool.utils import format_cache, git, watcher
+from serverworkflowtool.utils.format_cache import FormatCache, file_digest
+
+from benchmarks.fixtures import BASE_BRANCH
+from benchmarks.harness import benchmark
+
+FORMATTER_KEY = 'clang-format-0123456789abcdef'
+
+
+def _repo_ctx(fixtures):
+    os.chdir(str(fixtures.mongo))
+    git.invalidate_cache()
+    return fixtures.ctx
+
+
+def _remove_watcher_index(ctx):
+    index_path = watcher._index_path(ctx)
+    if index_path.exists():
+        index_path.unlink()
+
+
+@benchmark('format')
+def format_modified_files_git(fixtures):
+    ctx = _repo_ctx(fixtures)
+    _remove_watcher_index(ctx)
+    return lambda: format_cache.modified_files(ctx, BASE_BRANCH)
+
+
+@benchmark('format')
+def format_modified_files_watcher(fixtures):
+    """
+    Same as above, with the index a running watcher would keep.
+    """
+    ctx = _repo_ctx(fixtures)
+    files = watcher._git_changed_files(ctx, BASE_BRANCH)
+    index = {
+        'pid': os.getpid(),
+        'branch': git.cur_branch_name(ctx),
+        'base_branch': BASE_BRANCH,
+        'base_sha': git.rev_parse(ctx, BASE_BRANCH),
+        'files': files,
+    }
+    watcher._index_path(ctx).write_text(json.dumps(index))
+
+    def run():
+        try:
+            return format_cache.modified_files(ctx, BASE_BRANCH)
+        finally:
+            git.invalidate_cache()
+    return run
+
+
+@benchmark('format')
+def format_stale_files_cold(fixtures):
+    ctx = _repo_ctx(fixtures)
+    _remove_watcher_index(ctx)
+    files = format_cache.modified_files(ctx, BASE_BRANCH)
+    return lambda: format_cache.stale_files(FormatCache(fixtures.root / 'missing.json'), FORMATTER_KEY, files)
+
+
+@benchmark('format')
+def format_stale_files_warm(fixtures):
+    ctx = _repo_ctx(fixtures)
+    _remove_watcher_index(ctx)
+    files = format_cache.modified_files(ctx, BASE_BRANCH)
+
+    path = fixtures.root / 'format-cache' / 'format.json'
+    cache = FormatCache(path)
+    for f in files:
+        cache.add(FORMATTER_KEY, file_digest(f))
+    cache.save()
+
+    def run():
+        stale = format_cache.stale_files(FormatCache(path), FORMATTER_KEY, files)
+        assert not stale
+    return run
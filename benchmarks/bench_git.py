@@ -0,0 +1,77 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import os
+
+from serverworkflowtool.utils import git
+
+from benchmarks.fixtures import BASE_BRANCH, FEATURE_BRANCH
+from benchmarks.harness import benchmark
+
+
+def _repo_ctx(fixtures):
+    os.chdir(str(fixtures.mongo))
+    return fixtures.ctx
+
+
+@benchmark('git')
+def git_cur_branch_name(fixtures):
+    ctx = _repo_ctx(fixtures)
+
+    def run():
+        git.invalidate_cache()
+        git.cur_branch_name(ctx)
+        with ctx.cd(git.ent_repo_rel_path):
+            git.cur_branch_name(ctx)
+    return run
+
+
+@benchmark('git')
+def git_rev_parse_packed_ref(fixtures):
+    ctx = _repo_ctx(fixtures)
+    ref = f'origin/old-branch-{fixtures.sizes["branches"] - 1}'
+
+    def run():
+        git.invalidate_cache()
+        git.rev_parse(ctx, ref)
+    return run
+
+
+@benchmark('git')
+def git_rev_parse_subprocess(fixtures):
+    """
+    Baseline for the in-process reads above.
+    """
+    ctx = _repo_ctx(fixtures)
+    return lambda: ctx.run('git rev-parse --abbrev-ref HEAD')
+
+
+@benchmark('git')
+def git_refresh_repos(fixtures):
+    ctx = _repo_ctx(fixtures)
+    return lambda: git.refresh_repos(ctx, BASE_BRANCH)
+
+
+@benchmark('git')
+def git_checkout_round_trip(fixtures):
+    ctx = _repo_ctx(fixtures)
+
+    def run():
+        git.checkout_branch(ctx, BASE_BRANCH, silent=True)
+        git.checkout_branch(ctx, FEATURE_BRANCH, silent=True)
+    return run
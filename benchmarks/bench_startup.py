@@ -0,0 +1,37 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import subprocess
+import sys
+
+from benchmarks.harness import benchmark
+
+
+def _python(*args):
+    return lambda: subprocess.run([sys.executable] + list(args), check=True,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@benchmark('startup')
+def startup_import(fixtures):
+    return _python('-c', 'import serverworkflowtool.__main__')
+
+
+@benchmark('startup')
+def startup_version(fixtures):
+    return _python('-m', 'serverworkflowtool', '--version')
@@ -0,0 +1,136 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import os
+import pathlib
+import subprocess
+
+from invoke import Config, Context
+
+from serverworkflowtool.utils import git
+
+# Sizes of the generated data. `default` is roughly the size of the real mongo repo's source tree.
+SCALES = {
+    'small': {'files': 200, 'branches': 20, 'modified': 50, 'tickets': 100},
+    'default': {'files': 5000, 'branches': 500, 'modified': 2000, 'tickets': 2000},
+    'large': {'files': 20000, 'branches': 5000, 'modified': 10000, 'tickets': 10000},
+}
+
+BASE_BRANCH = 'master'
+FEATURE_BRANCH = 'SERVER-12345'
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com')
+
+
+def run_git(cwd, *args, stdin=None):
+    return subprocess.run(['git'] + list(args), cwd=str(cwd), env=GIT_ENV, input=stdin, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode().strip()
+
+
+def _source_path(i):
+    # Spread files over a few hundred directories, like src/mongo/db/....
+    return f'src/mongo/dir{i % 300}/sub{i % 7}/file{i}' + ('.js' if i % 10 == 0 else '.cpp')
+
+
+def _fast_import_stream(num_files, num_branches, prefix):
+    """
+    Build a `git fast-import` stream with a single commit of num_files files on master, plus
+    num_branches other branches pointing at it. Generating the history this way is much faster
+    than running git commands per file.
+    """
+    def data(payload):
+        return b'data %d\n%s\n' % (len(payload), payload)
+
+    chunks = [
+        b'commit refs/heads/%s\n' % BASE_BRANCH.encode(),
+        b'mark :1\n',
+        b'committer bench <bench@example.com> 1500000000 +0000\n',
+        data(b'initial commit'),
+    ]
+    for i in range(num_files):
+        path = f'{prefix}{_source_path(i)}'.encode()
+        chunks.append(b'M 644 inline %s\n' % path)
+        chunks.append(data(b'// file %d\nint f%d() { return %d; }\n' % (i, i, i)))
+    chunks.append(b'\n')
+
+    for i in range(num_branches):
+        chunks.append(b'reset refs/heads/old-branch-%d\nfrom :1\n\n' % i)
+    return b''.join(chunks)
+
+
+def _make_remote(path, num_files, num_branches, prefix=''):
+    path.mkdir(parents=True)
+    run_git(path, 'init', '-q', '--bare')
+    run_git(path, 'fast-import', '--quiet', stdin=_fast_import_stream(num_files, num_branches, prefix))
+    run_git(path, 'symbolic-ref', 'HEAD', f'refs/heads/{BASE_BRANCH}')
+    return path
+
+
+class Fixtures(object):
+    """
+    Lazily generated benchmark data under root, so running a subset of the benchmarks only
+    creates what they need.
+    """
+
+    def __init__(self, root, scale='default'):
+        self.root = pathlib.Path(root)
+        self.scale = scale
+        self.sizes = SCALES[scale]
+        self._mongo = None
+
+    @property
+    def ctx(self):
+        return Context(config=Config(overrides={'run': {'hide': True, 'in_stream': False}}))
+
+    @property
+    def mongo(self):
+        """
+        A mongo repo with the enterprise module nested inside it, both cloned from local bare
+        remotes. The feature branch is checked out in both, with files modified relative to master
+        in the mongo repo, half of them committed.
+        """
+        if self._mongo is None:
+            self._mongo = self._make_repos()
+        return self._mongo
+
+    def _make_repos(self):
+        remotes = self.root / 'remotes'
+        mongo = self.root / 'mongo'
+        enterprise = mongo / git.ent_repo_rel_path
+
+        _make_remote(remotes / 'mongo.git', self.sizes['files'], self.sizes['branches'])
+        _make_remote(remotes / 'enterprise.git', self.sizes['files'] // 10, self.sizes['branches'] // 10,
+                     prefix='ent/')
+        run_git(self.root, 'clone', '-q', str(remotes / 'mongo.git'), str(mongo))
+        run_git(mongo, 'clone', '-q', str(remotes / 'enterprise.git'), git.ent_repo_rel_path)
+        (mongo / '.git' / 'info' / 'exclude').write_text(git.ent_repo_rel_path + '\n')
+        # Packed refs, like a repo that has been gc'ed.
+        run_git(mongo, 'pack-refs', '--all')
+
+        modified = [_source_path(i) for i in range(0, self.sizes['files'], 2)][:self.sizes['modified']]
+        for repo in (mongo, enterprise):
+            run_git(repo, 'checkout', '-q', '-b', FEATURE_BRANCH)
+
+        half = len(modified) // 2
+        for i, path in enumerate(modified):
+            with open(str(mongo / path), 'a') as fh:
+                fh.write(f'int modified{i};\n')
+            if i == half:
+                run_git(mongo, 'commit', '-q', '-a', '-m', 'half of the changes')
+        return mongo
@@ -0,0 +1,134 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+from serverworkflowtool import __version__
+
+# Registered benchmarks, in definition order: name -> (group, function).
+BENCHMARKS = {}
+
+
+def benchmark(group):
+    """
+    Register a benchmark. The decorated function is called with the fixtures and returns the
+    function to time, so expensive setup is excluded from the measurement.
+    """
+    def decorator(func):
+        BENCHMARKS[func.__name__] = (group, func)
+        return func
+    return decorator
+
+
+def _time(func, repeat, min_time):
+    """
+    Call func at least `repeat` times and until min_time seconds have passed, returning the
+    duration of each call in seconds.
+    """
+    func()  # Warm up caches, e.g. imports and the OS page cache.
+
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < repeat or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def _summarize(timings):
+    return {
+        'runs': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def _git_sha():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(fixtures, names=None, repeat=5, min_time=0.2, log=print):
+    """
+    Run the registered benchmarks, or only the ones whose name or group is in names, and return
+    the results as a JSON-serializable dict.
+    """
+    results = {}
+    for name, (group, func) in BENCHMARKS.items():
+        if names and name not in names and group not in names:
+            continue
+
+        timings = _time(func(fixtures), repeat, min_time)
+        results[name] = dict(_summarize(timings), group=group)
+        log(f'{name:<40} {results[name]["median"] * 1000:10.3f} ms (median of {len(timings)})')
+
+    return {
+        'version': __version__,
+        'git_sha': _git_sha(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': {
+            'hostname': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'scale': fixtures.scale,
+        'results': results,
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Return (name, baseline median, current median, ratio, flag) rows for the benchmarks present in
+    both results. flag is 'slower' or 'faster' if the medians differ by more than threshold.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        ratio = result['median'] / base['median'] if base['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'slower'
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        rows.append((name, base['median'], result['median'], ratio, flag))
+    return rows
@@ -5,8 +5,217 @@ import importlib
 import json
 import os
 import subprocess
-import psutil
 import argparse
+import concurrent.futures
+import hashlib
+import re
+import socket
+import socketserver
+import stat
+import time
+
+import keyring
+import keyring.backend
+
+# The credential agent keeps credentials read from the keyring in memory, so `create-cr` doesn't have to
+# start gnome-keyring-daemon and query it every time.
+AGENT_DIR = path.join(os.getenv('XDG_RUNTIME_DIR') or path.expanduser(path.join('~', '.cache')),
+                      'jira-credential-agent')
+AGENT_SOCKET = path.join(AGENT_DIR, 'agent.sock')
+# The agent exits, forgetting the credentials, after this many seconds without requests.
+AGENT_IDLE_TIMEOUT = 8 * 60 * 60
+# Requests are handled one at a time, so a client that doesn't send its request within this many
+# seconds is disconnected rather than holding up the others.
+AGENT_CLIENT_TIMEOUT = 5
+
+# Checks run concurrently before uploading a CR, as (upload.py flag they replace, command, files the
+# result depends on besides the diff). Checks whose script doesn't exist are left to upload.py.
+PRE_UPLOAD_CHECKS = [
+    ('--check-clang-format', ['buildscripts/clang_format.py', 'lint-patch', '{patch}'],
+     ['buildscripts/clang_format.py', '.clang-format']),
+    ('--check-eslint', ['buildscripts/eslint.py', 'lint-patch', '{patch}'],
+     ['buildscripts/eslint.py', '.eslintrc.yml']),
+    ('--check-todos', ['buildscripts/todo_check.py', '--ticket', '{ticket}'],
+     ['buildscripts/todo_check.py']),
+]
+# Keys of checks that passed, so uploading the same diff again doesn't rerun them.
+PRE_UPLOAD_CACHE_FILE = path.expanduser(path.join('~', '.cache', 'server-workflow-tool', 'pre-upload-checks.json'))
+PRE_UPLOAD_CACHE_MAX_ENTRIES = 1000
+
+
+def _connect_agent():
+    """
+    Return a socket connected to the credential agent, or None if it isn't running. A leftover
+    socket, e.g. from before a reboot, doesn't count as running.
+    """
+    sock = socket.socket(socket.AF_UNIX)
+    sock.settimeout(5)
+    try:
+        sock.connect(AGENT_SOCKET)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _agent_alive():
+    sock = _connect_agent()
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def _remove_agent_socket():
+    try:
+        os.unlink(AGENT_SOCKET)
+    except FileNotFoundError:
+        pass
+
+
+def _private_agent_dir():
+    """
+    Create AGENT_DIR, or make sure an existing one belongs to the user and only they can access it,
+    since anyone who can reach the socket can read the credentials.
+    """
+    os.makedirs(AGENT_DIR, mode=0o700, exist_ok=True)
+    st = os.lstat(AGENT_DIR)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        sys.exit("{} is not a directory owned by you, not starting the credential agent".format(AGENT_DIR))
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        os.chmod(AGENT_DIR, 0o700)
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        self.timeout = AGENT_CLIENT_TIMEOUT
+        super().setup()
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except socket.timeout:
+            return
+        if not line:
+            # A client checking whether the agent is running.
+            return
+        request = json.loads(line.decode('utf-8'))
+        key = (request.get('service'), request.get('username'))
+        response = {}
+        if request['op'] == 'get':
+            response['password'] = self.server.credentials.get(key)
+        elif request['op'] == 'set':
+            self.server.credentials[key] = request['password']
+        elif request['op'] == 'stop':
+            self.server.stopped = True
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def run_agent(args, extra_args):
+    _private_agent_dir()
+    if _agent_alive():
+        # Another client started an agent at the same time.
+        return
+    _remove_agent_socket()
+
+    # Only the user can reach the socket, as its directory is private.
+    server = socketserver.UnixStreamServer(AGENT_SOCKET, _AgentHandler)
+    server.credentials = {}
+    server.stopped = False
+    server.timeout = AGENT_IDLE_TIMEOUT
+    server.handle_timeout = lambda: setattr(server, 'stopped', True)
+
+    try:
+        while not server.stopped:
+            server.handle_request()
+    finally:
+        server.server_close()
+        _remove_agent_socket()
+
+
+def _start_agent():
+    subprocess.Popen([sys.executable, path.abspath(__file__), 'agent'], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 5
+    while not _agent_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _agent_request(request, start=True):
+    """
+    Send a request to the credential agent, starting it first if it isn't running and start is set.
+    Returns None if the agent can't be reached.
+    """
+    sock = _connect_agent()
+    if sock is None:
+        if not start:
+            return None
+        _start_agent()
+        sock = _connect_agent()
+        if sock is None:
+            return None
+
+    try:
+        with sock:
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            return json.loads(sock.makefile('rb').readline().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _keyring_daemon_running():
+    control = os.getenv('GNOME_KEYRING_CONTROL')
+    if not control and os.getenv('XDG_RUNTIME_DIR'):
+        control = path.join(os.getenv('XDG_RUNTIME_DIR'), 'keyring')
+    if control:
+        try:
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(path.join(control, 'control'))
+            return True
+        except OSError:
+            return False
+
+    import psutil
+    return "gnome-keyring-daemon" in (p.name() for p in psutil.process_iter())
+
+
+def _ensure_keyring_daemon():
+    if not _keyring_daemon_running():
+        subprocess.run(["gnome-keyring-daemon", "--unlock"], input="password", text=True)
+
+
+def _system_keyring():
+    _ensure_keyring_daemon()
+    backends = [k for k in keyring.backend.get_all_keyring() if not isinstance(k, AgentKeyring)]
+    return max(backends, key=keyring.backend.by_priority)
+
+
+class AgentKeyring(keyring.backend.KeyringBackend):
+    """
+    Keyring backend that reads credentials from the credential agent, falling back to the system
+    keyring and caching what it finds in the agent.
+    """
+    priority = 0
+
+    def get_password(self, service, username):
+        response = _agent_request({'op': 'get', 'service': service, 'username': username})
+        if response and response.get('password') is not None:
+            return response['password']
+
+        password = _system_keyring().get_password(service, username)
+        if password is not None:
+            # The agent was started by the first request if it wasn't running.
+            _agent_request({'op': 'set', 'service': service, 'username': username, 'password': password},
+                           start=False)
+        return password
+
+    def set_password(self, service, username, password):
+        _system_keyring().set_password(service, username, password)
+        _agent_request({'op': 'set', 'service': service, 'username': username, 'password': password})
+
+    def delete_password(self, service, username):
+        _system_keyring().delete_password(service, username)
+        _agent_request({'op': 'set', 'service': service, 'username': username, 'password': None}, start=False)
 
 
 def set_password(args, extra_args):
@@ -20,20 +229,141 @@ def set_password(args, extra_args):
     password = {'access_token': tokengen.access_token['oauth_token'], 'access_token_secret': tokengen.access_token['oauth_token_secret']}
     user = os.getenv('JIRA_USERNAME')
 
-    if not "gnome-keyring-daemon" in (p.name() for p in psutil.process_iter()):
-        subprocess.run(["gnome-keyring-daemon", "--unlock"], input="password", text=True)
-    import keyring
-    keyring.set_password(server, user, json.dumps(password))
+    AgentKeyring().set_password(server, user, json.dumps(password))
     print("Password set in keyring for server: {}, user: {}".format(server, user))
 
 
+def _git(*args):
+    return subprocess.run(['git'] + list(args), stdout=subprocess.PIPE, check=True).stdout
+
+
+def _read_check_cache():
+    try:
+        with open(PRE_UPLOAD_CACHE_FILE) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return []
+
+
+def _write_check_cache(keys):
+    os.makedirs(path.dirname(PRE_UPLOAD_CACHE_FILE), exist_ok=True)
+    with open(PRE_UPLOAD_CACHE_FILE + '.tmp', 'w') as fh:
+        json.dump(keys[-PRE_UPLOAD_CACHE_MAX_ENTRIES:], fh)
+    os.replace(PRE_UPLOAD_CACHE_FILE + '.tmp', PRE_UPLOAD_CACHE_FILE)
+
+
+def _check_key(flag, inputs, base, diff):
+    digest = hashlib.sha256(flag.encode('utf-8') + base + diff)
+    for name in inputs:
+        digest.update(name.encode('utf-8'))
+        if path.exists(name):
+            with open(name, 'rb') as fh:
+                digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def run_pre_upload_checks(base_branch, recheck=False):
+    """
+    Run the checks in PRE_UPLOAD_CHECKS on the diff from base_branch's merge base to the working
+    tree, skipping checks that already passed on the same diff. Returns the upload.py flags of the
+    checks that passed, or None if any failed.
+    """
+    os.chdir(_git('rev-parse', '--show-toplevel').decode('utf-8').strip())
+    base = _git('merge-base', 'HEAD', base_branch).strip()
+    diff = _git('diff', '--binary', '--no-color', '--no-ext-diff', base.decode('utf-8'))
+    ticket = re.search(r'[A-Z]+-[0-9]+', _git('rev-parse', '--abbrev-ref', 'HEAD').decode('utf-8'))
+
+    cached = _read_check_cache()
+    passed = set()
+    pending = []
+    for flag, command, inputs in PRE_UPLOAD_CHECKS:
+        if not path.exists(command[0]) or ('{ticket}' in command and not ticket):
+            continue
+        key = _check_key(flag, inputs, base, diff)
+        if key in cached and not recheck:
+            print("{}: already passed on this diff".format(flag))
+            passed.add(flag)
+        else:
+            pending.append((flag, command, key))
+
+    if not pending:
+        return passed
+
+    patch = path.join(_git('rev-parse', '--git-dir').decode('utf-8').strip(), 'pre-upload.patch')
+    with open(patch, 'wb') as fh:
+        fh.write(diff)
+    substitutions = {'{patch}': patch, '{ticket}': ticket.group(0) if ticket else ''}
+
+    def run(command):
+        return subprocess.run([sys.executable] + [substitutions.get(arg, arg) for arg in command],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    failed = False
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = [(flag, key, executor.submit(run, command)) for flag, command, key in pending]
+            for flag, key, future in futures:
+                res = future.result()
+                if res.returncode == 0:
+                    print("{}: passed".format(flag))
+                    passed.add(flag)
+                    cached = [k for k in cached if k != key] + [key]
+                else:
+                    print("{}: failed".format(flag))
+                    sys.stdout.write(res.stdout.decode('utf-8', 'replace'))
+                    failed = True
+    finally:
+        os.unlink(patch)
+
+    _write_check_cache(cached)
+    return None if failed else passed
+
+
+# upload.py options that take a value, which may be given as a separate argument.
+UPLOAD_VALUE_OPTIONS = {
+    "-s", "--server", "-e", "--email", "-H", "--host", "--oauth2_port", "--account_type",
+    "-i", "--issue", "-t", "--title", "-m", "--message", "-F", "--message_file", "-d", "--description",
+    "-f", "--description_file", "-r", "--reviewers", "--cc", "--base_url", "--vcs", "--git_similarity",
+    "-j", "--number-parallel-uploads", "--jira_user",
+}
+
+
+def _may_select_revision(upload_args):
+    """
+    Whether upload.py args may choose what to upload instead of the diff from the merge base with the
+    base branch, through --rev or positional revision or path arguments.
+    """
+    args = iter(upload_args)
+    for arg in args:
+        if arg == "--rev" or arg.startswith("--rev="):
+            return True
+        if arg == "--":
+            return next(args, None) is not None
+        if arg in UPLOAD_VALUE_OPTIONS:
+            # Skip the option's value.
+            next(args, None)
+        elif not arg.startswith("-"):
+            return True
+    return False
+
+
 def create_cr(args, extra_args):
-    if not "gnome-keyring-daemon" in (p.name() for p in psutil.process_iter()):
-        subprocess.run(["gnome-keyring-daemon", "--unlock"], input="password", text=True)
+    upload_args = ["--check-clang-format", "--check-eslint", "--check-todos"]
+    if not args.no_pre_check and _may_select_revision(extra_args):
+        # The pre-upload checks would check a different diff than the one uploaded.
+        print("Leaving the checks to upload.py, as its arguments may select the revisions to upload")
+    elif not args.no_pre_check:
+        passed = run_pre_upload_checks(args.base_branch, recheck=args.recheck)
+        if passed is None:
+            sys.exit("Pre-upload checks failed, not uploading")
+        # Checks that passed here aren't run again by upload.py.
+        upload_args = [flag for flag in upload_args if flag not in passed]
+
+    # upload.py reads the token through keyring, which is only started if the agent doesn't have it.
+    keyring.set_keyring(AgentKeyring())
 
     sys.path.append(os.path.expanduser(os.path.join("~", "kernel-tools", "codereview")))
     upload = importlib.import_module('upload')
-    upload_args = ["--check-clang-format", "--check-eslint", "--check-todos"]
     if os.getenv('JIRA_USERNAME') is not None:
         upload_args.append("--jira_user={}".format(os.getenv('JIRA_USERNAME')))
     upload.RealMain(upload_args + extra_args)
@@ -48,6 +378,15 @@ if __name__ == '__main__':
 
     cr_command = subparsers.add_parser("create-cr", help="open a CR")
     cr_command.set_defaults(func=create_cr)
+    cr_command.add_argument("--base-branch", default="origin/master", help="branch the diff to check is taken from")
+    cr_command.add_argument("--recheck", action="store_true", help="run the pre-upload checks even if they passed on the same diff")
+    cr_command.add_argument("--no-pre-check", action="store_true", help="leave the checks to upload.py")
+
+    agent_command = subparsers.add_parser("agent", help="run the credential agent; it's started automatically when needed")
+    agent_command.set_defaults(func=run_agent)
+
+    forget_command = subparsers.add_parser("forget", help="stop the credential agent, forgetting the credentials it holds")
+    forget_command.set_defaults(func=lambda args, extra_args: _agent_request({'op': 'stop'}, start=False))
 
     known_args, extra_args = parser.parse_known_args()
     known_args.func(known_args, extra_args)
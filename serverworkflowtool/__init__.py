@@ -16,3 +16,6 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
+
+# Keep in sync with setup.py, which reads it from here.
+__version__ = '1.0.1'
@@ -16,54 +16,127 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
+import cProfile
+import importlib
 import logging
 import sys
 
-import pkg_resources
+from invoke import Argument, Program, Collection
 
-from invoke import Program, Collection
-
-from serverworkflowtool import setupenv, helpers
-from serverworkflowtool.config import Config
+from serverworkflowtool import __version__
+from serverworkflowtool.config import dump_config
 from serverworkflowtool.utils import InvalidConfigError, RequireUserInputError
+from serverworkflowtool.utils import trace
 from serverworkflowtool.utils.log import get_logger
 
+# Subcommand collections. Their modules are only imported when one of their tasks is invoked.
+COLLECTIONS = {
+    'setup': 'serverworkflowtool.setupenv',
+    'helpers': 'serverworkflowtool.helpers',
+    'build': 'serverworkflowtool.build',
+    'status': 'serverworkflowtool.status',
+}
+
+
+def _requested_collections(argv):
+    if '--version' in argv or '-V' in argv:
+        return []
+
+    names = {arg.split('.', 1)[0] for arg in argv if not arg.startswith('-')}
+    requested = [name for name in COLLECTIONS if name in names]
+
+    # Listing tasks, e.g. with --help or no arguments at all, needs every collection.
+    return requested or list(COLLECTIONS)
+
+
+def build_namespace(argv, invoke_config=None):
+    ns = Collection()
+    for name in _requested_collections(argv):
+        module = importlib.import_module(COLLECTIONS[name])
+        ns.add_collection(Collection.from_module(module, name=name, config=invoke_config))
+    return ns
+
+
+class WorkflowProgram(Program):
+    """
+    Adds the --trace and --profile core flags.
+    """
+
+    def core_args(self):
+        return super().core_args() + [
+            Argument(
+                names=('trace',),
+                kind=str,
+                default='',
+                help='Write a Chrome trace event file with the timings of tasks and commands to this path.',
+            ),
+            Argument(
+                names=('profile',),
+                kind=str,
+                default='',
+                help='Run the main thread under cProfile and write the stats to this path.',
+            ),
+        ]
+
+    def execute(self):
+        trace_path = self.args.trace.value
+        profile_path = self.args.profile.value
+
+        if trace_path:
+            trace.enable()
+        profiler = cProfile.Profile() if profile_path else None
+
+        try:
+            with trace.span('workflow ' + ' '.join(self.argv[1:]), 'command'):
+                if profiler:
+                    profiler.runcall(super().execute)
+                else:
+                    super().execute()
+        finally:
+            if trace_path:
+                trace.enable().write(trace_path)
+                trace.disable()
+                get_logger().info('Wrote trace to %s, open it in chrome://tracing or ui.perfetto.dev', trace_path)
+            if profiler:
+                profiler.dump_stats(profile_path)
+                get_logger().info('Wrote profile to %s, view it with `python -m pstats %s`',
+                                  profile_path, profile_path)
+
 
 def run():
     invoke_config = {
         'run': {
             'hide': True  # Don't print stdout or stderr.
         },
+        'runners': {
+            'local': trace.TracingLocal  # Records commands when --trace is given.
+        },
         'NINJA_STATUS': '[%f/%t (%p) %es] '  # make the ninja output even nicer
     }
 
-    ns = Collection()
-    ns.add_collection(Collection.from_module(setupenv, name='setup', config=invoke_config))
-    ns.add_collection(Collection.from_module(helpers, name='helpers', config=invoke_config))
-
-    proj_info = pkg_resources.require("server_workflow_tool")[0]
+    argv = sys.argv[1:]
 
-    p = Program(
+    p = WorkflowProgram(
         binary='workflow',
-        name=proj_info.project_name,
-        namespace=ns,
-        version=proj_info.version)
+        name='server_workflow_tool',
+        namespace=build_namespace(argv, invoke_config),
+        version=__version__)
 
-    p.parse_core(sys.argv[1:])
+    p.parse_core(argv)
 
     if p.args.debug.value:
         get_logger(level=logging.DEBUG)
     else:
         get_logger(level=logging.INFO)
 
-    c = Config()
     try:
         p.run()
     except (InvalidConfigError, RequireUserInputError):
         # These errors are not actionable right now.
         sys.exit(1)
     finally:
-        c.dump()
+        # Only commands that used the config load it, and only changes are written back.
+        dump_config()
 
 
 if __name__ == '__main__':
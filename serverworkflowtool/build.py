@@ -0,0 +1,209 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import functools
+import os
+import os.path
+import tempfile
+
+from invoke import task
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import build_jobs, ninja_log, InvalidConfigError
+from serverworkflowtool.utils.log import get_logger
+
+NINJA_LOG = '.ninja_log'
+
+
+def _worktree_for_branch(ctx, branch):
+    path = None
+    for line in ctx.run('git worktree list --porcelain', hide=True, warn=True).stdout.splitlines():
+        if line.startswith('worktree '):
+            path = line.split(' ', 1)[1]
+        elif line == f'branch refs/heads/{branch}':
+            return path
+    return None
+
+
+def _resolve_log(ctx, name):
+    """
+    Find the ninja log for a path to a log, a directory containing one, or a branch checked out in a worktree.
+    """
+    path = name
+    if not os.path.exists(path):
+        path = _worktree_for_branch(ctx, name)
+        if path is None:
+            get_logger().critical('"%s" is neither a ninja log, a directory, nor a branch checked out in a worktree',
+                                  name)
+            raise InvalidConfigError()
+    if os.path.isdir(path):
+        path = os.path.join(path, NINJA_LOG)
+    if not os.path.isfile(path):
+        get_logger().critical('Could not find %s', path)
+        raise InvalidConfigError()
+    return path
+
+
+def _seconds(ms):
+    return f'{ms / 1000:.1f}s'
+
+
+def _log_ccache(ctx):
+    res = ctx.run('ccache --print-stats', hide=True, warn=True)
+    counts = ninja_log.parse_ccache_stats(res.stdout) if res.ok else None
+    if counts is None:
+        get_logger().info('ccache:          no statistics available')
+        return
+    hits, misses = counts
+    total = hits + misses
+    get_logger().info('ccache:          %d/%d hits (%.0f%%) since the statistics were last zeroed',
+                      hits, total, 100.0 * hits / total if total else 0)
+
+
+def _log_summary(label, path, stats):
+    get_logger().info('%s: %s', label, path)
+    get_logger().info('Targets built:   %d', stats.targets)
+    get_logger().info('Wall time:       %s', _seconds(stats.wall_ms))
+    get_logger().info('Total CPU time:  %s (%.1fx parallelism)', _seconds(stats.cpu_ms),
+                      stats.cpu_ms / stats.wall_ms if stats.wall_ms else 0)
+
+
+def _log_changes(title, rows):
+    get_logger().info('')
+    get_logger().info('%s:', title)
+    for delta, base, current, key in rows:
+        get_logger().info('    %+9.1fs  %9s -> %9s  %s', delta / 1000, _seconds(base), _seconds(current), key)
+
+
+@task(help={
+    'log': f'Ninja log to analyze. Defaults to {NINJA_LOG} in the current directory.',
+    'run': 'Which build in the log to analyze; negative numbers count back from the last one. Defaults to -1.',
+    'baseline': 'Compare against this ninja log, a directory containing one, or a branch checked out in a worktree.',
+    'baseline-run': 'Which build in the baseline log to compare against. Defaults to the build before --run '
+                    'when no --baseline is given, otherwise to -1.',
+    'top': 'Number of targets and directories to list. Defaults to 20.',
+    'depth': 'Group compile times by this many leading directory components. Defaults to the full directory.',
+})
+def stats(ctx, log=NINJA_LOG, run=-1, baseline=None, baseline_run=None, top=20, depth=None):
+    """
+    Report the slowest targets, critical path, and per-directory times of a ninja build.
+
+    The log is streamed, so logs of any size can be analyzed. Pass --baseline or --baseline-run to compare
+    two builds, e.g. before and after a change, or the same build on two branches.
+    """
+    run, top, depth = int(run), int(top), int(depth) if depth else None
+    log = _resolve_log(ctx, log)
+
+    try:
+        current = ninja_log.analyze(log, run=run, top=top, depth=depth)
+    except ValueError as e:
+        get_logger().critical(str(e))
+        raise InvalidConfigError()
+
+    if baseline is None and baseline_run is None:
+        _log_summary('Build', log, current)
+        _log_ccache(ctx)
+
+        get_logger().info('')
+        get_logger().info('Slowest targets:')
+        for duration, output in current.slowest():
+            get_logger().info('    %9s  %s', _seconds(duration), output)
+
+        path = current.critical_path()
+        get_logger().info('')
+        get_logger().info('Critical path (estimated from timestamps, %s over %d targets):',
+                          _seconds(sum(duration for _, duration in path)), len(path))
+        for output, duration in path:
+            get_logger().info('    %9s  %s', _seconds(duration), output)
+
+        get_logger().info('')
+        get_logger().info('Compile time by directory:')
+        for key, ms in current.slowest_dirs(top):
+            get_logger().info('    %9s  %5d targets  %s', _seconds(ms), current.dir_targets[key], key)
+        return
+
+    if baseline_run is None:
+        baseline_run = -1 if baseline else run - 1
+    baseline_log = _resolve_log(ctx, baseline) if baseline else log
+
+    try:
+        base = ninja_log.analyze(baseline_log, run=int(baseline_run), top=top, depth=depth)
+    except ValueError as e:
+        get_logger().critical(str(e))
+        raise InvalidConfigError()
+
+    _log_summary('Baseline', baseline_log, base)
+    get_logger().info('')
+    _log_summary('Current', log, current)
+
+    dirs, targets = ninja_log.diff(base, current, n=top)
+    _log_changes('Largest changes by directory', dirs)
+    _log_changes('Largest changes by target', targets)
+
+
+def _plan(cores, scheduler):
+    slots = build_jobs.icecream_slots(scheduler) if scheduler else None
+    return build_jobs.plan_jobs(cores, build_jobs.available_memory(), slots)
+
+
+@task(default=True, help={
+    'targets': 'Space separated ninja targets to build. Defaults to the default targets of the build file.',
+    'build-file': 'Ninja file to build. Defaults to build.ninja.',
+    'icecream': 'Use idle icecream slots to run more jobs than there are local cores. On by default.',
+    'scheduler': 'Host of the icecream scheduler. Defaults to $USE_SCHEDULER, or localhost.',
+    'cores': 'Number of local cores to use. Defaults to all of them.',
+})
+def run(ctx, targets='', build_file='build.ninja', icecream=True, scheduler=None, cores=None):
+    """
+    Run ninja with job counts picked from the free cores, memory and icecream slots.
+
+    Link jobs are limited by memory through the link pool of a temporary copy of the ninja file, so
+    the generated file is left alone. With ninja 1.13 or newer the number of jobs keeps being
+    adjusted as memory and icecream slots free up or run out, otherwise it's picked once and ninja
+    stops starting jobs while the load average exceeds the number of cores.
+    """
+    if not os.path.isfile(build_file):
+        get_logger().critical('Could not find %s, run `workflow helpers.build-files` to generate it', build_file)
+        raise InvalidConfigError()
+
+    cores = int(cores) if cores else os.cpu_count()
+    if icecream:
+        scheduler = scheduler or os.environ.get('USE_SCHEDULER', 'localhost')
+    plan = functools.partial(_plan, cores, scheduler if icecream else None)
+
+    # Ninja doesn't regenerate the copy with the pool depths set, so bring the original up to date first.
+    if build_jobs.builds_itself(build_file):
+        ctx.run(f'ninja -f {build_file} {build_file}', echo=True, hide=False, pty=True)
+
+    jobs = plan()
+    get_logger().info('Building with %d jobs, %d of them local and %d of them linking',
+                      jobs.jobs, jobs.local_jobs, jobs.link_jobs)
+
+    version = build_jobs.ninja_version(ctx.run('ninja --version').stdout)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool_file = build_jobs.write_pool_depths(build_file, {config.NINJA_LOCAL_POOL: jobs.local_jobs,
+                                                              config.NINJA_LINK_POOL: jobs.link_jobs}, tmpdir)
+
+        if version < build_jobs.JOBSERVER_NINJA_VERSION:
+            ctx.run(f'ninja -f {pool_file} -j{jobs.jobs} -l{cores} {targets}', echo=True, hide=False, pty=True)
+            return
+
+        # Ninja only uses the jobserver if -j isn't given.
+        with build_jobs.Jobserver(tmpdir, jobs.jobs) as jobserver, build_jobs.JobAdjuster(jobserver, plan):
+            ctx.run(f'ninja -f {pool_file} {targets}', env={'MAKEFLAGS': jobserver.makeflags},
+                    echo=True, hide=False, pty=True)
@@ -16,9 +16,11 @@
 #  KIND, either express or implied.  See the License for the
 #  specific language governing permissions and limitations
 #  under the License.
+import collections.abc
 import getpass
 import pathlib
 import pickle
+import sqlite3
 
 import invoke.exceptions
 
@@ -27,6 +29,10 @@ from serverworkflowtool.utils.log import get_logger, actionable
 # These configs may need to be updated periodically.
 CLANG_FORMAT_URL = 'https://s3.amazonaws.com/boxes.10gen.com/build/clang%2Bllvm-3.8.0-x86_64-apple-darwin.tar.xz'
 ESLINT_URL = 'https://s3.amazonaws.com/boxes.10gen.com/build/eslint-2.3.0-darwin.tar.gz'
+EVERGREEN_CLI_URL = 'https://evergreen.mongodb.com/clients/darwin_amd64/evergreen'
+BREW_PACKAGES = ['ninja', 'icecream', 'ccache']
+# Executable installed by each of BREW_PACKAGES.
+BREW_PACKAGE_BINARIES = {'ninja': 'ninja', 'icecream': 'icecc', 'ccache': 'ccache'}
 
 # Constants
 HOME = pathlib.Path.home()
@@ -36,13 +42,82 @@ OPT = pathlib.Path('/opt')
 # Parent directory of all git repositories.
 REPO_ROOT = HOME / 'mongodb'
 
+# Python from the MongoDB toolchain, used for the mongo repo's virtualenvs when it's installed.
+TOOLCHAIN_PYTHON = OPT / 'mongodbtoolchain' / 'v4' / 'bin' / 'python3'
+
 CONFIG_DIR = HOME / '.config' / 'server-workflow-tool'
-CONFIG_FILE = CONFIG_DIR / 'config.pickle'
+CONFIG_FILE = CONFIG_DIR / 'config.db'
+# Format of the config, stored as its _version setting. Version 1 was a single pickle file,
+# version 2 is the SQLite database in CONFIG_FILE.
+CONFIG_VERSION = 2
+# Config file used before version 2, migrated to CONFIG_FILE on first use.
+LEGACY_CONFIG_FILE = CONFIG_DIR / 'config.pickle'
+
+# Fingerprints of the inputs of completed setup steps, see utils/step_state.py.
+STEP_STATE_FILE = CONFIG_DIR / 'setup-state.json'
+
+CACHE_DIR = HOME / '.cache' / 'server-workflow-tool'
+
+# Shared cache of downloaded tools, see utils/download.py.
+DOWNLOAD_CACHE_DIR = CACHE_DIR / 'downloads'
+DOWNLOAD_CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Whether to also keep small archives, which are extracted while they download, in the download
+# cache. Archives large enough for a segmented download are always kept, so reprovisioning doesn't
+# download the toolchain tarballs again.
+CACHE_ARCHIVES = False
+# Files at least this large are downloaded as DOWNLOAD_SEGMENTS parallel range requests.
+DOWNLOAD_SEGMENTS = 4
+SEGMENTED_DOWNLOAD_MIN_BYTES = 16 * 1024 ** 2
+
+# Python virtualenvs shared by mongo checkouts with the same requirements, see utils/venv_cache.py.
+VENV_CACHE_DIR = CACHE_DIR / 'venvs'
+VENV_CACHE_MAX_ENTRIES = 5
+# Built wheels and downloads reused when creating any virtualenv.
+WHEEL_CACHE_DIR = CACHE_DIR / 'wheels'
+PIP_CACHE_DIR = CACHE_DIR / 'pip'
+POETRY_CACHE_DIR = CACHE_DIR / 'poetry'
+POETRY_VERSION = '1.5.1'
+
+# compile_commands.json and build.ninja for each set of build inputs, see utils/build_cache.py.
+BUILD_FILES_CACHE_DIR = CACHE_DIR / 'build-files'
+BUILD_FILES_CACHE_MAX_ENTRIES = 20
+
+# Memory each kind of ninja job is assumed to need when `workflow build` picks job counts, see
+# utils/build_jobs.py. Icecream jobs only preprocess locally, so a core can keep several of them busy.
+BUILD_COMPILE_JOB_MEMORY = 1536 * 1024 ** 2
+BUILD_LINK_JOB_MEMORY = 6 * 1024 ** 3
+BUILD_ICECREAM_JOB_MEMORY = 256 * 1024 ** 2
+BUILD_ICECREAM_JOBS_PER_CORE = 4
+# Seconds between job count adjustments while a build runs.
+BUILD_ADJUST_INTERVAL = 5
+# Ninja pools of jobs that must run locally and of link jobs, as named by mongo's ninja generator.
+NINJA_LOCAL_POOL = 'local_pool'
+NINJA_LINK_POOL = 'link_pool'
+# Port of the icecream scheduler's text interface.
+ICECREAM_SCHEDULER_PORT = 8766
+
+# Commits ahead of and behind the base branch of each ticket branch, by commit, see utils/ticket_status.py.
+STATUS_CACHE_FILE = CACHE_DIR / 'status.json'
+
+# Content hashes of files known to be formatted, see utils/format_cache.py.
+FORMAT_CACHE_FILE = CACHE_DIR / 'format.json'
+FORMAT_CACHE_MAX_ENTRIES = 50000
 
 EVG_CONFIG_FILE = HOME / '.evergreen.yml'
 SSH_KEY_FILE = HOME / '.ssh' / 'id_rsa'
 
 EVG_PATCH_URL_BASE = 'https://evergreen.mongodb.com/version/'
+# Patch statuses fetched from Evergreen, see utils/evergreen.py. Finished patches are never fetched
+# again, others are at most every EVG_STATUS_MAX_AGE seconds.
+EVG_STATUS_CACHE_FILE = CACHE_DIR / 'evergreen-patches.json'
+EVG_STATUS_MAX_AGE = 30
+EVG_MAX_CONCURRENT_REQUESTS = 4
+EVG_REQUESTS_PER_SECOND = 10
+# Failed requests are retried up to EVG_MAX_RETRIES times, waiting EVG_RETRY_DELAY seconds, doubled
+# after every attempt.
+EVG_MAX_RETRIES = 5
+EVG_RETRY_DELAY = 1.0
+
 GITHUB_SSH_HELP_URL = ('https://help.github.com/articles/'
                        'generating-a-new-ssh-key-and-adding-it-to-the-ssh-agent/#platform-mac')
 
@@ -54,9 +129,16 @@ class DownloadConfig:
     Config for any downloadable items.
     """
 
-    def __init__(self, remote, relative_local=None, absolute_local=None):
+    def __init__(self, remote, relative_local=None, absolute_local=None, sha256=None, versioned=False):
         self.remote = remote
 
+        # Expected SHA-256 of the downloaded file. If set, the download is verified against it and
+        # can be served from the download cache regardless of URL.
+        self.sha256 = sha256
+        # Whether the content at remote never changes. Without sha256, the checksum of the first
+        # download is pinned, and later downloads are verified against it.
+        self.versioned = versioned
+
         # Only need at most one of the following.
         self.relative_local = relative_local
         self.absolute_local = absolute_local
@@ -73,6 +155,12 @@ REQUIRED_REPOS = [
     DownloadConfig('git@github.com:10gen/employees.git', relative_local='scratch')
 ]
 
+# Maximum number of REQUIRED_REPOS to clone at the same time.
+MAX_CONCURRENT_CLONES = 3
+
+# `helpers.prune` deletes ticket branches without commits for this many days.
+PRUNE_AFTER_DAYS = 90
+
 
 class CommitInfo(object):
     def __init__(self):
@@ -123,9 +211,131 @@ class TicketConfig(object):
         self.__dict__.update(state)
 
 
+def _dumps(obj):
+    return pickle.dumps(
+        obj,
+        protocol=pickle.HIGHEST_PROTOCOL,  # Use protocol version 4.
+        fix_imports=False  # Don't support Python 2.
+    )
+
+
+def _loads(blob):
+    return pickle.loads(blob, fix_imports=False)
+
+
+class _ConfigDB(object):
+    """
+    SQLite database holding the config. Top level settings and tickets are stored as one pickled row
+    each, so a process only writes the rows it changed and concurrent processes don't overwrite each
+    other's changes. SQLite's file locking serializes concurrent writers.
+    """
+
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; write transactions are started explicitly in write().
+        self.conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tickets (branch TEXT PRIMARY KEY, value BLOB NOT NULL)')
+
+    def settings(self):
+        return dict(self.conn.execute('SELECT key, value FROM settings'))
+
+    def ticket(self, branch):
+        row = self.conn.execute('SELECT value FROM tickets WHERE branch = ?', (branch,)).fetchone()
+        return row[0] if row else None
+
+    def tickets(self):
+        return self.conn.execute('SELECT branch, value FROM tickets').fetchall()
+
+    def write(self, settings, tickets, deleted_tickets):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', settings.items())
+            self.conn.executemany('INSERT OR REPLACE INTO tickets (branch, value) VALUES (?, ?)', tickets.items())
+            self.conn.executemany('DELETE FROM tickets WHERE branch = ?', [(b,) for b in deleted_tickets])
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+
+class _TicketStore(collections.abc.MutableMapping):
+    """
+    Dict of branch name to TicketConfig that only loads the tickets that are actually used, and keeps
+    track of which ones have changed since they were loaded.
+    """
+
+    def __init__(self, db=None, tickets=None):
+        self._db = db
+        self._tickets = {}
+        # Pickled form of each ticket as last loaded or saved, used to detect changes.
+        self._saved = {}
+        self._deleted = set()
+        self._all_loaded = db is None
+
+        for branch, ticket in (tickets or {}).items():
+            self[branch] = ticket
+
+    def _load(self, branch, blob):
+        self._tickets[branch] = _loads(blob)
+        self._saved[branch] = blob
+
+    def _load_all(self):
+        if not self._all_loaded:
+            for branch, blob in self._db.tickets():
+                if branch not in self._tickets and branch not in self._deleted:
+                    self._load(branch, blob)
+            self._all_loaded = True
+
+    def __getitem__(self, branch):
+        if branch not in self._tickets and not self._all_loaded and branch not in self._deleted:
+            blob = self._db.ticket(branch)
+            if blob is not None:
+                self._load(branch, blob)
+        return self._tickets[branch]
+
+    def __setitem__(self, branch, ticket):
+        self._tickets[branch] = ticket
+        self._deleted.discard(branch)
+
+    def __delitem__(self, branch):
+        self[branch]  # Raise KeyError for unknown branches.
+        del self._tickets[branch]
+        self._deleted.add(branch)
+
+    def __iter__(self):
+        self._load_all()
+        return iter(list(self._tickets))
+
+    def __len__(self):
+        self._load_all()
+        return len(self._tickets)
+
+    def changes(self):
+        """
+        Return the pickled tickets that changed and the branches that were deleted since the last save.
+        """
+        changed = {}
+        for branch, ticket in self._tickets.items():
+            blob = _dumps(ticket)
+            if blob != self._saved.get(branch):
+                changed[branch] = blob
+        return changed, set(self._deleted)
+
+    def mark_saved(self, changed, deleted):
+        self._saved.update(changed)
+        for branch in deleted:
+            self._saved.pop(branch, None)
+        self._deleted -= deleted
+
+
 class _ConfigImpl(object):
     instance = None
 
+    # Attributes that are not user settings.
+    _TRANSIENT_ATTRS = ('in_progress_tickets', '_db', '_saved_settings')
+
     def __init__(self):
         """
         Define dummy instance attributes here to pacify static code analyzers. The __init__
@@ -139,6 +349,9 @@ class _ConfigImpl(object):
 
         self._version = None
 
+        self._db = None
+        self._saved_settings = None
+
         # Call __setstate__ to ensure atttributes are initialized correctly if _ConfigImpl is
         # created directly (i.e. not through pickle).
         self.__setstate__({})
@@ -146,7 +359,7 @@ class _ConfigImpl(object):
     def __setstate__(self, state):
         # Create instance variables here instead of in __init__
         # because pickle will not add ones from __init__ to __dict__
-        self.in_progress_tickets = {}
+        self.in_progress_tickets = _TicketStore()
 
         self._username = None
         self._sudo_pwd = None
@@ -154,17 +367,29 @@ class _ConfigImpl(object):
         # Default to version 1, this will be overridden by the value in the config file.
         self._version = 1
 
+        self._db = None
+        self._saved_settings = {}
+
         # Restore instance attributes.
         self.__dict__.update(state)
 
-    def __getstate__(self):
-        d = self.__dict__.copy()
+        if not isinstance(self.in_progress_tickets, _TicketStore):
+            # Version 1 config files pickled a plain dict.
+            self.in_progress_tickets = _TicketStore(tickets=self.in_progress_tickets)
+
+    def _settings(self):
+        d = {k: v for k, v in self.__dict__.items() if k not in self._TRANSIENT_ATTRS}
 
         # Remove sensitive and unnecessary info.
         d['_sudo_pwd'] = None
 
         return d
 
+    def __getstate__(self):
+        d = self._settings()
+        d['in_progress_tickets'] = dict(self.in_progress_tickets)
+        return d
+
     def get_sudo_pwd(self, ctx):
         if not self._sudo_pwd:
             while True:
@@ -190,28 +415,91 @@ class _ConfigImpl(object):
         return self._username
 
     def dump(self):
-        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        """
+        Write settings and tickets that changed since they were loaded. Does nothing if nothing changed.
+        """
+        settings = {k: _dumps(v) for k, v in self._settings().items()}
+        settings = {k: v for k, v in settings.items() if self._saved_settings.get(k) != v}
+        tickets, deleted = self.in_progress_tickets.changes()
+
+        if not (settings or tickets or deleted):
+            return
+
+        # Always record which format wrote the file.
+        settings['_version'] = _dumps(self._version)
+
+        if self._db is None:
+            self._db = _ConfigDB(CONFIG_FILE)
+        self._db.write(settings, tickets, deleted)
+
+        self._saved_settings.update(settings)
+        self.in_progress_tickets.mark_saved(tickets, deleted)
+
+    @staticmethod
+    def _load_legacy():
+        with open(str(LEGACY_CONFIG_FILE), 'rb') as fh:
+            try:
+                return pickle.load(fh, fix_imports=False)
+            except (EOFError, KeyError, TypeError, AttributeError) as e:
+                get_logger().error('%s: %s', type(e), str(e))
+        return None
 
-        with open(str(CONFIG_FILE), 'wb') as fh:
-            pickle.dump(
-                self,
-                fh,
-                protocol=pickle.HIGHEST_PROTOCOL,  # Use protocol version 4.
-                fix_imports=False  # Don't support Python 2.
-            )
+    @staticmethod
+    def _move_aside_corrupt_db(db):
+        """
+        Rename an unreadable config database so a new one can be created in its place.
+        """
+        if db is not None:
+            db.conn.close()
+        backup = CONFIG_FILE.with_name(CONFIG_FILE.name + '.bak')
+        get_logger().warning('Moving unreadable config file %s to %s', str(CONFIG_FILE), str(backup))
+        # Keep SQLite's journal files with the database they belong to.
+        for suffix in ('', '-wal', '-shm'):
+            path = CONFIG_FILE.with_name(CONFIG_FILE.name + suffix)
+            if path.exists():
+                path.rename(backup.with_name(backup.name + suffix))
 
     @staticmethod
     def load():
         if CONFIG_FILE.exists():
-            with open(str(CONFIG_FILE), 'rb') as fh:
-                try:
-                    return pickle.load(fh, fix_imports=False)
-                except (EOFError, KeyError, TypeError, AttributeError) as e:
-                    get_logger().error('%s: %s', type(e), str(e))
+            db = None
+            try:
+                db = _ConfigDB(CONFIG_FILE)
+                settings = db.settings()
+            except sqlite3.DatabaseError as e:
+                get_logger().error('%s: %s', type(e), str(e))
+                _ConfigImpl._move_aside_corrupt_db(db)
+            else:
+                conf = _ConfigImpl()
+                # Settings missing from the database have their default value.
+                saved_settings = {k: _dumps(v) for k, v in conf._settings().items()}
+                saved_settings.update(settings)
+
+                conf.__setstate__({k: _loads(v) for k, v in settings.items()})
+                conf._db = db
+                conf._saved_settings = saved_settings
+                conf.in_progress_tickets = _TicketStore(db)
+                # Databases written before the format was versioned are recorded as the current
+                # version on the next write.
+                conf._version = max(conf._version, CONFIG_VERSION)
+                return conf
+
+        elif LEGACY_CONFIG_FILE.exists():
+            conf = _ConfigImpl._load_legacy()
+            if conf is not None:
+                get_logger().info('Migrating config file %s to %s', str(LEGACY_CONFIG_FILE), str(CONFIG_FILE))
+                conf._version = CONFIG_VERSION
+                conf.dump()
+                LEGACY_CONFIG_FILE.rename(LEGACY_CONFIG_FILE.with_name(LEGACY_CONFIG_FILE.name + '.bak'))
+                return conf
 
         get_logger().warning('Could not read config file at %s, using empty config '
                              'as fallback', str(CONFIG_FILE))
-        return _ConfigImpl()
+        conf = _ConfigImpl()
+        conf._version = CONFIG_VERSION
+        # Default settings don't need to be written until something changes.
+        conf._saved_settings = {k: _dumps(v) for k, v in conf._settings().items()}
+        return conf
 
 
 # Singleton _Config object
@@ -220,3 +508,19 @@ def Config():
         _ConfigImpl.instance = _ConfigImpl.load()
 
     return _ConfigImpl.instance
+
+
+def reload_config():
+    """
+    Discard the loaded config and read it again, e.g. to pick up changes made by other processes.
+    """
+    _ConfigImpl.instance = None
+    return Config()
+
+
+def dump_config():
+    """
+    Save the config if it has been loaded by this invocation.
+    """
+    if _ConfigImpl.instance is not None:
+        _ConfigImpl.instance.dump()
@@ -27,14 +27,18 @@
 #  KIND, either express or implied.  See the License for the
 #  specific language governing permissions and limitations
 #  under the License.
+import concurrent.futures
 import os.path
+import pathlib
 
 from invoke import task
 
 from serverworkflowtool import config
-from serverworkflowtool.utils import git as git, InvalidConfigError
+from serverworkflowtool.utils import build_cache, format_cache, git as git, venv_cache, watcher, InvalidConfigError
+from serverworkflowtool.utils.format_cache import FormatCache, file_digest, formatter_key
 from serverworkflowtool.utils.git import cur_branch_name
 from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.utils.scheduler import clone_context
 
 virtualenv = f'source {config.REPO_ROOT / "mongo" / "python3-venv" / "bin" / "activate"}'
 
@@ -55,30 +59,92 @@ def get_ticket_conf(ctx):
     return ticket_conf
 
 
-@task(aliases=['f'])
-def format_code(ctx):
+# Same file types as buildscripts/clang_format.py.
+CLANG_FORMAT_EXTENSIONS = ('.h', '.hpp', '.ipp', '.cpp', '.js')
+
+
+# Resolves and, if missing, downloads the clang-format version mongo pins, the same way
+# `clang_format.py format` does. The last line printed is the binary's path.
+_CLANG_FORMAT_BINARY_SCRIPT = (
+    'from buildscripts.clang_format import ClangFormat, _get_build_dir; '
+    'print(ClangFormat(None, _get_build_dir()).path)'
+)
+
+
+def _clang_format_binary(ctx):
     """
-    Format modified C++ and JavaScript code.
+    Return the path of mongo's pinned clang-format binary.
+
+    `clang_format.py format` ignores file arguments and reformats the whole repo, so the binary
+    is run directly on the files that need formatting.
+    """
+    res = ctx.run(f'python -c "{_CLANG_FORMAT_BINARY_SCRIPT}"', hide=True)
+    return res.stdout.strip().splitlines()[-1]
+
+
+def _chunks(items, n):
+    return [items[i::n] for i in range(n) if items[i::n]]
+
+
+def _run_formatter(ctx, cmd, files, jobs):
+    """
+    Run `cmd <files>` over the files split into up to `jobs` chunks, each in its own process.
+    """
+    def run_chunk(chunk):
+        clone_context(ctx).run(f'{cmd} {" ".join(chunk)}', echo=True, hide=False)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(run_chunk, chunk) for chunk in _chunks(files, jobs)]:
+            future.result()
 
-    Wrapper around `buildscripts/clang_format.py` and `buildscripts/eslint.py`. This command
-    is invoked as part of `commit`.
 
+@task(aliases=['f'], help={'jobs': 'Number of formatter processes to run in parallel. Defaults to the number of CPUs.'})
+def format_code(ctx, jobs=None):
+    """
+    Format modified C++ and JavaScript code.
+
+    Runs the clang-format version pinned by `buildscripts/clang_format.py` and
+    `buildscripts/eslint.py` on the modified files. This command is invoked as part of `commit`.
+    Files whose current content has already been formatted by the same formatter version are
+    skipped.
     """
     check_mongo_repo_root()
 
     ticket_conf = get_ticket_conf(ctx)
     base_branch = ticket_conf.base_branch
+    jobs = int(jobs) if jobs else os.cpu_count()
+
+    modified_files = format_cache.modified_files(ctx, base_branch)
 
-    with ctx.prefix(virtualenv):
-        modified_files = ctx.run(f'git diff --name-only {base_branch}')
-        modified_js_files = [js_file for js_file in modified_files.stdout.strip().split('\n') if
-                             js_file.endswith('.js')]
+    cache = FormatCache()
+    try:
+        with ctx.prefix(virtualenv):
+            clang_format_files = [f for f in modified_files if f.endswith(CLANG_FORMAT_EXTENSIONS)]
+            # Use the clang-format version mongo pins rather than whichever one is on the PATH.
+            clang_format = _clang_format_binary(ctx) if clang_format_files else 'clang-format'
 
-        # If there are no modified JS files, eslint will lint everything.
-        if modified_js_files:
-            ctx.run(f'python buildscripts/eslint.py fix {" ".join(modified_js_files)}', echo=True, hide=False)
+            formatters = [
+                # (cache key, command, files)
+                (formatter_key('eslint', 'buildscripts/eslint.py', '.eslintrc.yml'),
+                 'python buildscripts/eslint.py fix',
+                 [f for f in modified_files if f.endswith('.js')]),
+                (formatter_key('clang-format', clang_format, '.clang-format'),
+                 f'{clang_format} -i -style=file',
+                 clang_format_files),
+            ]
 
-        ctx.run(f'python buildscripts/clang_format.py format-my {base_branch}', echo=True, hide=False)
+            for key, cmd, files in formatters:
+                stale = format_cache.stale_files(cache, key, files)
+                get_logger().info('%s: %d modified files, %d already formatted',
+                                  key.rsplit('-', 1)[0], len(files), len(files) - len(stale))
+
+                # Don't run eslint without files, it would lint everything.
+                if stale:
+                    _run_formatter(ctx, cmd, stale, jobs)
+                    for f in stale:
+                        cache.add(key, file_digest(f))
+    finally:
+        cache.save()
 
 
 @task(aliases=['d'])
@@ -97,6 +163,7 @@ def delete_branch(ctx):
     def run():
         ctx.run(f'git checkout {ticket_conf.base_branch}')
         ctx.run(f'git branch --delete --force {branch}', echo=True, hide=False)
+        git.invalidate_cache()
 
     run()
     with ctx.cd(git.ent_repo_rel_path):
@@ -105,6 +172,126 @@ def delete_branch(ctx):
     config.Config().in_progress_tickets.pop(branch)
 
 
+@task(help={
+    'days': f'Also delete branches without commits for this many days. Defaults to {config.PRUNE_AFTER_DAYS}.',
+    'dry-run': 'Only list the branches that would be deleted.',
+})
+def prune(ctx, days=config.PRUNE_AFTER_DAYS, dry_run=False):
+    """
+    Delete ticket branches that were merged, whose remote branch was deleted, or that were abandoned.
+
+    Branches are deleted from the community and enterprise repos, and their tickets are forgotten. A
+    branch is only deleted if it's stale in every repo that has it. Tickets whose branch no longer
+    exists are forgotten too.
+    """
+    check_mongo_repo_root()
+
+    tickets = config.Config().in_progress_tickets
+    branches = set(tickets)
+    base_branches = {ticket.base_branch for ticket in tickets.values() if ticket.base_branch} | {'master'}
+
+    stale, community_branches = git.find_stale_branches(ctx, branches, base_branches, int(days))
+    # git refuses to delete branches checked out in any worktree, including the current branch.
+    for checked_out in git.run_in_repos(ctx, git.worktree_branches):
+        for branch in sorted(set(stale) & set(checked_out)):
+            get_logger().warning('Not deleting %s, it is checked out in %s', branch, checked_out[branch])
+            del stale[branch]
+    # Tickets of branches deleted outside the tool.
+    orphaned = sorted(branch for branch in branches if branch not in community_branches)
+
+    for branch, (sha, reason) in sorted(stale.items()):
+        get_logger().info('%s %s (%s, was %s)', 'Would delete' if dry_run else 'Deleting', branch, reason, sha[:12])
+    for branch in orphaned:
+        get_logger().info('%s ticket of deleted branch %s', 'Would forget' if dry_run else 'Forgetting', branch)
+    if dry_run:
+        return
+
+    not_deleted = set().union(*git.run_in_repos(ctx, lambda repo_ctx: git.delete_branches(repo_ctx, stale)))
+    deleted = [branch for branch in stale if branch not in not_deleted]
+    # Tickets are only forgotten once their branch is gone from every repo.
+    for branch in deleted + orphaned:
+        del tickets[branch]
+    if not_deleted:
+        get_logger().warning('Could not delete %s', ', '.join(sorted(not_deleted)))
+    get_logger().info('Deleted %d branches and forgot %d tickets', len(deleted), len(deleted) + len(orphaned))
+
+
+@task(help={'background': 'Detach from the terminal and keep running in the background.'})
+def watch(ctx, background=False):
+    """
+    [Linux only] Track modified files so commands like `format_code` don't need to diff the whole tree.
+
+    Watches the mongo repo for file changes and keeps an index of the files modified on the current
+    branch. Commands fall back to asking git when the watcher isn't running.
+    """
+    check_mongo_repo_root()
+
+    if not watcher.is_supported():
+        get_logger().critical('File watching is only supported on Linux')
+        raise InvalidConfigError()
+
+    existing = watcher.read_index(ctx)
+    if existing and watcher.pid_alive(existing['pid']):
+        get_logger().warning('A watcher is already running for this repo with pid %d', existing['pid'])
+        return
+
+    if background:
+        pid = os.fork()
+        if pid:
+            get_logger().info('Started watcher in the background with pid %d', pid)
+            return
+
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            watcher.ChangedFilesWatcher(ctx).run()
+        finally:
+            # Don't run the parent's exit handlers, e.g. saving the config.
+            os._exit(0)
+
+    try:
+        watcher.ChangedFilesWatcher(ctx).run()
+    except KeyboardInterrupt:
+        get_logger().info('Stopped watching')
+
+
+@task(help={'python': 'Python interpreter to create the virtualenv with. Defaults to python3.'})
+def venv(ctx, python='python3'):
+    """
+    Create or update the python3-venv of the current mongo checkout.
+
+    Virtualenvs are created by linking to a copy shared by every checkout with the same requirements, so
+    setting up another worktree takes seconds.
+    """
+    check_mongo_repo_root()
+    venv_cache.provision(ctx, pathlib.Path.cwd(), python=python)
+
+
+@task(help={
+    'jobs': 'Number of SCons jobs if the files need to be generated. Defaults to the number of CPUs.',
+    'force': 'Regenerate the files even if they are cached.'
+})
+def build_files(ctx, jobs=None, force=False):
+    """
+    Restore compile_commands.json and build.ninja for the current branch.
+
+    The files are cached by a hash of the SCons build files and the list of tracked files, so they're
+    only regenerated when those changed. Run this after checking out a branch. Files generated by
+    `ninja compiledb` and `buildninjaic` are added to the cache the next time this command runs on
+    the branch they were generated for.
+    """
+    check_mongo_repo_root()
+
+    repo_dir = pathlib.Path.cwd()
+    # Files generated outside the tool since the last run.
+    build_cache.save(ctx, repo_dir)
+
+    if force or not build_cache.restore(ctx, repo_dir):
+        build_cache.generate(ctx, repo_dir, int(jobs) if jobs else os.cpu_count())
+
+
 @task
 def upgrade(ctx):
     """
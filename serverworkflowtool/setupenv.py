@@ -17,18 +17,24 @@
 #  specific language governing permissions and limitations
 #  under the License.
 import getpass
+import os
 import pathlib
+import shutil
 import sys
+import time
 import webbrowser
 
 import requests
 
-from invoke import task, UnexpectedExit
+from invoke import task
 
 from serverworkflowtool import config
 from serverworkflowtool.config import DownloadConfig
 from serverworkflowtool.templates import evergreen_yaml_template, shell_profile_template
+from serverworkflowtool.utils import build_cache, download, git, step_state, venv_cache, InvalidConfigError
 from serverworkflowtool.utils.log import get_logger, actionable, log_func, log_multiline, req_input
+from serverworkflowtool.utils.scheduler import Step, clone_context, run_steps, split_jobs
+from serverworkflowtool.utils.step_state import StepState
 
 
 def evergreen_yaml(conf):
@@ -87,20 +93,48 @@ def ssh_keys(ctx):
         get_logger().info('Skipping adding SSH Keys to GitHub')
 
 
-def clone_repos(ctx):
+def _clone_repo(ctx, repo_config):
+    repo_dir = config.REPO_ROOT / repo_config.relative_local
+    if repo_dir.exists():
+        get_logger().warning('Local directory %s exists.', str(repo_dir))
+        get_logger().warning('If you\'d like to re-clone, please delete this directory first')
+        return
+
+    cmd = f'git clone --progress {repo_config.remote} {repo_dir}'
+    get_logger().info(cmd)
+    start = time.monotonic()
+    ctx.run(cmd, hide=False, err_stream=git.CloneProgress(repo_config.relative_local))
+    get_logger().info('Cloned %s in %.1fs', repo_config.relative_local, time.monotonic() - start)
+
+
+def _parent_repo(repo_config, repos):
+    """
+    Return the innermost repo in `repos` that contains `repo_config`'s checkout, if any.
+    """
+    path = pathlib.PurePosixPath(repo_config.relative_local)
+    parents = [r for r in repos if r is not repo_config and pathlib.PurePosixPath(r.relative_local) in path.parents]
+    return max(parents, key=lambda r: len(r.relative_local), default=None)
+
+
+def clone_repos(ctx, max_workers=config.MAX_CONCURRENT_CLONES):
+    """
+    Clone all required repos concurrently. Repos nested inside another checkout (e.g. the enterprise
+    module inside mongo) are cloned once their parent has finished.
+    """
     config.REPO_ROOT.mkdir(exist_ok=True)
     get_logger().info('Placing MongoDB Git repositories in %s', config.REPO_ROOT)
 
+    steps = []
+    for repo_config in config.REQUIRED_REPOS:
+        parent = _parent_repo(repo_config, config.REQUIRED_REPOS)
+        steps.append(Step(
+            repo_config.relative_local,
+            f'Clone {repo_config.relative_local}',
+            lambda c, r=repo_config: _clone_repo(c, r),
+            deps=[parent.relative_local] if parent else []))
+
     with ctx.cd(str(config.REPO_ROOT)):
-        for repo_config in config.REQUIRED_REPOS:
-            repo_dir = config.REPO_ROOT / repo_config.relative_local
-            if repo_dir.exists():
-                get_logger().warning('Local directory %s exists.', str(repo_dir))
-                get_logger().warning('If you\'d like to re-clone, please delete this directory first')
-            else:
-                cmd = f'git clone {repo_config.remote} {repo_dir}'
-                get_logger().info(cmd)
-                ctx.run(cmd, hide=False)
+        run_steps(ctx, steps, max_workers=max_workers, keep_going=True)
 
 
 def create_dir(ctx, conf, dir_absolute):
@@ -116,32 +150,23 @@ def create_dir(ctx, conf, dir_absolute):
     get_logger().info(f'Created directory {d}')
 
 
-def _do_download(ctx, download_config):
-    with ctx.cd(str(config.HOME)):
-        local_path = config.HOME / download_config.relative_local
-        if local_path.exists():
-            get_logger().warning('File %s exists. If you\'d like to re-download this '
-                                 'file, please delete the local copy first.', local_path)
-        else:
-            cmd = f'curl -o {download_config.relative_local} {download_config.remote}'
-            get_logger().info(cmd)
-            ctx.run(cmd)
+def _do_download(download_config):
+    local_path = config.HOME / download_config.relative_local
+    if local_path.exists():
+        get_logger().warning('File %s exists. If you\'d like to re-download this '
+                             'file, please delete the local copy first.', local_path)
+    else:
+        download.install(download_config, local_path)
 
 
-def _download_executable_tarball(ctx, download_config, default_name, pretty_name):
+def _download_executable_tarball(download_config, default_name, pretty_name):
     bin_dir = config.HOME / 'bin'
 
     if (bin_dir / pretty_name).exists():
         get_logger().warning('File/Directory %s already exists. Skipping install', str(bin_dir / pretty_name))
         return
 
-    download_config.relative_local = f'bin/{pretty_name}.tar.xz'
-    _do_download(ctx, download_config)
-
-    with ctx.cd(str(bin_dir)):
-        ctx.run(f'tar -xvzf {pretty_name}.tar.xz')
-        ctx.run(f'rm -f {pretty_name}.tar.xz')
-        ctx.run(f'mv {default_name} {pretty_name}')
+    download.extract_tarball(download_config, default_name, bin_dir / pretty_name)
 
 
 def download_clang_format(ctx):
@@ -152,12 +177,12 @@ def download_clang_format(ctx):
                              str(bin_dir / 'clang-format'))
         return
 
-    dc = DownloadConfig(config.CLANG_FORMAT_URL)
+    dc = DownloadConfig(config.CLANG_FORMAT_URL, versioned=True)
 
     default_name = 'clang+llvm-3.8.0-x86_64-apple-darwin'
     pretty_name = 'llvm-3.8.0'
 
-    _download_executable_tarball(ctx, dc, default_name=default_name, pretty_name=pretty_name)
+    _download_executable_tarball(dc, default_name=default_name, pretty_name=pretty_name)
 
     with ctx.cd(str(bin_dir)):
         # softlink clang-format to PATH.
@@ -165,12 +190,12 @@ def download_clang_format(ctx):
 
 
 def download_eslint(ctx):
-    dc = DownloadConfig(config.ESLINT_URL)
+    dc = DownloadConfig(config.ESLINT_URL, versioned=True)
 
     default_name = 'eslint-Darwin-x86_64'
     pretty_name = 'eslint'
 
-    _download_executable_tarball(ctx, dc, default_name=default_name, pretty_name=pretty_name)
+    _download_executable_tarball(dc, default_name=default_name, pretty_name=pretty_name)
 
 
 def download_evergreen(ctx):
@@ -180,16 +205,13 @@ def download_evergreen(ctx):
         get_logger().warning('File %s already exists. Skipping downloading evergreen CLI',
                              str(bin_dir / 'evergreen'))
     else:
-        dc = DownloadConfig(
-            'https://evergreen.mongodb.com/clients/darwin_amd64/evergreen',
-            relative_local='bin/evergreen'
-        )
+        dc = DownloadConfig(config.EVERGREEN_CLI_URL, relative_local='bin/evergreen')
 
-        _do_download(ctx, dc)
+        _do_download(dc)
 
-    with ctx.cd(str(bin_dir)):
-        # chmod is cheap enough that we'll just always do it instead of checking if it's already done.
-        ctx.run('chmod +x evergreen')
+    # chmod is cheap enough that we'll just always do it instead of checking if it's already done.
+    evergreen = bin_dir / 'evergreen'
+    evergreen.chmod(evergreen.stat().st_mode | 0o111)
 
 
 def install_githooks(ctx):
@@ -215,42 +237,20 @@ def install_githooks(ctx):
 
 
 def setup_mongo_repo_env(ctx):
-    mongo_dir = config.REPO_ROOT / 'mongo'
-    python3_venv_dir = 'python3-venv'
-
-    def run_cmds(cmds):
-        for cmd in cmds:
-            res = ctx.run(cmd)
-            get_logger().info('Ran cmd: %s', res.command)
-
-    with ctx.cd(str(mongo_dir)):
-        if not (mongo_dir / python3_venv_dir).exists():
-            install_venv_cmds = [
-                f'python3 -m venv {python3_venv_dir}',
-            ]
-
-            run_cmds(install_venv_cmds)
-        else:
-            get_logger().warning('Found existing Python3 virtualenv at %s, skipping creating a new one',
-                                 str(mongo_dir / python3_venv_dir))
+    # The virtualenv is shared with other checkouts that have the same requirements.
+    venv_cache.provision(ctx, config.REPO_ROOT / 'mongo')
 
-        with ctx.prefix('source python3-venv/bin/activate'):
-            install_cmds = [
-                'pip install -r etc/pip/dev-requirements.txt',
-                'pip install regex',
-            ]
 
-            run_cmds(install_cmds)
+def _brew_binaries():
+    return [shutil.which(config.BREW_PACKAGE_BINARIES[package]) for package in config.BREW_PACKAGES]
 
 
 def install_ninja(ctx):
-    try:
-        # Use ninja as a sentinel to check if this step as run.
-        ctx.run('ninja --version')
-    except UnexpectedExit:
-        ctx.run('brew install ninja icecream ccache')
+    missing = [package for package, binary in zip(config.BREW_PACKAGES, _brew_binaries()) if not binary]
+    if not missing:
+        get_logger().warning('%s appear to be already installed, skipping install', ', '.join(config.BREW_PACKAGES))
     else:
-        get_logger().warning('ninja appears to be already installed, skipping install')
+        ctx.run(f'brew install {" ".join(missing)}')
 
     (config.HOME / 'Library' / 'LaunchAgents').mkdir(parents=True, exist_ok=True)
 
@@ -281,7 +281,9 @@ def post_task_instructions():
         '',
         '    https://sarcasm.github.io/notes/dev/compilation-database.html#text-editors-and-ides',
         '',
-        '    When you switch branches or add/remove files, compiledb needs to be updated by running `ninja compiledb`',
+        '    When you add or remove files, compiledb needs to be updated by running `ninja compiledb`. Run',
+        '    `workflow helpers.build-files` after switching branches to restore it and build.ninja from a cache,',
+        '    which only regenerates them if the build files or the list of source files changed',
         '',
         '    If you\'d like to use an editor that "just works", The CLion IDE is a good option. You just need',
         '    to install it and open the "mongo" directory. Code completion and jumping to definitions will',
@@ -294,41 +296,151 @@ def post_task_instructions():
     get_logger().warning('Please run mongod with `--dbpath /opt/data` as macOS 10.15+ does not allow modifying /')
 
 
-@task
-def macos(ctx):
+@task(help={
+    'jobs': 'Maximum number of setup tasks to run concurrently. Defaults to 4.',
+    'clone-jobs': f'Maximum number of repositories to clone concurrently. Defaults to {config.MAX_CONCURRENT_CLONES}.',
+    'force': 'Rerun every step, even ones whose inputs haven\'t changed since they last finished.'
+})
+def macos(ctx, jobs=4, clone_jobs=config.MAX_CONCURRENT_CLONES, force=False):
     """
     Set up macOS for MongoDB server development.
 
     If you're running the workflow tool for the first time, please use the bootstrap script from README.md.
+    Steps that finished before are skipped unless their inputs, e.g. download URLs or the mongo repo's
+    Python requirements, have changed.
     """
     conf = config.Config()
+    state = StepState()
+    if force:
+        state.clear()
 
-    funcs = [
-        # Do tasks that require user interaction first.
-        (lambda: ssh_keys(ctx), 'Configure SSH Keys'),
-        (lambda: create_dir(ctx, conf, '/opt/data'), 'Create MongoDB Data Directory'),
-        (lambda: create_dir(ctx, conf, '/opt/mongodbtoolchain/revisions'), 'Create MongoDB Toolchain Directory'),
-        (lambda: create_dir(ctx, conf, str(config.HOME / 'bin')), 'Create User bin Directory'),
-
-        # Then do the automated tasks that don't require user interaction.
-        (lambda: evergreen_yaml(conf), 'Configure Evergeen'),
-        (lambda: clone_repos(ctx), 'Clone MongoDB Repositories'),
-        (lambda: download_clang_format(ctx), 'Download clang-format'),
-        (lambda: download_eslint(ctx), 'Download eslint'),
-        (lambda: download_evergreen(ctx), 'Download evergreen CLI'),
-        (lambda: install_ninja(ctx), 'Install ninja, icecream, ccache'),
-
-        # Next do mongo repo setup. These tasks require the system setup steps above to have run.
-        (lambda: setup_mongo_repo_env(ctx), 'Setup the mongo Repository'),
-
-        # Do tasks that require followup work last.
-        (lambda: install_githooks(ctx), 'Install Git Hooks'),
-        (lambda: install_shell_profile(ctx), 'Install Shell Profile'),
-        (lambda: post_task_instructions(), 'Post Setup Instructions')
+    bin_dir = config.HOME / 'bin'
+    mongo_dir = config.REPO_ROOT / 'mongo'
+    fingerprint = step_state.fingerprint
+
+    steps = [
+        # Do tasks that require user interaction first. These are run serially.
+        Step('ssh_keys', 'Configure SSH Keys', ssh_keys, interactive=True),
+        Step('data_dir', 'Create MongoDB Data Directory',
+             lambda c: create_dir(c, conf, '/opt/data'), interactive=True),
+        Step('toolchain_dir', 'Create MongoDB Toolchain Directory',
+             lambda c: create_dir(c, conf, '/opt/mongodbtoolchain/revisions'), interactive=True),
+        Step('bin_dir', 'Create User bin Directory',
+             lambda c: create_dir(c, conf, str(config.HOME / 'bin')), interactive=True),
+        Step('evergreen_yaml', 'Configure Evergeen', lambda c: evergreen_yaml(conf), interactive=True),
+
+        # Then do the automated tasks that don't require user interaction. These run concurrently
+        # once their dependencies have finished.
+        Step('clone_repos', 'Clone MongoDB Repositories',
+             lambda c: clone_repos(c, max_workers=int(clone_jobs)), deps=['ssh_keys']),
+        Step('clang_format', 'Download clang-format', download_clang_format, deps=['bin_dir'],
+             fingerprint=lambda: fingerprint(config.CLANG_FORMAT_URL),
+             outputs=[bin_dir / 'clang-format', bin_dir / 'llvm-3.8.0'], clean=True),
+        Step('eslint', 'Download eslint', download_eslint, deps=['bin_dir'],
+             fingerprint=lambda: fingerprint(config.ESLINT_URL), outputs=[bin_dir / 'eslint'], clean=True),
+        # The evergreen CLI URL always points at the latest release, so ask the server whether it changed.
+        Step('evergreen_cli', 'Download evergreen CLI', download_evergreen, deps=['bin_dir'],
+             fingerprint=lambda: fingerprint(config.EVERGREEN_CLI_URL,
+                                             download.remote_validator(config.EVERGREEN_CLI_URL)),
+             outputs=[bin_dir / 'evergreen'], clean=True),
+        Step('ninja', 'Install ninja, icecream, ccache', install_ninja,
+             # Runs again when any of the tools is uninstalled.
+             fingerprint=lambda: fingerprint(config.BREW_PACKAGES, _brew_binaries())),
+        Step('mongo_repo_env', 'Setup the mongo Repository', setup_mongo_repo_env, deps=['clone_repos'],
+             fingerprint=lambda: venv_cache.lock_digest(mongo_dir),
+             outputs=[mongo_dir / venv_cache.VENV_DIR_NAME]),
+        Step('githooks', 'Install Git Hooks', install_githooks, deps=['clone_repos'],
+             fingerprint=lambda: fingerprint(step_state.stat_digest(config.REPO_ROOT / 'kernel-tools' / 'githooks'),
+                                             step_state.stat_digest(mongo_dir / 'buildscripts' / 'install-hooks')),
+             outputs=[config.HOME / '.githooks' / 'mongo']),
     ]
 
-    for func in funcs:
-        log_func(func[0], func[1])
+    run_steps(ctx, steps, max_workers=int(jobs), state=state)
+
+    # Do tasks that require followup work last, so their instructions aren't buried in other output.
+    log_func(lambda: install_shell_profile(ctx), 'Install Shell Profile')
+    log_func(lambda: post_task_instructions(), 'Post Setup Instructions')
 
     get_logger().info('Finished setting up macOS for MongoDB development!')
     get_logger().info(f'Please go over any action items above highlighted in {actionable("green")}.')
+
+
+def _worktree_dir(repo, branch):
+    # E.g. ~/mongo-v80 for the v8.0 branch of ~/mongo, as in virtual_workstation_setup.sh.
+    return repo.parent / f'{repo.name}-{branch.replace(".", "").replace("/", "-")}'
+
+
+def _add_worktree(ctx, repo, branch, path):
+    if path.exists():
+        get_logger().warning('%s exists, skipping adding a worktree for %s', str(path), branch)
+        return
+
+    with ctx.cd(str(repo)):
+        ctx.run(f'git worktree add {path} {branch}')
+
+
+def _head_sha(ctx, path):
+    path_ctx = clone_context(ctx)
+    with path_ctx.cd(str(path)):
+        return git.rev_parse(path_ctx)
+
+
+@task(help={
+    'branches': 'Comma separated branches to set up, e.g. "master,v8.0". A branch checked out in the main '
+                'repo is set up in place, others get a worktree next to it, e.g. mongo-v80.',
+    'repo': 'Path of the main mongo repo. Defaults to the current directory.',
+    'cpus': 'Number of cores to split between the branches\' build file generation. Defaults to all of them.',
+    'python': f'Python to create the virtualenvs with. Defaults to {config.TOOLCHAIN_PYTHON} if it exists.',
+    'force': 'Rerun every step, even ones whose inputs haven\'t changed since they last finished.'
+})
+def worktrees(ctx, branches, repo=None, cpus=None, python=None, force=False):
+    """
+    Set up worktrees of the mongo repo for several branches concurrently.
+
+    Each branch gets a worktree, a virtualenv from the shared cache, a compilation database and a
+    build.ninja. The cores are split between the branches, so their mostly single-threaded SCons
+    phases overlap without oversubscribing the machine.
+    """
+    repo = pathlib.Path(repo).expanduser().resolve() if repo else pathlib.Path.cwd()
+    if not (repo / 'SConstruct').exists():
+        get_logger().critical('%s is not a mongo repo', str(repo))
+        raise InvalidConfigError()
+
+    branches = [b.strip() for b in branches.split(',') if b.strip()]
+    if not python:
+        python = str(config.TOOLCHAIN_PYTHON) if config.TOOLCHAIN_PYTHON.exists() else 'python3'
+
+    state = StepState()
+    if force:
+        state.clear()
+
+    with ctx.cd(str(repo)):
+        main_branch = git.cur_branch_name(ctx)
+
+    steps = []
+    previous_add = None
+    jobs = split_jobs(int(cpus) if cpus else os.cpu_count(), len(branches))
+    for branch, branch_jobs in zip(branches, jobs):
+        path = repo if branch == main_branch else _worktree_dir(repo, branch)
+        deps = []
+        if path != repo:
+            # `git worktree add` updates the main repo's metadata, so they're run one at a time.
+            steps.append(Step(f'worktree:{path}', f'Add worktree for {branch}',
+                              lambda c, b=branch, p=path: _add_worktree(c, repo, b, p),
+                              deps=[previous_add] if previous_add else []))
+            previous_add = f'worktree:{path}'
+            deps = [previous_add]
+
+        steps.append(Step(f'venv:{path}', f'Create virtualenv for {branch}',
+                          lambda c, p=path: venv_cache.provision(c, p, python=python), deps=deps,
+                          fingerprint=lambda p=path: venv_cache.lock_digest(p, python),
+                          outputs=[path / venv_cache.VENV_DIR_NAME]))
+        steps.append(Step(f'build_files:{path}', f'Generate compiledb and build.ninja for {branch} '
+                                                 f'with {branch_jobs} jobs',
+                          lambda c, p=path, j=branch_jobs: build_cache.ensure(c, p, j), deps=[f'venv:{path}'],
+                          fingerprint=lambda p=path: step_state.fingerprint(_head_sha(ctx, p)),
+                          outputs=[path / 'compile_commands.json', path / 'build.ninja']))
+
+    get_logger().info('Setting up %s using %s', ', '.join(branches),
+                      ', '.join(f'{j} cores' for j in jobs))
+    run_steps(ctx, steps, max_workers=len(branches), keep_going=True, state=state)
@@ -0,0 +1,121 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import time
+
+from invoke import task
+
+from serverworkflowtool import config
+from serverworkflowtool.helpers import check_mongo_repo_root
+from serverworkflowtool.utils import evergreen, ticket_status
+from serverworkflowtool.utils.git import cur_branch_name
+from serverworkflowtool.utils.log import get_logger
+
+
+def _format_repo(status):
+    if not status.exists:
+        return '-'
+    counts = f'+{status.ahead}/-{status.behind}' if status.ahead is not None else '?'
+    return counts + (' dirty' if status.dirty else '')
+
+
+@task(default=True)
+def tickets(ctx):
+    """
+    Show the status of every in-progress ticket.
+
+    For each ticket, shows the commits ahead of and behind its base branch and any uncommitted
+    changes in each repo, and its code reviews and patches.
+
+    "+a/-b" is the number of commits ahead of and behind the base branch, "?" means the base branch
+    doesn't exist locally and "-" that the repo doesn't have the branch.
+    """
+    check_mongo_repo_root()
+
+    in_progress = config.Config().in_progress_tickets
+    branches = {branch: ticket.base_branch for branch, ticket in in_progress.items()}
+    if not branches:
+        get_logger().info('No tickets in progress')
+        return
+
+    cache = ticket_status.AheadBehindCache()
+    community, enterprise = ticket_status.collect(ctx, branches, cache)
+    cache.save()
+
+    current = cur_branch_name(ctx)
+    rows = [('', 'Branch', 'Base', 'Community', 'Enterprise', 'Code reviews', 'Patches')]
+    for branch in sorted(branches):
+        ticket = in_progress[branch]
+        reviews = ', '.join(str(cr) for cr in (ticket.cr_info.community, ticket.cr_info.enterprise) if cr)
+        patches = f'{len(ticket.patch_ids)}, latest {ticket.patch_ids[-1]}' if ticket.patch_ids else ''
+        rows.append(('*' if branch == current else '', branch, ticket.base_branch or '',
+                     _format_repo(community[branch]), _format_repo(enterprise[branch]), reviews or '', patches))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        get_logger().info('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def _log_patches(patches, cache, errors):
+    for branch, patch_id in patches:
+        entry = cache.get(patch_id)
+        status = entry['patch'].get('status', 'unknown') if entry else 'unknown'
+        if patch_id in errors:
+            status += f' (could not refresh: {errors[patch_id]})'
+        get_logger().info('%-12s %-10s %s%s', branch, status, config.EVG_PATCH_URL_BASE, patch_id)
+
+
+@task(help={
+    'watch': 'Keep polling until every patch has finished, showing the patches whose status changed.',
+    'force': 'Fetch every patch, even finished ones and ones fetched recently.',
+})
+def patches(ctx, watch=False, force=False):
+    """
+    Show the Evergreen status of the patches of every in-progress ticket.
+
+    Statuses are cached: finished patches are never fetched again and unfinished ones only once the
+    cached status is half a minute old, so running this repeatedly is cheap.
+    """
+    in_progress = config.Config().in_progress_tickets
+    all_patches = [(branch, patch_id) for branch in sorted(in_progress) for patch_id in in_progress[branch].patch_ids]
+    if not all_patches:
+        get_logger().info('No patches to check')
+        return
+
+    cache = evergreen.PatchStatusCache()
+    cache.retain(patch_id for _, patch_id in all_patches)
+    poller = evergreen.PatchPoller(*evergreen.read_credentials(), cache)
+
+    def status(patch_id):
+        entry = cache.get(patch_id)
+        return entry['patch'].get('status') if entry else None
+
+    errors = poller.poll([patch_id for _, patch_id in all_patches], force=force)
+    cache.save()
+    _log_patches(all_patches, cache, errors)
+
+    pending = [(branch, patch_id) for branch, patch_id in all_patches
+               if patch_id not in errors and not cache.is_finished(patch_id)]
+    while watch and pending:
+        time.sleep(config.EVG_STATUS_MAX_AGE)
+        before = {patch_id: status(patch_id) for _, patch_id in pending}
+        errors = poller.poll([patch_id for _, patch_id in pending])
+        cache.save()
+        _log_patches([(branch, patch_id) for branch, patch_id in pending
+                      if patch_id in errors or status(patch_id) != before[patch_id]], cache, errors)
+        pending = [(branch, patch_id) for branch, patch_id in pending if not cache.is_finished(patch_id)]
@@ -16,6 +16,8 @@
 #  KIND, either express or implied.  See the License for the
 #  specific language governing permissions and limitations
 #  under the License.
+import os
+import tempfile
 
 
 def singleton(cls):
@@ -28,6 +30,20 @@ def singleton(cls):
     return getinstance
 
 
+def atomic_write_text(path, text):
+    """
+    Write text to path so that readers see either the old or the new content, never a partial file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(text)
+        os.replace(tmp, str(path))
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
 class InvalidConfigError(Exception):
     """
     Error indicating invalid configuration or usage of the workflow tool.
@@ -40,3 +56,18 @@ class RequireUserInputError(Exception):
     Error type indicating user input is needed outside of this tool.
     """
     pass
+
+
+class ChecksumMismatchError(Exception):
+    """
+    Error indicating a downloaded file does not match its expected checksum.
+    """
+    pass
+
+
+class IncompleteDownloadError(IOError):
+    """
+    Error indicating the connection closed before a download finished. Segmented downloads resume
+    from where they stopped on the next attempt.
+    """
+    pass
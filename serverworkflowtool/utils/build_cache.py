@@ -0,0 +1,180 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import hashlib
+import os
+import shutil
+import tempfile
+
+from serverworkflowtool import config
+from serverworkflowtool.utils.log import get_logger
+
+# Generated files that only depend on the build inputs below, not on the content of source files.
+BUILD_FILES = ['compile_commands.json', 'build.ninja']
+
+MODULES_DIR = 'src/mongo/db/modules'
+
+
+def _is_build_input(path):
+    name = os.path.basename(path)
+    return (name == 'SConstruct' or name.startswith('SConscript')
+            or path.startswith('site_scons/')
+            or (path.startswith('etc/scons/') and name.endswith('.vars'))
+            or (path.startswith(MODULES_DIR + '/') and name == 'build.py'))
+
+
+def _tracked_files(ctx, repo_dir):
+    """
+    Return the files tracked in the mongo repo and in any modules checked out inside it, relative
+    to repo_dir.
+    """
+    with ctx.cd(str(repo_dir)):
+        files = [f for f in ctx.run('git ls-files -z').stdout.split('\0') if f]
+
+    modules_dir = repo_dir / MODULES_DIR
+    if modules_dir.is_dir():
+        for module in sorted(os.listdir(str(modules_dir))):
+            if os.path.exists(str(modules_dir / module / '.git')):
+                with ctx.cd(str(modules_dir / module)):
+                    files.extend(f'{MODULES_DIR}/{module}/{f}'
+                                 for f in ctx.run('git ls-files -z').stdout.split('\0') if f)
+    return sorted(files)
+
+
+def inputs_digest(ctx, repo_dir, files=None):
+    """
+    Hash everything compile_commands.json and build.ninja are generated from: the names of all
+    tracked files and the content of the SCons build files.
+    """
+    files = files if files is not None else _tracked_files(ctx, repo_dir)
+    digest = hashlib.sha256()
+    for f in files:
+        digest.update(f.encode('utf-8', 'surrogateescape') + b'\0')
+        if _is_build_input(f):
+            try:
+                with open(str(repo_dir / f), 'rb') as fh:
+                    digest.update(hashlib.sha256(fh.read()).digest())
+            except FileNotFoundError:
+                digest.update(b'deleted')
+    return digest.hexdigest()
+
+
+def _repo_cache_dir(repo_dir):
+    # The files contain absolute paths, so each checkout has its own entries.
+    key = hashlib.sha256(os.path.realpath(str(repo_dir)).encode('utf-8')).hexdigest()[:16]
+    return config.BUILD_FILES_CACHE_DIR / key
+
+
+def _is_fresh(repo_dir, files):
+    """
+    Whether the build files were generated after the last change to any build input.
+    """
+    try:
+        generated = min(os.stat(str(repo_dir / f)).st_mtime for f in BUILD_FILES)
+    except FileNotFoundError:
+        return False
+
+    inputs = [repo_dir / f for f in files if _is_build_input(f)]
+    newest_input = max((os.stat(str(p)).st_mtime for p in inputs if p.exists()), default=0)
+    return generated >= newest_input
+
+
+def save(ctx, repo_dir):
+    """
+    Add repo_dir's build files to the cache if they are up to date with the build inputs. Returns
+    whether they were added.
+    """
+    # Checked first so checkouts that never generated the files don't pay for listing tracked files.
+    if not all((repo_dir / f).exists() for f in BUILD_FILES):
+        return False
+
+    files = _tracked_files(ctx, repo_dir)
+    if not _is_fresh(repo_dir, files):
+        return False
+
+    entry = _repo_cache_dir(repo_dir) / inputs_digest(ctx, repo_dir, files)
+    if entry.exists():
+        os.utime(str(entry))
+        return True
+
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    # Written to a temporary directory first, so a concurrent restore never sees a partial entry.
+    tmp = tempfile.mkdtemp(dir=str(entry.parent), prefix='.tmp-')
+    try:
+        for f in BUILD_FILES:
+            shutil.copyfile(str(repo_dir / f), os.path.join(tmp, f))
+        os.rename(tmp, str(entry))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Another process may have added the same entry first.
+        if not entry.exists():
+            raise
+    get_logger().debug('Cached build files for %s in %s', str(repo_dir), str(entry))
+
+    _evict(entry.parent)
+    return True
+
+
+def restore(ctx, repo_dir):
+    """
+    Replace repo_dir's build files with cached ones generated from the same build inputs. Returns
+    whether they were found.
+    """
+    entry = _repo_cache_dir(repo_dir) / inputs_digest(ctx, repo_dir)
+    if not entry.exists():
+        return False
+
+    for f in BUILD_FILES:
+        # Copying gives the files a new modification time, so ninja doesn't consider build.ninja
+        # older than the build inputs the checkout just touched.
+        tmp = repo_dir / f'.{f}.tmp'
+        shutil.copyfile(str(entry / f), str(tmp))
+        os.replace(str(tmp), str(repo_dir / f))
+    os.utime(str(entry))
+
+    get_logger().info('Restored %s from the cache', ' and '.join(BUILD_FILES))
+    return True
+
+
+def _evict(repo_cache_dir):
+    entries = [p for p in repo_cache_dir.iterdir() if p.is_dir() and not p.name.startswith('.')]
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for entry in entries[config.BUILD_FILES_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(str(entry), ignore_errors=True)
+
+
+def generate(ctx, repo_dir, jobs):
+    """
+    Generate the build files with SCons using repo_dir's virtualenv, and cache them.
+    """
+    with ctx.cd(str(repo_dir)), ctx.prefix('source python3-venv/bin/activate'):
+        ctx.run(f'python buildscripts/scons.py --variables-files=etc/scons/mongodbtoolchain_stable_clang.vars '
+                f'compiledb -j{jobs}')
+        # Same as `buildninjaic` in server_bashrc.sh.
+        ctx.run(f'python buildscripts/scons.py --variables-files=etc/scons/mongodbtoolchain_stable_gcc.vars '
+                f'MONGO_VERSION=$(git describe --abbrev=0 | tail -c+2) --ssl ICECC=icecc CCACHE=ccache '
+                f'--ninja build.ninja -j{jobs}')
+    save(ctx, repo_dir)
+
+
+def ensure(ctx, repo_dir, jobs):
+    """
+    Restore repo_dir's build files from the cache, generating them if they aren't cached.
+    """
+    if not restore(ctx, repo_dir):
+        generate(ctx, repo_dir, jobs)
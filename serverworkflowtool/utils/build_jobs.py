@@ -0,0 +1,243 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import collections
+import os
+import pathlib
+import re
+import socket
+import subprocess
+import sys
+import threading
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text
+from serverworkflowtool.utils.log import get_logger
+
+# Ninja reads job tokens from a GNU make jobserver since 1.13.
+JOBSERVER_NINJA_VERSION = (1, 13)
+
+JobPlan = collections.namedtuple('JobPlan', ['jobs', 'local_jobs', 'link_jobs'])
+
+
+def _parse_meminfo(text):
+    for line in text.splitlines():
+        if line.startswith('MemAvailable:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def _parse_vm_stat(text):
+    page_size = re.search(r'page size of (\d+) bytes', text)
+    pages = dict(re.findall(r'^Pages (free|inactive|speculative|purgeable):\s+(\d+)\.$', text, re.MULTILINE))
+    if not page_size or not pages:
+        return None
+    return sum(int(n) for n in pages.values()) * int(page_size.group(1))
+
+
+def available_memory():
+    """
+    Return the bytes of memory that can be used without swapping, or None if unknown.
+    """
+    if sys.platform == 'darwin':
+        res = subprocess.run(['vm_stat'], stdout=subprocess.PIPE, universal_newlines=True)
+        return _parse_vm_stat(res.stdout)
+
+    try:
+        with open('/proc/meminfo') as fh:
+            return _parse_meminfo(fh.read())
+    except FileNotFoundError:
+        return None
+
+
+def _parse_listcs(text):
+    # Each host is listed as " <name> (<ip>:<port>) [<platform>] speed=<speed> jobs=<used>/<max> load=<load>".
+    free = 0
+    for used, total in re.findall(r'jobs=(\d+)/(\d+)', text):
+        free += max(0, int(total) - int(used))
+    return free
+
+
+def icecream_slots(host, port=None, timeout=1.0):
+    """
+    Return the number of idle job slots in the icecream cluster, including this machine's, or None if
+    the scheduler can't be reached.
+    """
+    port = port or config.ICECREAM_SCHEDULER_PORT
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            sock.sendall(b'listcs\nquit\n')
+            data = b''
+            while b'\n200 done' not in data:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError as e:
+        get_logger().debug('Could not reach the icecream scheduler at %s:%d: %s', host, port, str(e))
+        return None
+    return _parse_listcs(data.decode('utf-8', 'replace'))
+
+
+def plan_jobs(cores, memory, icecream_slots=None):
+    """
+    Pick ninja job counts for a machine with the given cores and bytes of available memory.
+
+    Compiles run locally unless the icecream cluster has idle slots, in which case up to that many
+    jobs run while this machine has the cores and memory to preprocess for them. Link jobs always run
+    locally and need the most memory.
+    """
+    if memory is None:
+        memory = cores * config.BUILD_COMPILE_JOB_MEMORY
+
+    local_jobs = max(1, min(cores, memory // config.BUILD_COMPILE_JOB_MEMORY))
+    link_jobs = max(1, min(local_jobs, memory // config.BUILD_LINK_JOB_MEMORY))
+
+    jobs = local_jobs
+    if icecream_slots:
+        jobs = max(local_jobs, min(icecream_slots, cores * config.BUILD_ICECREAM_JOBS_PER_CORE,
+                                   memory // config.BUILD_ICECREAM_JOB_MEMORY))
+    return JobPlan(jobs, local_jobs, link_jobs)
+
+
+def builds_itself(build_file):
+    """
+    Whether the ninja file has a build statement that regenerates it, e.g. when SConscripts change.
+    """
+    name = re.escape(pathlib.Path(build_file).name)
+    pattern = re.compile(rf'^build (?:[^:\n]*\s)?(?:\./)?{name}(?:\s[^:\n]*)?:', re.MULTILINE)
+    return bool(pattern.search(pathlib.Path(build_file).read_text()))
+
+
+def write_pool_depths(build_file, depths, directory):
+    """
+    Write a copy of a ninja file with the given depths for its existing pools to directory, and
+    return the copy's path.
+
+    The generated file itself is left alone, as its generator would overwrite any change to it.
+    Paths in ninja files are relative to where ninja runs, so the copy can be built from anywhere.
+    Pools that aren't defined are skipped with a warning, as the jobs meant for them then run without
+    a limit.
+    """
+    build_file = pathlib.Path(build_file)
+    text = build_file.read_text()
+
+    for pool, depth in depths.items():
+        pattern = re.compile(rf'^(pool {re.escape(pool)}\n\s+depth\s*=\s*)\d+', re.MULTILINE)
+        text, found = pattern.subn(rf'\g<1>{depth}', text)
+        if found:
+            get_logger().info('Limiting ninja pool %s to %d jobs', pool, depth)
+        else:
+            get_logger().warning('%s has no pool named %s, its jobs are not limited to %d at a time',
+                                 build_file, pool, depth)
+
+    pool_file = pathlib.Path(directory) / build_file.name
+    atomic_write_text(pool_file, text)
+    return pool_file
+
+
+def ninja_version(text):
+    match = re.match(r'(\d+)\.(\d+)', text.strip())
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+class Jobserver(object):
+    """
+    A GNU make jobserver backed by a named pipe, whose number of job tokens can change while it's used.
+
+    Clients implicitly own one job, so the pipe holds one token less than the number of jobs. Tokens
+    taken back while clients hold them are reclaimed when they are returned.
+    """
+
+    def __init__(self, directory, jobs):
+        self.path = os.path.join(str(directory), 'jobserver')
+        os.mkfifo(self.path, 0o600)
+        # Opening for reading and writing doesn't block and keeps the pipe usable when clients exit.
+        self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        self.jobs = 1
+        self._tokens = 0
+        self.resize(jobs)
+
+    @property
+    def makeflags(self):
+        return f'-j{self.jobs} --jobserver-auth=fifo:{self.path}'
+
+    def resize(self, jobs):
+        self.jobs = max(1, jobs)
+        self.reclaim()
+        while self._tokens < self.jobs - 1:
+            os.write(self._fd, b'+')
+            self._tokens += 1
+
+    def reclaim(self):
+        """
+        Take back tokens returned to the pipe beyond the current number of jobs.
+        """
+        excess = self._tokens - (self.jobs - 1)
+        while excess > 0:
+            try:
+                taken = len(os.read(self._fd, excess))
+            except BlockingIOError:
+                return
+            self._tokens -= taken
+            excess -= taken
+
+    def close(self):
+        os.close(self._fd)
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JobAdjuster(threading.Thread):
+    """
+    Periodically re-plans the number of jobs from the current free memory and icecream slots and
+    resizes a `Jobserver` to match.
+    """
+
+    def __init__(self, jobserver, plan, interval=None):
+        super().__init__(daemon=True)
+        self.jobserver = jobserver
+        self.plan = plan
+        self.interval = interval if interval is not None else config.BUILD_ADJUST_INTERVAL
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            jobs = self.plan().jobs
+            if jobs != self.jobserver.jobs:
+                get_logger().debug('Adjusting the number of build jobs from %d to %d', self.jobserver.jobs, jobs)
+                self.jobserver.resize(jobs)
+            else:
+                self.jobserver.reclaim()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
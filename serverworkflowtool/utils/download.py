@@ -0,0 +1,500 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tarfile
+import tempfile
+import threading
+
+import requests
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import ChecksumMismatchError, IncompleteDownloadError, atomic_write_text
+from serverworkflowtool.utils.log import get_logger
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = (10, 60)  # (connect, read) in seconds.
+
+
+def _sha256_str(s):
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+def _check_digest(url, expected, actual):
+    if expected is not None and actual != expected.lower():
+        raise ChecksumMismatchError(f'Checksum mismatch for {url}: expected {expected}, got {actual}')
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _probe(url):
+    """
+    Return the size of url, whether the server accepts range requests and a validator (ETag or
+    Last-Modified) identifying this version of the file.
+    """
+    res = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if not res.ok:
+        # Some servers don't support HEAD; let the GET report any real error.
+        return -1, False, None
+    size = int(res.headers.get('Content-Length', -1))
+    accepts_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    validator = res.headers.get('ETag') or res.headers.get('Last-Modified')
+    return size, accepts_ranges, validator
+
+
+def remote_validator(url):
+    """
+    Return the ETag or Last-Modified header the server reports for url, which changes whenever a new
+    file is published at an unversioned URL. Returns None if the server can't be reached or reports
+    neither.
+    """
+    try:
+        return _probe(url)[2]
+    except requests.RequestException as e:
+        get_logger().debug('Could not check %s for updates: %s', url, str(e))
+        return None
+
+
+def _download_single(url, path):
+    try:
+        with open(str(path), 'wb') as fh, requests.get(url, stream=True, timeout=TIMEOUT) as res:
+            res.raise_for_status()
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                fh.write(chunk)
+    except BaseException:
+        # A single stream can't be resumed, so don't leave the partial file behind.
+        if os.path.exists(str(path)):
+            os.unlink(str(path))
+        raise
+
+
+class _SegmentedDownload(object):
+    """
+    Download of a single file as several byte ranges fetched in parallel.
+
+    Progress is saved to a state file next to the partial download, so an interrupted download
+    resumes each segment where it left off.
+    """
+
+    # Save progress at most once per this many bytes written by a segment.
+    SAVE_INTERVAL = 8 * CHUNK_SIZE
+
+    def __init__(self, url, path, size, validator, num_segments):
+        self.url = url
+        self.path = pathlib.Path(path)
+        self.state_path = self.path.with_name(self.path.name + '.state')
+        self.size = size
+        self.validator = validator
+        self.lock = threading.Lock()
+
+        self.segments = self._load_segments()
+        if self.segments is None:
+            bounds = [size * i // num_segments for i in range(num_segments + 1)]
+            # Each segment is [first byte, last byte, next byte to download].
+            self.segments = [[bounds[i], bounds[i + 1] - 1, bounds[i]] for i in range(num_segments)]
+            with open(str(self.path), 'wb') as fh:
+                fh.truncate(size)
+            self._save()
+        else:
+            get_logger().info('Resuming download of %s', url)
+
+    def _load_segments(self):
+        if not (self.path.exists() and self.state_path.exists()):
+            return None
+        try:
+            state = json.loads(self.state_path.read_text())
+        except ValueError:
+            return None
+        if (state.get('url'), state.get('size'), state.get('validator')) != (self.url, self.size, self.validator):
+            return None
+        return state['segments']
+
+    def _save(self):
+        state = {'url': self.url, 'size': self.size, 'validator': self.validator, 'segments': self.segments}
+        atomic_write_text(self.state_path, json.dumps(state))
+
+    def _record_progress(self, fh, segment, num_bytes):
+        fh.flush()
+        with self.lock:
+            segment[2] += num_bytes
+            self._save()
+
+    def _fetch_segment(self, segment):
+        start, end, offset = segment
+        if offset > end:
+            return
+
+        headers = {'Range': f'bytes={offset}-{end}'}
+        if self.validator:
+            headers['If-Range'] = self.validator
+
+        with open(str(self.path), 'r+b') as fh, \
+                requests.get(self.url, headers=headers, stream=True, timeout=TIMEOUT) as res:
+            res.raise_for_status()
+            if res.status_code != 206:
+                raise IOError(f'Server did not honor range request for {self.url}, the file may have changed')
+
+            fh.seek(offset)
+            unsaved = 0
+            try:
+                for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                    fh.write(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= self.SAVE_INTERVAL:
+                        self._record_progress(fh, segment, unsaved)
+                        unsaved = 0
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                raise IncompleteDownloadError(f'Connection closed early while downloading {self.url}') from e
+            finally:
+                # Keep what was downloaded so far even if the connection dropped.
+                self._record_progress(fh, segment, unsaved)
+
+        if segment[2] <= end:
+            raise IncompleteDownloadError(f'Connection closed early while downloading {self.url}')
+
+    def run(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.segments)) as executor:
+            futures = [executor.submit(self._fetch_segment, segment) for segment in self.segments]
+        for future in futures:
+            # Re-raise the first error, if any. Progress has been saved for the next attempt.
+            future.result()
+
+        self.state_path.unlink()
+
+
+def download_file(url, path, segments=None, probe=None):
+    """
+    Download url to path, using parallel range requests for large files if the server supports them.
+
+    Interrupted segmented downloads are resumed from where they left off on the next call with the
+    same path. Servers without range support fall back to a single stream.
+
+    :param probe: the result of _probe(url), if the caller already has it.
+    """
+    segments = segments if segments is not None else config.DOWNLOAD_SEGMENTS
+    probe = probe if probe is not None else _probe(url)
+
+    if _use_segments(probe, segments):
+        size, _, validator = probe
+        _SegmentedDownload(url, path, size, validator, segments).run()
+    else:
+        _download_single(url, path)
+
+
+def _use_segments(probe, segments=None):
+    segments = segments if segments is not None else config.DOWNLOAD_SEGMENTS
+    size, accepts_ranges, _ = probe
+    return segments > 1 and accepts_ranges and size >= config.SEGMENTED_DOWNLOAD_MIN_BYTES
+
+
+class DownloadCache(object):
+    """
+    Content-addressed cache of downloaded files.
+
+    Files are stored under blobs/<sha256 of content>. Downloads without a known checksum are found
+    through urls/<sha256 of url>, which holds the content checksum of the last download of that URL
+    and the server's validator (ETag or Last-Modified) for it. Such downloads are only reused while
+    the server still reports the same validator.
+
+    The least recently used blobs are evicted once the cache grows beyond max_bytes. Blobs returned
+    by get() or fetch() must only be read inside using(), which keeps evict() from removing them.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = pathlib.Path(cache_dir if cache_dir is not None else config.DOWNLOAD_CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else config.DOWNLOAD_CACHE_MAX_BYTES
+
+        self.blob_dir = self.cache_dir / 'blobs'
+        self.url_dir = self.cache_dir / 'urls'
+        self.tmp_dir = self.cache_dir / 'tmp'
+        self.lock_file = self.cache_dir / 'lock'
+
+    def _ensure_dirs(self):
+        for d in (self.blob_dir, self.url_dir, self.tmp_dir):
+            d.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # flock() locks belong to the open file, so every holder opens its own, even within a process.
+        with open(str(self.lock_file), 'a') as fh:
+            fcntl.flock(fh, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def using(self):
+        """
+        Context manager that keeps blobs from being evicted while they are in use.
+        """
+        return self._lock(fcntl.LOCK_SH)
+
+    def _read_url_entry(self, url):
+        try:
+            entry = json.loads((self.url_dir / _sha256_str(url)).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        # Entries written before validators were recorded hold just the checksum and are never reused.
+        return entry if isinstance(entry, dict) else None
+
+    def last_sha256(self, url):
+        """
+        Return the checksum of the last download of url, or None if it was never downloaded.
+        """
+        entry = self._read_url_entry(url)
+        return entry and entry['sha256']
+
+
+    def get(self, url, sha256=None, validator=None):
+        """
+        Return the path of the cached file for url, or None if it isn't cached.
+
+        Without sha256, the file is only found if it was downloaded when the server reported the
+        same validator for url.
+        """
+        if sha256 is None:
+            entry = self._read_url_entry(url)
+            if validator is None or entry is None or entry.get('validator') != validator:
+                return None
+            sha256 = entry['sha256']
+
+        blob = self.blob_dir / sha256
+        try:
+            # Record the access for LRU eviction.
+            os.utime(str(blob))
+        except FileNotFoundError:
+            return None
+        return blob
+
+    def fetch(self, url, sha256=None):
+        """
+        Return the path of the cached file for url, downloading it first if necessary.
+
+        Without sha256, the server is asked whether url changed since it was cached.
+
+        :raises ChecksumMismatchError: if sha256 is given and the downloaded file doesn't match it.
+        """
+        probe = _probe(url) if sha256 is None else None
+        blob = self.get(url, sha256, probe and probe[2])
+        if blob is not None:
+            get_logger().info('Using cached download of %s', url)
+            return blob
+
+        get_logger().info('Downloading %s', url)
+        probe = probe if probe is not None else _probe(url)
+        part, actual = self.download(url, sha256, probe)
+        return self.add(str(part), url, actual, probe[2])
+
+    def download(self, url, sha256, probe):
+        """
+        Download url to a partial file in the cache's temp directory without adding it to the cache.
+
+        The partial file is named after the URL, so an interrupted segmented download is resumed by
+        the next call. Returns the partial file and the checksum of its content.
+
+        :raises ChecksumMismatchError: if sha256 is given and the downloaded file doesn't match it.
+        """
+        self._ensure_dirs()
+        part = self.tmp_dir / f'{_sha256_str(url)}.part'
+        download_file(url, part, probe=probe)
+
+        actual = _sha256_file(part)
+        try:
+            _check_digest(url, sha256, actual)
+        except ChecksumMismatchError:
+            part.unlink()
+            raise
+        return part, actual
+
+    def add(self, tmp, url, sha256, validator=None):
+        """
+        Move a fully downloaded and verified file into the cache.
+        """
+        blob = self.blob_dir / sha256
+        os.replace(tmp, str(blob))
+        self.record(url, sha256, validator)
+        self.evict(keep=blob)
+        return blob
+
+    def record(self, url, sha256, validator=None):
+        """
+        Record the checksum of the last download of url, whether or not the file itself is cached.
+        """
+        self._ensure_dirs()
+        atomic_write_text(self.url_dir / _sha256_str(url), json.dumps({'sha256': sha256, 'validator': validator}))
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used blobs until the cache is no larger than max_bytes.
+
+        Does nothing while any blob is in use, the next call after that catches up.
+        """
+        if not self.blob_dir.exists():
+            return
+
+        try:
+            with self._lock(fcntl.LOCK_EX | fcntl.LOCK_NB):
+                self._evict(keep)
+        except BlockingIOError:
+            get_logger().debug('Download cache is in use, not evicting')
+
+    def _evict(self, keep):
+        blobs = []
+        for blob in self.blob_dir.iterdir():
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((st.st_mtime, st.st_size, blob))
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, blob in sorted(blobs, key=lambda b: b[0]):
+            if total <= self.max_bytes:
+                break
+            if blob == keep:
+                continue
+            get_logger().debug('Evicting %s from the download cache', blob.name)
+            try:
+                blob.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _expected_sha256(download_config, cache):
+    # The checksum of the first download of a versioned URL is pinned for all later downloads.
+    if download_config.sha256 is None and download_config.versioned:
+        return cache.last_sha256(download_config.remote)
+    return download_config.sha256
+
+
+def install(download_config, local_path, cache=None):
+    """
+    Fetch download_config.remote through the download cache and atomically place it at local_path.
+    """
+    cache = cache if cache is not None else DownloadCache()
+    local_path = pathlib.Path(local_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(local_path.parent), prefix=f'.{local_path.name}.')
+    os.close(fd)
+    try:
+        with cache.using():
+            blob = cache.fetch(download_config.remote, _expected_sha256(download_config, cache))
+            shutil.copyfile(str(blob), tmp)
+        os.replace(tmp, str(local_path))
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+    cache.evict()
+    return local_path
+
+
+class _HashingReader(object):
+    """
+    File-like wrapper that hashes everything read through it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.digest.update(data)
+        return data
+
+    def drain(self):
+        """
+        Read the rest of the stream; tarfile stops before the end-of-archive padding.
+        """
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _extract_stream(fileobj, dest_dir):
+    # Stream mode ("r|*") reads the archive strictly sequentially and detects the compression type.
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(dest_dir, filter='data')
+        else:
+            tar.extractall(dest_dir)
+
+
+def extract_tarball(download_config, member, local_path, cache=None):
+    """
+    Extract the top level directory `member` of the tarball at download_config.remote to local_path.
+
+    Small archives are decompressed and extracted while they are being downloaded, so they are never
+    written to disk, unless config.CACHE_ARCHIVES is set. Archives large enough for a segmented
+    download are always downloaded into the cache first, so an interrupted download resumes and
+    reprovisioning doesn't download them again.
+    Extraction happens in a temp directory next to local_path, which is renamed into place only once
+    the whole archive has been extracted and verified.
+    """
+    cache = cache if cache is not None else DownloadCache()
+    url = download_config.remote
+    sha256 = _expected_sha256(download_config, cache)
+    local_path = pathlib.Path(local_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with cache.using(), \
+            tempfile.TemporaryDirectory(dir=str(local_path.parent), prefix=f'.{local_path.name}.') as tmp_dir:
+        probe = _probe(url)
+        blob = cache.get(url, sha256, probe[2])
+        if blob is None and (config.CACHE_ARCHIVES or _use_segments(probe)):
+            get_logger().info('Downloading %s', url)
+            part, actual = cache.download(url, sha256, probe)
+            blob = cache.add(str(part), url, actual, probe[2])
+
+        if blob is not None:
+            get_logger().info('Extracting %s', url)
+            with open(str(blob), 'rb') as fh:
+                _extract_stream(fh, tmp_dir)
+        else:
+            get_logger().info('Downloading and extracting %s', url)
+            with requests.get(url, stream=True, timeout=TIMEOUT) as res:
+                res.raise_for_status()
+                res.raw.decode_content = True
+                reader = _HashingReader(res.raw)
+                _extract_stream(reader, tmp_dir)
+                reader.drain()
+
+            actual = reader.digest.hexdigest()
+            _check_digest(url, sha256, actual)
+            # The archive isn't cached, but later downloads of a versioned URL are verified against it.
+            cache.record(url, actual, probe[2])
+
+        os.replace(os.path.join(tmp_dir, member), str(local_path))
+
+    cache.evict()
+    return local_path
@@ -0,0 +1,193 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import asyncio
+import json
+import random
+import time
+
+import requests
+import yaml
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text, InvalidConfigError
+from serverworkflowtool.utils.log import get_logger
+
+TIMEOUT = (10, 30)  # (connect, read) in seconds.
+
+# Patches in these states don't change anymore.
+FINISHED_STATUSES = {'success', 'succeeded', 'failed', 'aborted'}
+
+
+def read_credentials(path=None):
+    """
+    Return the user, API key and REST API URL from the ~/.evergreen.yml written by `setup.macos`.
+    """
+    path = path if path is not None else config.EVG_CONFIG_FILE
+    try:
+        with open(str(path)) as fh:
+            evg_config = yaml.safe_load(fh)
+        return evg_config['user'], evg_config['api_key'], evg_config['api_server_host'].rstrip('/') + '/rest/v2'
+    except (OSError, KeyError, TypeError, yaml.YAMLError) as e:
+        get_logger().critical('Could not read Evergreen credentials from %s: %s', str(path), str(e))
+        raise InvalidConfigError()
+
+
+class PatchStatusCache(object):
+    """
+    Last known state of each patch: its API response, ETag and when it was fetched.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else config.EVG_STATUS_CACHE_FILE
+        self._entries = {}
+        self._dirty = False
+
+        try:
+            with open(str(self.path)) as fh:
+                self._entries = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            get_logger().warning('Ignoring corrupt Evergreen status cache %s: %s', str(self.path), str(e))
+
+    def get(self, patch_id):
+        return self._entries.get(patch_id)
+
+    def is_finished(self, patch_id):
+        entry = self._entries.get(patch_id)
+        return bool(entry) and entry['patch'].get('status') in FINISHED_STATUSES
+
+    def is_fresh(self, patch_id, now=None):
+        entry = self._entries.get(patch_id)
+        if not entry:
+            return False
+        if self.is_finished(patch_id):
+            return True
+        return (now if now is not None else time.time()) - entry['fetched'] < config.EVG_STATUS_MAX_AGE
+
+    def put(self, patch_id, patch, etag):
+        self._entries[patch_id] = {'patch': patch, 'etag': etag, 'fetched': time.time()}
+        self._dirty = True
+
+    def retain(self, patch_ids):
+        """
+        Forget patches that aren't in patch_ids, e.g. those of deleted tickets.
+        """
+        for patch_id in set(self._entries) - set(patch_ids):
+            del self._entries[patch_id]
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, json.dumps(self._entries))
+        self._dirty = False
+
+
+class _RateLimiter(object):
+    """
+    Spaces out the start of requests so no more than rate start per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PatchPoller(object):
+    """
+    Fetches the status of many patches concurrently from the Evergreen REST API.
+
+    Requests are limited to EVG_MAX_CONCURRENT_REQUESTS at a time and EVG_REQUESTS_PER_SECOND, are
+    conditional on the cached ETag, and are retried with exponential backoff on connection errors,
+    rate limiting and server errors. Blocking requests calls run in the default executor.
+    """
+
+    def __init__(self, user, api_key, api_url, cache):
+        self.api_url = api_url
+        self.cache = cache
+        self.session = requests.Session()
+        self.session.headers.update({'Api-User': user, 'Api-Key': api_key})
+        self._semaphore = None
+        self._limiter = None
+
+    def _get(self, patch_id, etag):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.session.get(f'{self.api_url}/patches/{patch_id}', headers=headers, timeout=TIMEOUT)
+
+    async def _fetch(self, patch_id):
+        entry = self.cache.get(patch_id)
+        etag = entry['etag'] if entry else None
+        loop = asyncio.get_event_loop()
+
+        delay = config.EVG_RETRY_DELAY
+        for attempt in range(config.EVG_MAX_RETRIES + 1):
+            retry_after = None
+            async with self._semaphore:
+                await self._limiter.wait()
+                try:
+                    res = await loop.run_in_executor(None, self._get, patch_id, etag)
+                except requests.RequestException as e:
+                    error = str(e)
+                else:
+                    if res.status_code == 304 and entry:
+                        self.cache.put(patch_id, entry['patch'], etag)
+                        return
+                    if res.status_code == 200:
+                        self.cache.put(patch_id, res.json(), res.headers.get('ETag'))
+                        return
+                    if res.status_code != 429 and res.status_code < 500:
+                        raise requests.HTTPError(f'{res.status_code} {res.reason}', response=res)
+                    error = f'{res.status_code} {res.reason}'
+                    retry_after = res.headers.get('Retry-After')
+
+            if attempt == config.EVG_MAX_RETRIES:
+                raise requests.HTTPError(error)
+            wait = float(retry_after) if retry_after and retry_after.isdigit() else delay * random.uniform(1, 1.5)
+            get_logger().debug('Fetching patch %s failed (%s), retrying in %.1fs', patch_id, error, wait)
+            await asyncio.sleep(wait)
+            delay *= 2
+
+    async def _poll(self, patch_ids, force):
+        self._semaphore = asyncio.Semaphore(config.EVG_MAX_CONCURRENT_REQUESTS)
+        self._limiter = _RateLimiter(config.EVG_REQUESTS_PER_SECOND)
+        stale = [patch_id for patch_id in dict.fromkeys(patch_ids) if force or not self.cache.is_fresh(patch_id)]
+        results = await asyncio.gather(*[self._fetch(patch_id) for patch_id in stale], return_exceptions=True)
+        return {patch_id: str(result) for patch_id, result in zip(stale, results) if result is not None}
+
+    def poll(self, patch_ids, force=False):
+        """
+        Update the cached status of the patches that aren't finished and weren't fetched recently, or
+        of all of them if force is set. Returns {patch id: error} for the patches that couldn't be fetched.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._poll(patch_ids, force))
+        finally:
+            loop.close()
@@ -0,0 +1,112 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import hashlib
+import json
+import os
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text, watcher
+from serverworkflowtool.utils.log import get_logger
+
+
+def file_digest(path):
+    with open(str(path), 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def formatter_key(name, *paths):
+    """
+    Identify a version of a formatter by the size and modification time of its executable and
+    config files, so a new formatter version or style config invalidates cached results without
+    running anything.
+    """
+    digest = hashlib.sha256(name.encode('utf-8'))
+    for path in paths:
+        path = os.path.realpath(str(path))
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        digest.update(repr((path, st and st.st_size, st and st.st_mtime_ns)).encode('utf-8'))
+    return f'{name}-{digest.hexdigest()[:16]}'
+
+
+def modified_files(ctx, base_branch):
+    """
+    Return the existing files changed relative to base_branch, excluding third party code.
+    """
+    # Deleted files show up in the diff too.
+    return [f for f in watcher.changed_files(ctx, base_branch)
+            if 'third_party' not in f and os.path.isfile(f)]
+
+
+def stale_files(cache, key, files):
+    """
+    Return the files that haven't been formatted by the formatter version identified by key.
+    """
+    return [f for f in files if not cache.is_formatted(key, file_digest(f))]
+
+
+class FormatCache(object):
+    """
+    Set of (formatter version, file content hash) pairs known to need no formatting.
+
+    Only entries for the latest version of each formatter are kept, up to max_entries each.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path if path is not None else config.FORMAT_CACHE_FILE
+        self.max_entries = max_entries if max_entries is not None else config.FORMAT_CACHE_MAX_ENTRIES
+        self._entries = {}
+        self._dirty = False
+
+        try:
+            with open(str(self.path)) as fh:
+                # Dicts are used as insertion-ordered sets, so the oldest entries can be dropped first.
+                self._entries = {k: dict.fromkeys(v) for k, v in json.load(fh).items()}
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            get_logger().warning('Ignoring corrupt format cache %s: %s', str(self.path), str(e))
+
+    def is_formatted(self, key, digest):
+        return digest in self._entries.get(key, ())
+
+    def add(self, key, digest):
+        if key not in self._entries:
+            # Results from older versions of the same formatter are no longer useful.
+            name = key.rsplit('-', 1)[0]
+            for old_key in [k for k in self._entries if k.rsplit('-', 1)[0] == name]:
+                del self._entries[old_key]
+            self._entries[key] = {}
+
+        entries = self._entries[key]
+        if digest not in entries:
+            entries[digest] = None
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        data = {key: list(digests)[-self.max_entries:] for key, digests in self._entries.items()}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, json.dumps(data))
+        self._dirty = False
@@ -28,29 +28,137 @@
 #  specific language governing permissions and limitations
 #  under the License.
 
+import concurrent.futures
+import os
+import re
+import time
+
 from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.utils.scheduler import clone_context
 
 ent_repo_rel_path = 'src/mongo/db/modules/enterprise'
 
+# (name, path relative to the mongo repo) of every repo a branch operation applies to.
+REPOS = [
+    ('community', None),
+    ('enterprise', ent_repo_rel_path),
+]
 
-def refresh_repos(ctx, branch):
-    original_branch = checkout_branch(ctx, branch, silent=True)
 
-    try:
-        ctx.run(f'git pull --rebase origin {branch}')
-        with ctx.cd(ent_repo_rel_path):
-            ctx.run(f'git pull --rebase origin {branch}')
+class CloneProgress(object):
+    """
+    Stream for the stderr of `git clone --progress` that logs each phase's progress every STEP percent,
+    prefixed with the repo's name, so the progress meters of concurrent clones don't garble each other.
+    """
+
+    STEP = 25
+
+    def __init__(self, name):
+        self.name = name
+        self._buffer = ''
+        self._last_step = None
+
+    def write(self, data):
+        # Progress meters are redrawn with carriage returns.
+        *lines, self._buffer = re.split(r'[\r\n]', self._buffer + data)
+        for line in lines:
+            self._log(line.strip())
+
+    def flush(self):
+        pass
+
+    def _log(self, line):
+        if not line:
+            return
+        match = re.match(r'(.+?):\s+(\d+)%', line)
+        if match:
+            step = (match.group(1), int(match.group(2)) // self.STEP)
+            if step == self._last_step:
+                return
+            self._last_step = step
+        get_logger().info('%s: %s', self.name, line)
+
+
+def _repo_context(ctx, rel_path):
+    repo_ctx = clone_context(ctx)
+    if rel_path:
+        repo_ctx.command_cwds.append(rel_path)
+    return repo_ctx
 
-        get_logger().info(f'Pulled latest changes from {branch} branch')
+
+def run_in_repos(ctx, func, rollback=None):
+    """
+    Run func(repo_ctx) in the community and enterprise repos concurrently. Returns the results in the
+    same order as REPOS.
+
+    If func fails in any repo, rollback(repo_ctx, result) is called for every repo where it succeeded,
+    so both repos are left in the same state, and the first error is re-raised.
+    """
+    repo_ctxs = [_repo_context(ctx, rel_path) for _, rel_path in REPOS]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(repo_ctxs)) as executor:
+            futures = [executor.submit(func, repo_ctx) for repo_ctx in repo_ctxs]
     finally:
-        checkout_branch(ctx, original_branch)
+        invalidate_cache()
+
+    errors = [(name, future.exception()) for (name, _), future in zip(REPOS, futures) if future.exception()]
+    if not errors:
+        return [future.result() for future in futures]
+
+    for name, exc in errors:
+        get_logger().error('Git operation failed in the %s repo: %s', name, str(exc))
+
+    if rollback:
+        for (name, _), repo_ctx, future in zip(REPOS, repo_ctxs, futures):
+            if future.exception() is None:
+                get_logger().warning('Rolling back the %s repo', name)
+                try:
+                    rollback(repo_ctx, future.result())
+                except Exception as e:
+                    get_logger().error('Failed to roll back the %s repo: %s', name, str(e))
+                finally:
+                    invalidate_cache()
+
+    raise errors[0][1]
+
+
+def refresh_repos(ctx, branch):
+    def refresh(repo_ctx):
+        if cur_branch_name(repo_ctx) == branch:
+            repo_ctx.run(f'git pull --rebase origin {branch}')
+            return
+
+        # Fast-forward the branch without checking it out. This only fails if it has local commits, in
+        # which case fall back to rebasing them onto the remote branch.
+        if repo_ctx.run(f'git fetch origin {branch}:{branch}', warn=True).failed:
+            original_branch = cur_branch_name(repo_ctx)
+            repo_ctx.run(f'git checkout {branch}')
+            try:
+                repo_ctx.run(f'git pull --rebase origin {branch}')
+            finally:
+                repo_ctx.run(f'git checkout {original_branch}')
+
+    run_in_repos(ctx, refresh)
+    get_logger().info(f'Pulled latest changes from {branch} branch')
+
+
+def _checkout(branch, create=False):
+    flag = '-B ' if create else ''
+
+    def checkout(repo_ctx):
+        original_branch = cur_branch_name(repo_ctx)
+        repo_ctx.run(f'git checkout {flag}{branch}')
+        return original_branch
+
+    return checkout
+
+
+def _restore_branch(repo_ctx, original_branch):
+    repo_ctx.run(f'git checkout {original_branch}')
 
 
 def checkout_branch(ctx, branch, silent=False):
-    original_branch = cur_branch_name(ctx)
-    ctx.run(f'git checkout {branch}')
-    with ctx.cd(ent_repo_rel_path):
-        ctx.run(f'git checkout {branch}')
+    original_branch = run_in_repos(ctx, _checkout(branch), rollback=_restore_branch)[0]
     if not silent:
         get_logger().info(f'Checked out existing branch {branch}')
 
@@ -58,12 +166,253 @@ def checkout_branch(ctx, branch, silent=False):
 
 
 def new_branch(ctx, branch):
-    ctx.run(f'git checkout -B {branch}')
-    with ctx.cd(ent_repo_rel_path):
-        ctx.run(f'git checkout -B {branch}')
+    run_in_repos(ctx, _checkout(branch, create=True), rollback=_restore_branch)
     get_logger().info(f'Created new branch {branch}')
 
 
+def _for_each_ref(repo_ctx, fmt, *options):
+    res = repo_ctx.run(f"git for-each-ref --format='{fmt}' {' '.join(options)} refs/heads/")
+    return [line.split('\t') for line in res.stdout.splitlines() if line]
+
+
+def _is_new(repo_ctx, branch):
+    """
+    Whether branch still points at the commit it was created at, according to its reflog. Reflog
+    entries expire after 90 days by default, so a branch without any isn't new.
+    """
+    dirs = _git_dirs(repo_ctx)
+    if not dirs:
+        return False
+    try:
+        with open(os.path.join(dirs[1], 'logs', 'refs', 'heads', branch)) as fh:
+            # Lines look like "<old sha> <new sha> <committer> <time> <tz>\t<message>".
+            commits = {line.split(' ', 2)[1] for line in fh if line.strip()}
+    except FileNotFoundError:
+        return False
+    return len(commits) == 1
+
+
+def stale_branches(repo_ctx, branches, base_branches, max_age_days, now=None):
+    """
+    Return {branch: (commit, reason)} for the given branches that exist in repo_ctx's repo and are
+    merged into one of base_branches, whose upstream branch was deleted, or whose last commit is
+    older than max_age_days, and the names of all local branches.
+
+    Branches that haven't moved since they were created are never stale, they may have just been
+    started. E.g. a branch started from a base branch that moved on since looks merged.
+    """
+    now = now if now is not None else time.time()
+
+    # All branches are listed in one pass, then the merged ones in another.
+    refs = _for_each_ref(repo_ctx, '%(refname:short)%09%(objectname)%09%(committerdate:unix)%09%(upstream:track)')
+    tips = {name: sha for name, sha, _, _ in refs}
+    bases = [b for b in base_branches if b in tips]
+    merged = {name for name, in _for_each_ref(repo_ctx, '%(refname:short)', *[f'--merged={b}' for b in bases])} \
+        if bases else set()
+    base_tips = {tips[b] for b in bases}
+
+    stale = {}
+    for name, sha, date, track in refs:
+        if name not in branches or name in base_branches or sha in base_tips:
+            continue
+        if name in merged:
+            reason = 'merged'
+        elif track == '[gone]':
+            reason = 'remote branch deleted'
+        elif now - int(date) > max_age_days * 24 * 60 * 60:
+            reason = f'no commits for {max_age_days} days'
+        else:
+            continue
+        # Only branches that look stale are checked, which is usually a handful.
+        if _is_new(repo_ctx, name):
+            continue
+        stale[name] = (sha, reason)
+    return stale, set(tips)
+
+
+def branch_tips(repo_ctx):
+    return dict(_for_each_ref(repo_ctx, '%(refname:short)%09%(objectname)'))
+
+
+def worktree_branches(repo_ctx):
+    """
+    Return {branch: path} for the branches checked out in repo_ctx's repo and its worktrees.
+    """
+    branches = {}
+    path = None
+    for line in repo_ctx.run('git worktree list --porcelain').stdout.splitlines():
+        if line.startswith('worktree '):
+            path = line[len('worktree '):]
+        elif line.startswith('branch refs/heads/'):
+            branches[line[len('branch refs/heads/'):]] = path
+    return branches
+
+
+def find_stale_branches(ctx, branches, base_branches, max_age_days, now=None):
+    """
+    Like stale_branches(), for the community and enterprise repos at once. A branch is stale if it's
+    stale in every repo that has it, and the community repo's commit and reason are reported. Also
+    returns the names of the community repo's branches.
+    """
+    results = run_in_repos(ctx, lambda repo_ctx: stale_branches(repo_ctx, branches, base_branches, max_age_days, now))
+
+    stale = {}
+    kept = set()
+    for repo_stale, repo_branches in results:
+        kept.update(branch for branch in repo_branches if branch in branches and branch not in repo_stale)
+        for branch, info in repo_stale.items():
+            stale.setdefault(branch, info)
+    return {branch: info for branch, info in stale.items() if branch not in kept}, results[0][1]
+
+
+def delete_branches(repo_ctx, branches):
+    """
+    Delete those of the branches that exist in repo_ctx's repo with a single command. Returns the
+    ones that couldn't be deleted, e.g. because they are checked out in a worktree.
+    """
+    existing = [name for name, in _for_each_ref(repo_ctx, '%(refname:short)') if name in branches]
+    if not existing:
+        return set()
+
+    # git deletes what it can and fails if any branch couldn't be deleted.
+    res = repo_ctx.run(f'git branch --delete --force {" ".join(existing)}', warn=True)
+    if res.ok:
+        return set()
+    get_logger().warning(res.stderr.strip())
+    return {name for name, in _for_each_ref(repo_ctx, '%(refname:short)') if name in branches}
+
+
+# Per-invocation cache of git metadata read directly from .git directories. It must be invalidated by
+# anything that may change branches or refs.
+_metadata_cache = {}
+
+
+def invalidate_cache():
+    _metadata_cache.clear()
+
+
+def _cached(key, func):
+    if key not in _metadata_cache:
+        _metadata_cache[key] = func()
+    return _metadata_cache[key]
+
+
+def _read_file(path):
+    with open(path) as fh:
+        return fh.read().strip()
+
+
+def _find_git_dirs(path):
+    """
+    Return (git dir, common dir) of the repo containing path, or None if it isn't in a repo.
+
+    The common dir differs from the git dir in linked worktrees, where .git is a file pointing to a
+    per-worktree git dir that only holds HEAD, and branches live in the main repo's git dir.
+    """
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            content = _read_file(dot_git)
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+            break
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        common_dir = os.path.normpath(os.path.join(git_dir, _read_file(commondir_file)))
+
+    return git_dir, common_dir
+
+
+def _packed_refs(common_dir):
+    refs = {}
+    try:
+        with open(os.path.join(common_dir, 'packed-refs')) as fh:
+            for line in fh:
+                # Skip the header and peeled tag lines.
+                if line.startswith(('#', '^')):
+                    continue
+                sha, _, name = line.strip().partition(' ')
+                refs[name] = sha
+    except FileNotFoundError:
+        pass
+    return refs
+
+
+def _resolve(git_dir, common_dir, ref, depth=0):
+    """
+    Resolve a full ref name (or HEAD) to a commit sha. Returns None if it doesn't exist.
+    """
+    if depth > 5:
+        return None
+
+    # HEAD is per-worktree, everything else is shared.
+    loose = os.path.join(git_dir if ref == 'HEAD' else common_dir, ref)
+    if os.path.isfile(loose):
+        content = _read_file(loose)
+        if content.startswith('ref:'):
+            return _resolve(git_dir, common_dir, content[len('ref:'):].strip(), depth + 1)
+        return content
+
+    return _cached(('packed-refs', common_dir), lambda: _packed_refs(common_dir)).get(ref)
+
+
+def _repo_path(ctx):
+    # ctx.cwd holds the directories from any enclosing ctx.cd() calls, with spaces escaped for the shell.
+    return os.path.join(os.getcwd(), os.path.expanduser(ctx.cwd.replace('\\ ', ' ')))
+
+
+def _git_dirs(ctx):
+    path = _repo_path(ctx)
+    return _cached(('git-dirs', path), lambda: _find_git_dirs(path))
+
+
+def git_dir(ctx):
+    """
+    Return the git dir of the repo ctx runs commands in, or None if it can't be found.
+    """
+    dirs = _git_dirs(ctx)
+    return dirs[0] if dirs else None
+
+
+def rev_parse(ctx, ref='HEAD'):
+    """
+    Return the commit sha of a branch, tag, remote branch, full ref name or HEAD.
+    """
+    dirs = _git_dirs(ctx)
+    if dirs is not None:
+        git_dir, common_dir = dirs
+        candidates = [ref] if ref == 'HEAD' or ref.startswith('refs/') else \
+            [f'refs/heads/{ref}', f'refs/tags/{ref}', f'refs/remotes/{ref}']
+        for candidate in candidates:
+            sha = _cached(('ref', git_dir, candidate), lambda: _resolve(git_dir, common_dir, candidate))
+            if sha:
+                return sha
+
+    return ctx.run(f'git rev-parse {ref}').stdout.strip()
+
+
 def cur_branch_name(ctx):
+    dirs = _git_dirs(ctx)
+    if dirs is not None:
+        head = _cached(('HEAD', dirs[0]), lambda: _read_file(os.path.join(dirs[0], 'HEAD')))
+        if not head.startswith('ref:'):
+            # Detached HEAD, same as `git rev-parse --abbrev-ref HEAD`.
+            return 'HEAD'
+        ref = head[len('ref:'):].strip()
+        if ref.startswith('refs/heads/'):
+            return ref[len('refs/heads/'):]
+
     res = ctx.run('git rev-parse --abbrev-ref HEAD')
     return res.stdout.strip()
@@ -19,6 +19,8 @@
 import logging
 import sys
 
+from serverworkflowtool.utils import trace
+
 _logger = None
 
 
@@ -46,7 +48,8 @@ def actionable(msg):
 def log_func(func, human_name):
     grey = lambda msg: f'\033[90m{msg}\033[0m'
     get_logger().info(grey('    ----- Starting Task: %s -----'), human_name)
-    retval = func()
+    with trace.span(human_name):
+        retval = func()
     get_logger().info(grey('    ----- Finished Task: %s -----'), human_name)
     get_logger().info('')
     get_logger().info('')
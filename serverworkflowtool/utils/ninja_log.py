@@ -0,0 +1,206 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import bisect
+import collections
+import heapq
+import os
+
+Entry = collections.namedtuple('Entry', ['start', 'end', 'mtime', 'output', 'cmdhash'])
+
+
+def iter_entries(path):
+    """
+    Yield (run index, Entry) for every line of a .ninja_log, reading it one line at a time.
+
+    Ninja appends an entry whenever a command finishes, so end times only decrease when a new build
+    starts. Commands with several outputs have one entry per output. Ninja occasionally rewrites the
+    log with only the latest entry of each target, in no particular order; builds before that point
+    can't be told apart.
+    """
+    with open(str(path), errors='replace') as fh:
+        header = fh.readline()
+        if not header.startswith('# ninja log v'):
+            raise ValueError(f'{path} is not a ninja log')
+
+        run = 0
+        prev_end = -1
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 4 or line.startswith('#'):
+                continue
+            try:
+                start, end = int(fields[0]), int(fields[1])
+            except ValueError:
+                continue
+
+            if end < prev_end:
+                run += 1
+            prev_end = end
+            yield run, Entry(start, end, fields[2], fields[3], fields[4] if len(fields) > 4 else None)
+
+
+def count_runs(path):
+    runs = 0
+    for run, _ in iter_entries(path):
+        runs = run + 1
+    return runs
+
+
+def _dir_key(output, depth):
+    parts = os.path.dirname(output).split('/')
+    return '/'.join(parts[:depth] if depth else parts) or '.'
+
+
+class RunStats(object):
+    """
+    Statistics about a single build, computed one entry at a time.
+
+    Memory use is proportional to the number of targets built in the run, not to the size of the log.
+    """
+
+    def __init__(self, top=20, depth=None):
+        self.top = top
+        self.depth = depth
+        self.targets = 0
+        self.cpu_ms = 0
+        self.first_start = None
+        self.last_end = 0
+        self.durations = {}
+        self.dir_ms = collections.Counter()
+        self.dir_targets = collections.Counter()
+        self._slowest = []
+        self._last_command = None
+
+        # Longest chain of targets where each one started after the previous one finished, an estimate
+        # of the critical path that doesn't need the dependency graph. Entries arrive in order of end
+        # time, so every possible predecessor of an entry has been seen by the time it arrives.
+        self._ends = []
+        self._best = []  # Index of the longest chain ending at or before each end time.
+        self._chains = []  # (chain length in ms, predecessor index, output, duration) per entry.
+
+    def add(self, entry):
+        command = (entry.start, entry.end, entry.cmdhash)
+        if command == self._last_command:
+            # Another output of the same command.
+            return
+        self._last_command = command
+
+        duration = entry.end - entry.start
+        self.targets += 1
+        self.cpu_ms += duration
+        self.first_start = entry.start if self.first_start is None else min(self.first_start, entry.start)
+        self.last_end = max(self.last_end, entry.end)
+        self.durations[entry.output] = duration
+
+        key = _dir_key(entry.output, self.depth)
+        self.dir_ms[key] += duration
+        self.dir_targets[key] += 1
+
+        item = (duration, entry.output)
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+        i = bisect.bisect_right(self._ends, entry.start) - 1
+        pred = self._best[i] if i >= 0 else None
+        length = duration + (self._chains[pred][0] if pred is not None else 0)
+        self._chains.append((length, pred, entry.output, duration))
+
+        index = len(self._chains) - 1
+        best = self._best[-1] if self._best else None
+        if best is None or length > self._chains[best][0]:
+            best = index
+        self._ends.append(entry.end)
+        self._best.append(best)
+
+    @property
+    def wall_ms(self):
+        return self.last_end - (self.first_start or 0)
+
+    def slowest(self):
+        """
+        Return (duration in ms, output) of the slowest targets, slowest first.
+        """
+        return sorted(self._slowest, reverse=True)
+
+    def critical_path(self):
+        """
+        Return (output, duration in ms) of the longest chain of sequential targets, first one first.
+        """
+        if not self._best:
+            return []
+        path = []
+        index = self._best[-1]
+        while index is not None:
+            _, pred, output, duration = self._chains[index]
+            path.append((output, duration))
+            index = pred
+        return path[::-1]
+
+    def slowest_dirs(self, n=None):
+        return self.dir_ms.most_common(n)
+
+
+def analyze(path, run=-1, top=20, depth=None):
+    """
+    Compute RunStats for one build in a .ninja_log. Negative run indexes count from the last build.
+    """
+    if run < 0:
+        run += count_runs(path)
+        if run < 0:
+            raise ValueError(f'{path} does not have that many builds')
+
+    stats = RunStats(top=top, depth=depth)
+    for index, entry in iter_entries(path):
+        if index == run:
+            stats.add(entry)
+        elif index > run:
+            break
+    return stats
+
+
+def diff(base, current, n=20):
+    """
+    Compare two RunStats. Returns the (delta ms, base ms, current ms, key) rows of the directories and
+    of the targets whose build time changed the most, largest change first.
+    """
+    def rows(base_totals, current_totals):
+        keys = set(base_totals) | set(current_totals)
+        changes = [(current_totals.get(k, 0) - base_totals.get(k, 0), base_totals.get(k, 0),
+                    current_totals.get(k, 0), k) for k in keys]
+        changes.sort(key=lambda row: abs(row[0]), reverse=True)
+        return [row for row in changes[:n] if row[0]]
+
+    return rows(base.dir_ms, current.dir_ms), rows(base.durations, current.durations)
+
+
+def parse_ccache_stats(text):
+    """
+    Return (hits, misses) from the output of `ccache --print-stats`, or None if it has no counters.
+    """
+    counters = {}
+    for line in text.splitlines():
+        key, _, value = line.partition('\t')
+        if value.strip().isdigit():
+            counters[key.strip()] = int(value)
+
+    if 'cache_miss' not in counters:
+        return None
+    return counters.get('direct_cache_hit', 0) + counters.get('preprocessed_cache_hit', 0), counters['cache_miss']
@@ -0,0 +1,186 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import concurrent.futures
+
+from invoke import Context, UnexpectedExit
+
+from serverworkflowtool.utils.log import get_logger, log_func
+
+
+class Step(object):
+    """
+    A single setup step and the names of the steps it depends on.
+
+    Interactive steps (anything that prompts the user) are always run serially in the main thread
+    before any other step, so prompts are never interleaved with output from background steps.
+
+    If fingerprint is given, it's called to compute a digest of the step's inputs without running
+    any commands, and outputs are the paths the step creates. Steps that skip work when their
+    outputs already exist should set clean, so their outputs are removed when their inputs change.
+    See `StepState`.
+    """
+
+    def __init__(self, name, human_name, func, deps=(), interactive=False, fingerprint=None, outputs=(),
+                 clean=False):
+        self.name = name
+        self.human_name = human_name
+        self.func = func
+        self.deps = list(deps)
+        self.interactive = interactive
+        self.fingerprint = fingerprint
+        self.outputs = list(outputs)
+        self.clean = clean
+
+
+def _sort_steps(steps):
+    """
+    Topologically sort steps, keeping the declared order among steps that are ready at the same time.
+    """
+    by_name = {}
+    for step in steps:
+        if step.name in by_name:
+            raise ValueError(f'Duplicate step name "{step.name}"')
+        by_name[step.name] = step
+
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f'Step "{step.name}" depends on unknown step "{dep}"')
+            if step.interactive and not by_name[dep].interactive:
+                raise ValueError(f'Interactive step "{step.name}" cannot depend on '
+                                 f'non-interactive step "{dep}"')
+
+    ordered = []
+    done = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if all(dep in done for dep in step.deps)]
+        if not ready:
+            raise ValueError('Cycle detected among steps: ' + ', '.join(s.name for s in remaining))
+        ordered.extend(ready)
+        done.update(step.name for step in ready)
+        remaining = [step for step in remaining if step.name not in done]
+
+    return ordered
+
+
+def split_jobs(total, n):
+    """
+    Split a budget of total jobs, e.g. CPU cores, between n concurrent tasks. Every task gets at
+    least one job, so the budget is exceeded when there are more tasks than jobs.
+    """
+    return [max(1, total // n + (1 if i < total % n else 0)) for i in range(n)]
+
+
+def clone_context(ctx):
+    """
+    Create a copy of ctx that can be used from another thread.
+
+    `Context.cd()` and `Context.prefix()` mutate the context they're called on, so work running
+    concurrently must not share one.
+    """
+    new_ctx = Context(config=ctx.config)
+    new_ctx.command_cwds.extend(ctx.command_cwds)
+    new_ctx.command_prefixes.extend(ctx.command_prefixes)
+    return new_ctx
+
+
+def _run_step(step, ctx, state):
+    if state is None or step.fingerprint is None:
+        return step.func(ctx)
+
+    digest = step.fingerprint()
+    if state.is_current(step, digest):
+        get_logger().info('Inputs unchanged since the last run, skipping')
+        return None
+
+    state.prepare(step, digest)
+    retval = step.func(ctx)
+    state.record(step, digest)
+    return retval
+
+
+def _summarize_error(exc):
+    if isinstance(exc, UnexpectedExit):
+        return f'`{exc.result.command}` exited with code {exc.result.exited}'
+    lines = str(exc).strip().splitlines()
+    return lines[0] if lines else type(exc).__name__
+
+
+def run_steps(ctx, steps, max_workers=None, keep_going=False, state=None):
+    """
+    Run interactive steps serially, then run the remaining steps concurrently as soon as their
+    dependencies have finished.
+
+    If a `StepState` is given, steps with a fingerprint are skipped if their inputs haven't changed
+    since they last finished.
+
+    If a step fails, no new steps are started; steps already running are allowed to finish and the
+    first error is re-raised. With keep_going, steps that don't depend on the failed step are still
+    run and a summary of all failures is logged before re-raising.
+    """
+    ordered = _sort_steps(steps)
+
+    for step in ordered:
+        if step.interactive:
+            log_func(lambda: _run_step(step, ctx, state), step.human_name)
+
+    pending = [step for step in ordered if not step.interactive]
+    done = set(step.name for step in ordered if step.interactive)
+    running = {}
+    errors = []
+    skipped = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if keep_going or not errors:
+                failed = set(step.name for step, _ in errors) | set(step.name for step in skipped)
+                for step in [step for step in pending if any(dep in failed for dep in step.deps)]:
+                    pending.remove(step)
+                    skipped.append(step)
+
+                ready = [step for step in pending if all(dep in done for dep in step.deps)]
+                for step in ready:
+                    pending.remove(step)
+                    step_ctx = clone_context(ctx)
+                    future = executor.submit(log_func, lambda s=step, c=step_ctx: _run_step(s, c, state),
+                                             step.human_name)
+                    running[future] = step
+
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    get_logger().error('Task "%s" failed: %s', step.human_name, str(exc))
+                    errors.append((step, exc))
+                else:
+                    done.add(step.name)
+
+    if errors:
+        skipped.extend(pending)
+        get_logger().error('%d of %d tasks failed:', len(errors), len(ordered))
+        for step, exc in errors:
+            get_logger().error('    %s: %s', step.human_name, _summarize_error(exc))
+        if skipped:
+            get_logger().error('Skipped tasks due to earlier failure: %s', ', '.join(s.human_name for s in skipped))
+        raise errors[0][1]
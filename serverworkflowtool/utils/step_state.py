@@ -0,0 +1,150 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text
+from serverworkflowtool.utils.log import get_logger
+
+
+def fingerprint(*parts):
+    """
+    Hash the JSON representation of parts, e.g. URLs, versions and file digests.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def requirements_digest(path, _seen=None):
+    """
+    Hash a pip requirements file along with the files it includes with `-r`. Missing files hash to
+    None, so creating them later changes the digest.
+    """
+    seen = _seen if _seen is not None else set()
+    path = os.path.realpath(str(path))
+    if path in seen:
+        return None
+    seen.add(path)
+
+    try:
+        with open(path, 'rb') as fh:
+            content = fh.read()
+    except FileNotFoundError:
+        return None
+
+    digest = hashlib.sha256(content)
+    for line in content.decode('utf-8', 'replace').splitlines():
+        line = line.strip()
+        for flag in ('-r ', '--requirement ', '--requirement='):
+            if line.startswith(flag):
+                included = os.path.join(os.path.dirname(path), line[len(flag):].strip())
+                digest.update(repr(requirements_digest(included, seen)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stat_digest(path):
+    """
+    Hash the names, sizes and modification times of a file or of the files in a directory tree,
+    without reading them. Returns None if it doesn't exist.
+    """
+    path = str(path)
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return fingerprint(st.st_size, st.st_mtime_ns)
+    if not os.path.isdir(path):
+        return None
+
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            full = os.path.join(dirpath, name)
+            try:
+                st = os.stat(full)
+            except FileNotFoundError:
+                continue
+            entries.append((os.path.relpath(full, path), st.st_size, st.st_mtime_ns))
+    return fingerprint(entries)
+
+
+def _remove(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.unlink(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+class StepState(object):
+    """
+    Manifest of the setup steps that have finished, keyed by step name, along with a fingerprint
+    of each step's inputs when it ran.
+
+    A step whose fingerprint is unchanged since it last ran, and whose outputs all still exist, can
+    be skipped without running anything.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else config.STEP_STATE_FILE
+        self._lock = threading.Lock()
+        self._steps = {}
+
+        try:
+            with open(str(self.path)) as fh:
+                self._steps = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            get_logger().warning('Ignoring corrupt setup state file %s: %s', str(self.path), str(e))
+
+    def is_current(self, step, digest):
+        record = self._steps.get(step.name)
+        return bool(record) and record['fingerprint'] == digest \
+            and all(os.path.lexists(str(p)) for p in step.outputs)
+
+    def prepare(self, step, digest):
+        """
+        Remove the outputs of a step that previously ran with different inputs, if it asks for that.
+        """
+        record = self._steps.get(step.name)
+        if not step.clean or not record or record['fingerprint'] == digest:
+            return
+
+        for path in step.outputs:
+            if os.path.lexists(str(path)):
+                get_logger().info('Inputs of "%s" changed, removing %s', step.human_name, str(path))
+                _remove(str(path))
+
+    def record(self, step, digest):
+        with self._lock:
+            self._steps[step.name] = {'fingerprint': digest, 'finished': time.time()}
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._steps = {}
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, json.dumps(self._steps, indent=2, sort_keys=True))
@@ -0,0 +1,114 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import collections
+import concurrent.futures
+import json
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text, git
+from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.utils.scheduler import clone_context
+
+# ahead and behind are None if the branch or its base branch doesn't exist in the repo.
+RepoStatus = collections.namedtuple('RepoStatus', ['exists', 'ahead', 'behind', 'dirty'])
+
+
+class AheadBehindCache(object):
+    """
+    Number of commits a branch is ahead of and behind its base branch, keyed by the commits both
+    point to, so entries are invalidated by any change to either ref.
+
+    Only the entries used since the cache was loaded are saved.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else config.STATUS_CACHE_FILE
+        self._entries = {}
+        self._used = {}
+
+        try:
+            with open(str(self.path)) as fh:
+                self._entries = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            get_logger().warning('Ignoring corrupt status cache %s: %s', str(self.path), str(e))
+
+    def get(self, branch_sha, base_sha):
+        key = f'{branch_sha}:{base_sha}'
+        if key in self._entries:
+            self._used[key] = self._entries[key]
+        return self._used.get(key)
+
+    def put(self, branch_sha, base_sha, ahead, behind):
+        self._used[f'{branch_sha}:{base_sha}'] = [ahead, behind]
+
+    def save(self):
+        if self._used == self._entries:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, json.dumps(self._used))
+        self._entries = dict(self._used)
+
+
+def _count(repo_ctx, branch_sha, base_sha):
+    res = clone_context(repo_ctx).run(f'git rev-list --left-right --count {branch_sha}...{base_sha}')
+    ahead, behind = res.stdout.split()
+    return int(ahead), int(behind)
+
+
+def _is_dirty(repo_ctx, path):
+    return bool(clone_context(repo_ctx).run(f'git -C {path} status --porcelain --untracked-files=no').stdout.strip())
+
+
+def repo_status(repo_ctx, tickets, cache):
+    """
+    Return {branch: RepoStatus} for the {branch: base branch} in tickets, in repo_ctx's repo.
+
+    All branches are read with one command. Commit counts come from the cache when neither branch
+    moved, and the remaining counts and the dirty state of checked out branches are computed
+    concurrently.
+    """
+    tips = git.branch_tips(repo_ctx)
+    checked_out = git.worktree_branches(repo_ctx)
+
+    pairs = {branch: (tips[branch], tips[base_branch]) for branch, base_branch in tickets.items()
+             if branch in tips and base_branch in tips}
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        # Branches that were just started point to the same commits, so count each pair once.
+        futures = {pair: executor.submit(_count, repo_ctx, *pair)
+                   for pair in set(pairs.values()) if cache.get(*pair) is None}
+        dirty = {branch: executor.submit(_is_dirty, repo_ctx, path)
+                 for branch, path in checked_out.items() if branch in tickets}
+
+        for pair, future in futures.items():
+            cache.put(*pair, *future.result())
+
+    status = {}
+    for branch in tickets:
+        ahead, behind = cache.get(*pairs[branch]) if branch in pairs else (None, None)
+        status[branch] = RepoStatus(branch in tips, ahead, behind, branch in dirty and dirty[branch].result())
+    return status
+
+
+def collect(ctx, tickets, cache):
+    """
+    Return the statuses of the {branch: base branch} in tickets for each repo in git.REPOS.
+    """
+    return git.run_in_repos(ctx, lambda repo_ctx: repo_status(repo_ctx, tickets, cache))
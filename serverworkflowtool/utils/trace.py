@@ -0,0 +1,170 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import contextlib
+import json
+import os
+import platform
+import resource
+import threading
+import time
+
+from invoke import Local, UnexpectedExit
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Collects timing events in the Chrome trace event format, which can be loaded in chrome://tracing
+    or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self._start_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+
+        # Child CPU time can only be measured for the whole process, so it is only attributed to a
+        # subprocess if no other subprocess ran at the same time.
+        self._active_runs = set()
+        self._overlapped_runs = set()
+        self._run_ids = 0
+
+    def _now_us(self):
+        return (time.perf_counter_ns() - self._start_ns) / 1000
+
+    def _add(self, event):
+        thread = threading.current_thread()
+        event['pid'] = os.getpid()
+        event['tid'] = thread.ident
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, cat, args=None):
+        """
+        Record the wall and CPU time of the current thread spent in the with block.
+        """
+        args = dict(args or {})
+        start = self._now_us()
+        start_cpu = time.thread_time()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            args['cpu_ms'] = round((time.thread_time() - start_cpu) * 1000, 3)
+            self._add({'name': name, 'cat': cat, 'ph': 'X', 'ts': start,
+                       'dur': self._now_us() - start, 'args': args})
+
+    @contextlib.contextmanager
+    def subprocess_span(self, command):
+        """
+        Like span(), but also records the CPU time used by the subprocesses started in the with block.
+        """
+        with self._lock:
+            self._run_ids += 1
+            run_id = self._run_ids
+            if self._active_runs:
+                self._overlapped_runs.update(self._active_runs)
+                self._overlapped_runs.add(run_id)
+            self._active_runs.add(run_id)
+            start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        with self.span(command, 'subprocess', {'command': command}) as args:
+            try:
+                yield args
+            finally:
+                with self._lock:
+                    end_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+                    self._active_runs.discard(run_id)
+                    overlapped = run_id in self._overlapped_runs
+                    self._overlapped_runs.discard(run_id)
+                if not overlapped:
+                    args['child_user_ms'] = round((end_usage.ru_utime - start_usage.ru_utime) * 1000, 3)
+                    args['child_sys_ms'] = round((end_usage.ru_stime - start_usage.ru_stime) * 1000, 3)
+
+    def to_json(self):
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in thread_names.items()]
+        return {
+            'traceEvents': metadata + sorted(events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms',
+            # Identifies the machine, so traces from different workstations can be compared.
+            'otherData': {
+                'hostname': platform.node(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+            },
+        }
+
+    def write(self, path):
+        with open(str(path), 'w') as fh:
+            json.dump(self.to_json(), fh)
+
+
+def enable():
+    global _tracer
+
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+
+    _tracer = None
+
+
+def span(name, cat='task', args=None):
+    """
+    Record the with block as a trace event if tracing is enabled; does nothing otherwise.
+    """
+    if _tracer is None:
+        return contextlib.nullcontext({})
+    return _tracer.span(name, cat, args)
+
+
+class TracingLocal(Local):
+    """
+    Runner for `ctx.run()` and `ctx.sudo()` that records every command as a trace event with its exit
+    status when tracing is enabled.
+    """
+
+    def run(self, command, **kwargs):
+        if _tracer is None:
+            return super().run(command, **kwargs)
+
+        with _tracer.subprocess_span(command) as args:
+            try:
+                result = super().run(command, **kwargs)
+            except UnexpectedExit as e:
+                args['exited'] = e.result.exited
+                raise
+            args['exited'] = result.exited
+            return result
@@ -0,0 +1,255 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import contextlib
+import fcntl
+import os
+import shlex
+import shutil
+import time
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import atomic_write_text, step_state
+from serverworkflowtool.utils.log import get_logger
+
+VENV_DIR_NAME = 'python3-venv'
+REQUIREMENTS_FILE = 'etc/pip/dev-requirements.txt'
+# Installed on top of the mongo repo's requirements.
+EXTRA_PACKAGES = ['regex']
+
+# Written to a template once it has been fully built, and to a checkout's venv with the digest it
+# was created from.
+_COMPLETE_MARKER = '.workflow-complete'
+_DIGEST_FILE = '.workflow-digest'
+
+# The venv's sys.path, read by gdbinit so gdb doesn't start Python to find the venv's packages. The
+# modification times of pyvenv.cfg and site-packages tell gdbinit when it's out of date. Keep in sync
+# with gdbinit.
+GDB_PATHS_FILE = '.gdb-sys-path.json'
+GDB_PATHS_SCRIPT = ("import json, os, site, sys; "
+                    "stamps = [os.path.join(sys.prefix, 'pyvenv.cfg')] + site.getsitepackages(); "
+                    "print(json.dumps({'prefix': sys.prefix, 'version': sys.version.split()[0], "
+                    "'paths': [p for p in sys.path if p], "
+                    "'stamps': {p: os.stat(p).st_mtime_ns for p in stamps if os.path.exists(p)}}))")
+
+
+def _uses_poetry(repo_dir):
+    return (repo_dir / 'poetry.lock').exists()
+
+
+def lock_digest(repo_dir, python='python3', extra_packages=EXTRA_PACKAGES):
+    """
+    Identify the packages a checkout's virtualenv needs by hashing its lock or requirements files and
+    the Python interpreter, without running anything.
+    """
+    python_path = shutil.which(python) or python
+    python_real = os.path.realpath(python_path)
+    if _uses_poetry(repo_dir):
+        inputs = [step_state.requirements_digest(repo_dir / 'poetry.lock'),
+                  step_state.requirements_digest(repo_dir / 'pyproject.toml')]
+    else:
+        inputs = [step_state.requirements_digest(repo_dir / REQUIREMENTS_FILE)]
+
+    return step_state.fingerprint(python_real, step_state.stat_digest(python_real), inputs,
+                                  sorted(extra_packages))[:16]
+
+
+def write_gdb_paths(ctx, venv):
+    res = ctx.run(f'{venv / "bin" / "python"} -c {shlex.quote(GDB_PATHS_SCRIPT)}')
+    # Files in cloned venvs are shared with the template, so never write to an existing one.
+    atomic_write_text(venv / GDB_PATHS_FILE, res.stdout)
+
+
+def _lock_file(path):
+    return path.with_name(path.name + '.lock')
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """
+    Hold an exclusive lock on path while building it, so concurrent setups of different
+    checkouts build each template only once.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = _lock_file(path)
+    while True:
+        fh = open(str(lock_file), 'a')
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            # The lock file may have been removed by _evict() while waiting for it.
+            if os.fstat(fh.fileno()).st_ino == os.stat(str(lock_file)).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        fh.close()
+
+    try:
+        yield
+    finally:
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        fh.close()
+
+
+def _install(ctx, repo_dir, venv, extra_packages):
+    """
+    Install repo_dir's requirements into venv, reusing the shared wheel and download caches.
+    """
+    venv_python = venv / 'bin' / 'python'
+    env = {
+        'VIRTUAL_ENV': str(venv),
+        'PATH': f'{venv / "bin"}:{os.environ.get("PATH", "")}',
+        'PIP_CACHE_DIR': str(config.PIP_CACHE_DIR),
+        'POETRY_CACHE_DIR': str(config.POETRY_CACHE_DIR),
+        'POETRY_VIRTUALENVS_CREATE': 'false',
+        # Needed for `poetry install` to work without a keyring, see the Virtual Workstation guide.
+        'PYTHON_KEYRING_BACKEND': 'keyring.backends.null.Keyring',
+    }
+    wheels = f'--find-links {config.WHEEL_CACHE_DIR}'
+    config.WHEEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    with ctx.cd(str(repo_dir)):
+        if _uses_poetry(repo_dir):
+            ctx.run(f'{venv_python} -m pip install {wheels} poetry=={config.POETRY_VERSION}', env=env)
+            ctx.run(f'{venv_python} -m poetry install --no-root --sync', env=env)
+        else:
+            # Build wheels into the shared wheel cache once, then install them without hitting the index.
+            ctx.run(f'{venv_python} -m pip wheel -r {REQUIREMENTS_FILE} -w {config.WHEEL_CACHE_DIR}', env=env)
+            ctx.run(f'{venv_python} -m pip install --no-index {wheels} -r {REQUIREMENTS_FILE}', env=env)
+
+        if extra_packages:
+            ctx.run(f'{venv_python} -m pip install {wheels} {" ".join(extra_packages)}', env=env)
+
+
+def _build_template(ctx, repo_dir, python, template, extra_packages):
+    get_logger().info('Building shared virtualenv %s, this only happens once per set of requirements', str(template))
+    if template.exists():
+        # Left over from an interrupted build.
+        shutil.rmtree(str(template))
+
+    ctx.run(f'{python} -m venv {template}')
+    _install(ctx, repo_dir, template, extra_packages)
+    (template / _COMPLETE_MARKER).touch()
+
+
+def _needs_rewrite(rel_path):
+    # Scripts and activate files in bin/ and pyvenv.cfg have the venv's absolute path baked in.
+    return rel_path == 'pyvenv.cfg' or rel_path.startswith('bin' + os.sep)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # E.g. the cache is on a different filesystem.
+        shutil.copy2(src, dst)
+
+
+def clone_venv(src, dst):
+    """
+    Recreate the virtualenv at src in dst. Files are hardlinked, except those that refer to the
+    venv's own path, which are copied with the path replaced.
+    """
+    src_bytes = os.fsencode(str(src))
+    dst_bytes = os.fsencode(str(dst))
+
+    for dirpath, dirnames, filenames in os.walk(str(src)):
+        rel_dir = os.path.relpath(dirpath, str(src))
+        out_dir = os.path.normpath(os.path.join(str(dst), rel_dir))
+        os.makedirs(out_dir, exist_ok=True)
+
+        # Symlinked directories, e.g. lib64 -> lib, are recreated as symlinks.
+        for name in list(dirnames):
+            if os.path.islink(os.path.join(dirpath, name)):
+                dirnames.remove(name)
+                filenames.append(name)
+
+        for name in filenames:
+            if name in (_COMPLETE_MARKER, _DIGEST_FILE):
+                continue
+            src_file = os.path.join(dirpath, name)
+            dst_file = os.path.join(out_dir, name)
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+
+            if os.path.islink(src_file):
+                os.symlink(os.readlink(src_file), dst_file)
+                continue
+
+            if _needs_rewrite(rel_path):
+                with open(src_file, 'rb') as fh:
+                    content = fh.read()
+                if src_bytes in content:
+                    with open(dst_file, 'wb') as fh:
+                        fh.write(content.replace(src_bytes, dst_bytes))
+                    shutil.copymode(src_file, dst_file)
+                    continue
+
+            _link_or_copy(src_file, dst_file)
+
+
+def _evict(keep):
+    """
+    Remove the least recently used templates beyond VENV_CACHE_MAX_ENTRIES. Venvs cloned from them
+    are unaffected as they hold their own links to the files.
+    """
+    templates = [p for p in config.VENV_CACHE_DIR.iterdir() if p.is_dir() and p != keep]
+    templates.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for template in templates[config.VENV_CACHE_MAX_ENTRIES - 1:]:
+        with _locked(template):
+            get_logger().info('Removing unused shared virtualenv %s', str(template))
+            shutil.rmtree(str(template), ignore_errors=True)
+            # Removed while still locked, so anyone waiting for it retries with a new lock file.
+            _lock_file(template).unlink()
+
+
+def provision(ctx, repo_dir, python='python3', extra_packages=EXTRA_PACKAGES):
+    """
+    Create repo_dir's virtualenv from a template shared by all checkouts with the same requirements,
+    building the template first if needed. An existing virtualenv is replaced if the requirements
+    changed since it was created.
+    """
+    digest = lock_digest(repo_dir, python, extra_packages)
+    venv = repo_dir / VENV_DIR_NAME
+
+    if venv.exists():
+        digest_file = venv / _DIGEST_FILE
+        if digest_file.exists() and digest_file.read_text().strip() == digest:
+            get_logger().info('Virtualenv %s is up to date', str(venv))
+            return
+        if not digest_file.exists():
+            get_logger().warning('Found existing Python3 virtualenv at %s, skipping creating a new one. Delete it '
+                                 'to use the shared virtualenv cache instead', str(venv))
+            _install(ctx, repo_dir, venv, extra_packages)
+            write_gdb_paths(ctx, venv)
+            return
+        get_logger().info('Requirements changed since %s was created, recreating it', str(venv))
+        shutil.rmtree(str(venv))
+
+    template = config.VENV_CACHE_DIR / digest
+    with _locked(template):
+        if not (template / _COMPLETE_MARKER).exists():
+            _build_template(ctx, repo_dir, python, template, extra_packages)
+
+        start = time.monotonic()
+        clone_venv(template, venv)
+        (venv / _DIGEST_FILE).write_text(digest)
+        # Used to find the least recently used templates.
+        os.utime(str(template))
+    write_gdb_paths(ctx, venv)
+
+    get_logger().info('Created %s from the shared virtualenv in %.1fs', str(venv), time.monotonic() - start)
+    _evict(keep=template)
@@ -0,0 +1,273 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import pathlib
+import select
+import struct
+import sys
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import InvalidConfigError, atomic_write_text, git
+from serverworkflowtool.utils.log import get_logger
+
+INDEX_FILE_NAME = 'workflow-changed-files.json'
+
+# Directories that are never watched: build output, virtualenvs and tool caches change constantly
+# and are not tracked by git.
+EXCLUDED_DIRS = {'.git', 'build', 'python3-venv', 'node_modules', '__pycache__', '.pytest_cache',
+                 '.mypy_cache', '.cache', '.scons'}
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_supported():
+    return sys.platform.startswith('linux')
+
+
+class _Inotify(object):
+    """
+    Minimal ctypes binding for Linux's inotify API.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_add_watch failed for {path}: {os.strerror(err)}')
+        return wd
+
+    def read_events(self, timeout):
+        """
+        Return a list of (watch descriptor, mask, name) tuples, waiting at most timeout seconds.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _index_path(ctx):
+    git_dir = git.git_dir(ctx)
+    return pathlib.Path(git_dir) / INDEX_FILE_NAME if git_dir else None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _git_changed_files(ctx, base_branch):
+    res = ctx.run(f'git diff --name-only {base_branch}')
+    return [f for f in res.stdout.strip().split('\n') if f]
+
+
+def read_index(ctx):
+    path = _index_path(ctx)
+    if not path:
+        return None
+    try:
+        with open(str(path)) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def changed_files(ctx, base_branch):
+    """
+    Return the files that differ from base_branch, possibly including some that were modified and
+    later reverted or that don't exist anymore.
+
+    Uses the watcher's index if it's running and is for the current branch and base branch commit,
+    otherwise asks git.
+    """
+    index = read_index(ctx)
+    if (index and pid_alive(index['pid'])
+            and index['branch'] == git.cur_branch_name(ctx)
+            and index['base_branch'] == base_branch
+            and index['base_sha'] == git.rev_parse(ctx, base_branch)):
+        get_logger().debug('Using changed files from the watcher index')
+        return index['files']
+
+    return _git_changed_files(ctx, base_branch)
+
+
+class ChangedFilesWatcher(object):
+    """
+    Keeps an index of the files modified on the current branch of the repo ctx runs commands in.
+
+    `git diff --name-only <base branch>` is run once on startup and whenever HEAD changes. After that,
+    every file written in the working tree is added to the index, which makes it a superset of what
+    git would report.
+    """
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.root = ctx.run('git rev-parse --show-toplevel').stdout.strip()
+        self.index_path = _index_path(ctx)
+        self.inotify = None
+        self.git_dir_wd = None
+        self.dirs = {}
+        self.files = set()
+        self.index = None
+        self.stopped = False
+
+    def _watch_tree(self, top):
+        """
+        Watch top and every directory below it, returning the files found.
+        """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            # Nested repos, e.g. the enterprise module, are not part of this repo's diff.
+            dirnames[:] = [d for d in dirnames if d not in EXCLUDED_DIRS
+                           and not os.path.exists(os.path.join(dirpath, d, '.git'))]
+            try:
+                self.dirs[self.inotify.add_watch(dirpath, _WATCH_MASK)] = dirpath
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # An index missing changes in unwatched directories would be wrong, so give up.
+                    get_logger().critical('Ran out of inotify watches after watching %d directories. Raise the '
+                                          'limit with `sudo sysctl fs.inotify.max_user_watches=524288`, and add '
+                                          '`fs.inotify.max_user_watches=524288` to /etc/sysctl.conf to keep it',
+                                          len(self.dirs))
+                    raise InvalidConfigError()
+                if e.errno != errno.ENOENT:
+                    get_logger().warning(str(e))
+            found.extend(os.path.join(dirpath, f) for f in filenames)
+        return found
+
+    def _save(self):
+        self.index['files'] = sorted(self.files)
+        atomic_write_text(self.index_path, json.dumps(self.index))
+
+    def reconcile(self):
+        """
+        Rebuild the index from git for the current branch.
+        """
+        git.invalidate_cache()
+        branch = git.cur_branch_name(self.ctx)
+        ticket_conf = config.reload_config().in_progress_tickets.get(branch)
+        base_branch = ticket_conf.base_branch if ticket_conf else None
+
+        self.index = {
+            'pid': os.getpid(),
+            'branch': branch,
+            'base_branch': base_branch,
+            'base_sha': git.rev_parse(self.ctx, base_branch) if base_branch else None,
+        }
+        self.files = set(_git_changed_files(self.ctx, base_branch)) if base_branch else set()
+        self._save()
+        get_logger().info('Tracking %d modified files on branch %s', len(self.files), branch)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            get_logger().warning('Missed some filesystem events, rebuilding the index')
+            self.reconcile()
+            return False
+
+        if wd == self.git_dir_wd:
+            if name == 'HEAD':
+                self.reconcile()
+            return False
+
+        dirpath = self.dirs.get(wd)
+        if dirpath is None or not name:
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            return False
+
+        path = os.path.join(dirpath, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and name not in EXCLUDED_DIRS:
+                paths = self._watch_tree(path)
+            else:
+                return False
+        else:
+            paths = [path]
+
+        new = {os.path.relpath(p, self.root) for p in paths} - self.files
+        self.files.update(new)
+        return bool(new)
+
+    def run(self, poll_interval=1.0):
+        self.inotify = _Inotify()
+        try:
+            self.git_dir_wd = self.inotify.add_watch(git.git_dir(self.ctx), IN_MOVED_TO | IN_CLOSE_WRITE)
+            self._watch_tree(self.root)
+            get_logger().info('Watching %d directories under %s', len(self.dirs), self.root)
+            self.reconcile()
+
+            while not self.stopped:
+                changed = False
+                for wd, mask, name in self.inotify.read_events(poll_interval):
+                    changed = self._handle(wd, mask, name) or changed
+                # Only files that weren't in the index before cause a write.
+                if changed:
+                    self._save()
+        finally:
+            self.inotify.close()
+            if self.index_path.exists():
+                self.index_path.unlink()
+
+    def stop(self):
+        self.stopped = True
@@ -17,14 +17,19 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import re
+
 import setuptools
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
+with open("serverworkflowtool/__init__.py", "r") as fh:
+    version = re.search(r"^__version__ = '(.*)'$", fh.read(), re.MULTILINE).group(1)
+
 setuptools.setup(
     name="server_workflow_tool",
-    version="1.0.1",
+    version=version,
     description="MongoDB Server Team Workflow Tool",
     long_description=long_description,
     long_description_content_type="text/markdown",
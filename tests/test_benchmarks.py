@@ -0,0 +1,58 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import serverworkflowtool.config as config
+from benchmarks import __main__ as bench
+from benchmarks.harness import BENCHMARKS, compare
+
+
+class BenchmarksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # The config benchmarks point the config module at their own files.
+        self.original_paths = config.CONFIG_FILE, config.LEGACY_CONFIG_FILE
+
+    def tearDown(self) -> None:
+        config.CONFIG_FILE, config.LEGACY_CONFIG_FILE = self.original_paths
+        config._ConfigImpl.instance = None
+
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'results.json')
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(bench.main(['--scale', 'small', '--repeat', '1', '--min-time', '0',
+                                             '--output', path, 'build', 'config', 'format', 'git']), 0)
+            with open(path) as fh:
+                results = json.load(fh)
+
+        expected = [name for name, (group, _) in BENCHMARKS.items() if group != 'startup']
+        self.assertCountEqual(results['results'], expected)
+        for result in results['results'].values():
+            self.assertEqual(result['runs'], 1)
+            self.assertGreater(result['median'], 0)
+
+        slower = {'results': {k: dict(v, median=v['median'] * 2) for k, v in results['results'].items()}}
+        self.assertEqual({row[4] for row in compare(results, slower)}, {'slower'})
+        self.assertEqual({row[4] for row in compare(slower, results)}, {'faster'})
@@ -0,0 +1,138 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import os
+import time
+from unittest import mock
+
+import serverworkflowtool.config as config
+from serverworkflowtool.utils import build_cache, git
+from tests.test_git import GitTestCase, _git
+
+
+class BuildCacheTest(GitTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.original_cache_dir = config.BUILD_FILES_CACHE_DIR
+        config.BUILD_FILES_CACHE_DIR = self.mongo.parent / 'cache'
+
+        (self.mongo / 'SConstruct').write_text('SConscript("src/SConscript")\n')
+        (self.mongo / 'src').mkdir(exist_ok=True)
+        (self.mongo / 'src' / 'SConscript').write_text('env.Library("base", ["a.cpp"])\n')
+        (self.mongo / 'src' / 'a.cpp').write_text('int a;\n')
+        # The fixture excludes src/ to hide the enterprise module, add the files explicitly.
+        _git(self.mongo, 'add', '-f', 'SConstruct', 'src/SConscript', 'src/a.cpp')
+        _git(self.mongo, 'commit', '-q', '-m', 'add build files')
+
+    def tearDown(self) -> None:
+        config.BUILD_FILES_CACHE_DIR = self.original_cache_dir
+        super().tearDown()
+
+    def generate(self, content):
+        # Make sure the generated files are newer than the build inputs.
+        time.sleep(0.01)
+        for f in build_cache.BUILD_FILES:
+            (self.mongo / f).write_text(content)
+
+    def build_files(self):
+        return {(self.mongo / f).read_text() for f in build_cache.BUILD_FILES}
+
+    def digest(self):
+        return build_cache.inputs_digest(self.ctx, self.mongo)
+
+    def test_digest_ignores_source_content(self):
+        before = self.digest()
+        (self.mongo / 'src' / 'a.cpp').write_text('int b;\n')
+        self.assertEqual(self.digest(), before)
+
+        (self.mongo / 'src' / 'SConscript').write_text('env.Library("base", ["a.cpp", "b.cpp"])\n')
+        self.assertNotEqual(self.digest(), before)
+
+    def test_digest_includes_file_names(self):
+        before = self.digest()
+        (self.mongo / 'src' / 'b.cpp').write_text('int b;\n')
+        _git(self.mongo, 'add', '-f', 'src/b.cpp')
+        self.assertNotEqual(self.digest(), before)
+
+        # Files tracked in the enterprise module count too.
+        before = self.digest()
+        (self.enterprise / 'ent.cpp').write_text('int e;\n')
+        _git(self.enterprise, 'add', 'ent.cpp')
+        self.assertNotEqual(self.digest(), before)
+
+    def test_stale_files_are_not_saved(self):
+        self.assertFalse(build_cache.save(self.ctx, self.mongo))
+
+        self.generate('generated')
+        time.sleep(0.01)
+        (self.mongo / 'src' / 'SConscript').write_text('env.Library("base", ["a.cpp", "b.cpp"])\n')
+        self.assertFalse(build_cache.save(self.ctx, self.mongo))
+
+    def switch_branch(self, branch, create=False):
+        # What running helpers.build-files before and after checking out a branch does.
+        build_cache.save(self.ctx, self.mongo)
+        if create:
+            git.new_branch(self.ctx, branch)
+        else:
+            git.checkout_branch(self.ctx, branch)
+        return build_cache.restore(self.ctx, self.mongo)
+
+    def test_restored_after_checkout(self):
+        self.switch_branch('SERVER-1', create=True)
+        self.generate('master build files')
+
+        # A branch with different build inputs.
+        self.switch_branch('SERVER-2', create=True)
+        (self.mongo / 'src' / 'b.cpp').write_text('int b;\n')
+        _git(self.mongo, 'add', '-f', 'src/b.cpp')
+        _git(self.mongo, 'commit', '-q', '-m', 'add b.cpp')
+        self.assertFalse(build_cache.restore(self.ctx, self.mongo))
+        self.generate('SERVER-2 build files')
+
+        self.assertTrue(self.switch_branch('SERVER-1'))
+        self.assertEqual(self.build_files(), {'master build files'})
+        # The restored files are newer than anything the checkout touched.
+        newest = max(os.stat(str(self.mongo / f)).st_mtime for f in ('SConstruct', 'src/SConscript'))
+        self.assertGreaterEqual(os.stat(str(self.mongo / 'build.ninja')).st_mtime, newest)
+
+        self.assertTrue(self.switch_branch('SERVER-2'))
+        self.assertEqual(self.build_files(), {'SERVER-2 build files'})
+
+    def test_branch_operations_leave_build_files_alone(self):
+        self.generate('master build files')
+        git.new_branch(self.ctx, 'SERVER-1')
+        (self.mongo / 'src' / 'SConscript').write_text('# changed\n')
+        _git(self.mongo, 'commit', '-q', '-am', 'change the build')
+
+        with mock.patch.object(build_cache, '_tracked_files') as tracked_files:
+            git.checkout_branch(self.ctx, 'master')
+        tracked_files.assert_not_called()
+        self.assertFalse(build_cache._repo_cache_dir(self.mongo).exists())
+
+    def test_evicts_least_recently_used(self):
+        for i in range(config.BUILD_FILES_CACHE_MAX_ENTRIES + 2):
+            (self.mongo / 'src' / 'SConscript').write_text(f'# version {i}\n')
+            self.generate(f'build files {i}')
+            self.assertTrue(build_cache.save(self.ctx, self.mongo))
+            # Entries are ordered by modification time.
+            time.sleep(0.01)
+
+        entries = list(build_cache._repo_cache_dir(self.mongo).iterdir())
+        self.assertEqual(len(entries), config.BUILD_FILES_CACHE_MAX_ENTRIES)
+        self.assertTrue(build_cache.restore(self.ctx, self.mongo))
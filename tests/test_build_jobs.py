@@ -0,0 +1,151 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import logging
+import os
+import pathlib
+import socket
+import socketserver
+import tempfile
+import threading
+import unittest
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import build_jobs
+from serverworkflowtool.utils.log import get_logger
+
+GIB = 1024 ** 3
+
+# Formatted like the scheduler's listcs output, see scheduler.cpp in icecream.
+LISTCS = (' laptop (10.0.0.2:10245) [x86_64] speed=120.00 jobs=2/8 load=300\n'
+          ' builder (10.0.0.3:10245) [x86_64] speed=240.00 jobs=10/32 load=500\n'
+          ' noremote (10.0.0.4:10245) [x86_64] speed=100.00 jobs=0/0 load=0\n'
+          '200 done\n')
+
+
+class _Scheduler(socketserver.StreamRequestHandler):
+    """
+    Stand-in for the icecream scheduler's text interface.
+    """
+
+    def handle(self):
+        self.wfile.write(b'200-ICECC 1.3.1: 3s uptime, 2 hosts, 12 jobs in queue (12 total).\n'
+                         b'200 Use \'help\' for help and \'quit\' to quit.\n')
+        for line in self.rfile:
+            if line.strip() == b'listcs':
+                self.wfile.write(LISTCS.encode('utf-8'))
+            elif line.strip() == b'quit':
+                return
+
+
+class BuildJobsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def test_available_memory(self):
+        self.assertEqual(build_jobs._parse_meminfo('MemTotal: 16 kB\nMemAvailable:    8 kB\n'), 8 * 1024)
+        self.assertIsNone(build_jobs._parse_meminfo('MemTotal: 16 kB\n'))
+
+        vm_stat = ('Mach Virtual Memory Statistics: (page size of 16384 bytes)\n'
+                   'Pages free:                               10.\n'
+                   'Pages active:                            100.\n'
+                   'Pages inactive:                           20.\n'
+                   'Pages speculative:                         5.\n')
+        self.assertEqual(build_jobs._parse_vm_stat(vm_stat), 35 * 16384)
+
+    def test_plan_jobs(self):
+        # Memory bound: 12GiB fits 8 local compiles and 2 links.
+        self.assertEqual(build_jobs.plan_jobs(16, 12 * GIB), (8, 8, 2))
+        # Core bound.
+        self.assertEqual(build_jobs.plan_jobs(4, 64 * GIB), (4, 4, 4))
+        # At least one job of each kind, no matter how little memory is free.
+        self.assertEqual(build_jobs.plan_jobs(4, 0), (1, 1, 1))
+        # Idle icecream slots, limited by how many jobs the local cores can feed.
+        self.assertEqual(build_jobs.plan_jobs(4, 64 * GIB, 28), (16, 4, 4))
+        self.assertEqual(build_jobs.plan_jobs(4, 64 * GIB, 10), (10, 4, 4))
+        # A busy cluster doesn't reduce the local jobs.
+        self.assertEqual(build_jobs.plan_jobs(4, 64 * GIB, 1), (4, 4, 4))
+
+    def test_icecream_slots(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _Scheduler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.assertEqual(build_jobs.icecream_slots('127.0.0.1', server.server_address[1]), 28)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Nothing listens on a port that was just closed.
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.assertIsNone(build_jobs.icecream_slots('127.0.0.1', port))
+
+    def test_write_pool_depths(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / 'build.ninja'
+            original = f'pool {config.NINJA_LINK_POOL}\n  depth = 16\n\nbuild a: phony\n'
+            path.write_text(original)
+            out_dir = pathlib.Path(tmpdir) / 'out'
+            out_dir.mkdir()
+            with self.assertLogs('workflow', level='INFO') as logs:
+                pool_file = build_jobs.write_pool_depths(path, {config.NINJA_LINK_POOL: 2, 'missing': 3}, out_dir)
+
+            self.assertEqual(len(logs.output), 2)
+            self.assertIn(f'Limiting ninja pool {config.NINJA_LINK_POOL} to 2 jobs', logs.output[0])
+            self.assertIn('no pool named missing', logs.output[1])
+            self.assertEqual(pool_file, out_dir / 'build.ninja')
+            self.assertEqual(pool_file.read_text(), f'pool {config.NINJA_LINK_POOL}\n  depth = 2\n\nbuild a: phony\n')
+            # The generated file is left alone.
+            self.assertEqual(path.read_text(), original)
+
+    def test_builds_itself(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / 'build.ninja'
+            path.write_text('build a: phony\n')
+            self.assertFalse(build_jobs.builds_itself(path))
+            path.write_text('build a: phony\nbuild compile_commands.json build.ninja: REGENERATE SConstruct\n')
+            self.assertTrue(build_jobs.builds_itself(path))
+
+    def test_ninja_version(self):
+        self.assertEqual(build_jobs.ninja_version('1.13.2.git.kitware.jobserver-pipe-1\n'), (1, 13))
+        self.assertEqual(build_jobs.ninja_version('1.9.0\n'), (1, 9))
+
+    def test_jobserver(self):
+        with tempfile.TemporaryDirectory() as tmpdir, build_jobs.Jobserver(tmpdir, 4) as jobserver:
+            self.assertEqual(jobserver.makeflags, f'-j4 --jobserver-auth=fifo:{jobserver.path}')
+            client = os.open(jobserver.path, os.O_RDWR | os.O_NONBLOCK)
+            try:
+                # The client holds one job itself.
+                self.assertEqual(len(os.read(client, 100)), 3)
+
+                jobserver.resize(2)
+                with self.assertRaises(BlockingIOError):
+                    os.read(client, 100)
+
+                # Two of the returned tokens are taken back.
+                os.write(client, b'+++')
+                jobserver.reclaim()
+                self.assertEqual(len(os.read(client, 100)), 1)
+
+                jobserver.resize(3)
+                self.assertEqual(len(os.read(client, 100)), 1)
+            finally:
+                os.close(client)
@@ -20,8 +20,10 @@
 import logging
 import os.path
 import pathlib
+import pickle
 import tempfile
 import unittest
+from unittest import mock
 
 import serverworkflowtool.config as config
 from serverworkflowtool.utils.log import get_logger
@@ -34,9 +36,17 @@ class ConfigTest(unittest.TestCase):
 
     def setUp(self) -> None:
         self.original_config_path = config.CONFIG_FILE
+        self.original_legacy_config_path = config.LEGACY_CONFIG_FILE
+        self.temp_dir = tempfile.TemporaryDirectory()
+        config.LEGACY_CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'legacy' / 'config.pickle'
+
+        config._ConfigImpl.instance = None
 
     def tearDown(self) -> None:
         config.CONFIG_FILE = self.original_config_path
+        config.LEGACY_CONFIG_FILE = self.original_legacy_config_path
+        config._ConfigImpl.instance = None
+        self.temp_dir.cleanup()
 
     def test_pickle(self):
         with tempfile.TemporaryDirectory('wb') as temp_dir:
@@ -59,3 +69,89 @@ class ConfigTest(unittest.TestCase):
 
             # Passwords should not be persisted.
             self.assertEqual(new_config._sudo_pwd, None)
+
+    def test_migrate_legacy_pickle(self):
+        legacy = config._ConfigImpl()
+        legacy._username = 'dummy_user'
+        legacy._sudo_pwd = 'old_sudo_pwd'
+        ticket = config.TicketConfig()
+        ticket.base_branch = 'master'
+        ticket.patch_ids.append('patch1')
+        legacy.in_progress_tickets['SERVER-1'] = ticket
+
+        # Version 1 config files held the whole pickled object, with a plain dict of tickets.
+        config.LEGACY_CONFIG_FILE.parent.mkdir()
+        with open(str(config.LEGACY_CONFIG_FILE), 'wb') as fh:
+            pickle.dump(legacy, fh)
+
+        config.CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'config.db'
+        migrated = config.Config()
+        self.assertEqual(migrated.username, 'dummy_user')
+        self.assertEqual(migrated.in_progress_tickets['SERVER-1'].patch_ids, ['patch1'])
+        self.assertFalse(config.LEGACY_CONFIG_FILE.exists())
+
+        config._ConfigImpl.instance = None
+        reloaded = config.Config()
+        self.assertEqual(reloaded.in_progress_tickets['SERVER-1'].base_branch, 'master')
+        self.assertEqual(reloaded._sudo_pwd, None)
+
+    def test_unchanged_config_is_not_written(self):
+        config.CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'config.db'
+
+        config.Config().dump()
+        self.assertFalse(config.CONFIG_FILE.exists())
+
+        config.Config()._username = 'dummy_user'
+        config.Config().dump()
+        config._ConfigImpl.instance = None
+
+        conf = config.Config()
+        conf.in_progress_tickets.get('SERVER-1')
+        with mock.patch.object(config._ConfigDB, 'write') as write:
+            conf.dump()
+        write.assert_not_called()
+
+    def test_concurrent_processes_keep_each_others_tickets(self):
+        config.CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'config.db'
+        config.Config()._username = 'dummy_user'
+        config.Config().dump()
+
+        # Simulate two workflow processes that loaded the config at the same time.
+        first = config._ConfigImpl.load()
+        second = config._ConfigImpl.load()
+        first.in_progress_tickets['SERVER-1'] = config.TicketConfig()
+        second.in_progress_tickets['SERVER-2'] = config.TicketConfig()
+        first.dump()
+        second.dump()
+
+        self.assertCountEqual(config._ConfigImpl.load().in_progress_tickets, ['SERVER-1', 'SERVER-2'])
+
+        # Deleting and modifying tickets only touches those tickets.
+        third = config._ConfigImpl.load()
+        third.in_progress_tickets.pop('SERVER-1')
+        third.in_progress_tickets['SERVER-2'].patch_ids.append('patch1')
+        third.dump()
+
+        tickets = config._ConfigImpl.load().in_progress_tickets
+        self.assertListEqual(list(tickets), ['SERVER-2'])
+        self.assertListEqual(tickets['SERVER-2'].patch_ids, ['patch1'])
+
+    def test_version(self):
+        config.CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'config.db'
+        config.Config()._username = 'dummy_user'
+        config.Config().dump()
+
+        settings = config._ConfigDB(config.CONFIG_FILE).settings()
+        self.assertEqual(pickle.loads(settings['_version']), config.CONFIG_VERSION)
+
+    def test_corrupt_database_is_moved_aside(self):
+        config.CONFIG_FILE = pathlib.Path(self.temp_dir.name) / 'config.db'
+        config.CONFIG_FILE.write_bytes(b'not a database' * 100)
+
+        conf = config.Config()
+        conf._username = 'dummy_user'
+        conf.dump()
+
+        self.assertEqual(config.CONFIG_FILE.with_name('config.db.bak').read_bytes(), b'not a database' * 100)
+        config._ConfigImpl.instance = None
+        self.assertEqual(config.Config().username, 'dummy_user')
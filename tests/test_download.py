@@ -0,0 +1,355 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import functools
+import hashlib
+import http.server
+import io
+import logging
+import os
+import pathlib
+import tarfile
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from serverworkflowtool import config
+from serverworkflowtool.config import DownloadConfig
+from serverworkflowtool.utils import ChecksumMismatchError, IncompleteDownloadError
+from serverworkflowtool.utils import download
+from serverworkflowtool.utils.log import get_logger
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _RangeHandler(_QuietHandler):
+    """
+    Adds single-range support to SimpleHTTPRequestHandler, and can drop connections part way through.
+    """
+
+    accept_ranges = True
+    # Close the connection after sending this many bytes of a response, if set.
+    drop_after = None
+    requested_ranges = []
+
+    def end_headers(self):
+        if self.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        super().end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if not self.accept_ranges or not range_header or not os.path.isfile(path):
+            return super().do_GET()
+
+        start, end = (int(x) for x in range_header[len('bytes='):].split('-'))
+        _RangeHandler.requested_ranges.append((start, end))
+        with open(path, 'rb') as fh:
+            fh.seek(start)
+            data = fh.read(end - start + 1)
+
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{os.path.getsize(path)}')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.drop_after is not None:
+            data = data[:self.drop_after]
+            self.close_connection = True
+        self.wfile.write(data)
+
+
+class LocalHTTPServerTestCase(unittest.TestCase):
+    """
+    Serves files from a temporary directory over HTTP on localhost.
+    """
+
+    handler = _QuietHandler
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.temp_dir.name)
+        self.served_dir = self.root / 'served'
+        self.served_dir.mkdir()
+
+        handler = functools.partial(self.handler, directory=str(self.served_dir))
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def serve(self, name, content):
+        (self.served_dir / name).write_bytes(content)
+        return f'http://127.0.0.1:{self.server.server_address[1]}/{name}'
+
+
+class DownloadCacheTest(LocalHTTPServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = download.DownloadCache(self.root / 'cache', max_bytes=1024 * 1024)
+
+    def cached(self, url):
+        return self.cache.get(url, validator=download._probe(url)[2])
+
+    def test_fetch_and_cache_hit(self):
+        url = self.serve('tool.tar.gz', b'tool contents')
+        mtime = (self.served_dir / 'tool.tar.gz').stat().st_mtime
+
+        blob = self.cache.fetch(url)
+        self.assertEqual(blob.read_bytes(), b'tool contents')
+        self.assertEqual(blob.name, hashlib.sha256(b'tool contents').hexdigest())
+
+        # Same Last-Modified: the second fetch must not download the file again.
+        self.serve('tool.tar.gz', b'tool CONTENTS')
+        os.utime(str(self.served_dir / 'tool.tar.gz'), (mtime, mtime))
+        self.assertEqual(self.cache.fetch(url), blob)
+
+    def test_changed_url_is_downloaded_again(self):
+        url = self.serve('evergreen', b'old release')
+        self.cache.fetch(url)
+
+        self.serve('evergreen', b'new release')
+        os.utime(str(self.served_dir / 'evergreen'), (1, 1))
+        self.assertEqual(self.cache.fetch(url).read_bytes(), b'new release')
+
+    def test_url_without_validator_is_not_reused(self):
+        url = self.serve('evergreen', b'binary')
+        self.cache.fetch(url)
+
+        self.assertIsNone(self.cache.get(url))
+        self.assertIsNone(self.cache.get(url, validator='"another-etag"'))
+
+    def test_checksum_lookup_ignores_url(self):
+        content = b'same bytes, different mirror'
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.cache.fetch(self.serve('a', content), sha256)
+
+        self.assertIsNotNone(self.cache.get('http://127.0.0.1:1/elsewhere', sha256))
+
+    def test_checksum_mismatch(self):
+        url = self.serve('tool', b'tampered')
+
+        with self.assertRaises(ChecksumMismatchError):
+            self.cache.fetch(url, hashlib.sha256(b'original').hexdigest())
+
+        self.assertIsNone(self.cached(url))
+        self.assertListEqual(list(self.cache.tmp_dir.iterdir()), [])
+
+    def test_lru_eviction(self):
+        self.cache.max_bytes = 250
+        urls = [self.serve(str(i), bytes([i]) * 100) for i in range(3)]
+
+        self.cache.fetch(urls[0])
+        self.cache.fetch(urls[1])
+        os.utime(str(self.cached(urls[1])), (0, 0))
+        os.utime(str(self.cached(urls[0])))  # urls[0] is now the most recently used.
+        self.cache.fetch(urls[2])
+
+        self.assertIsNotNone(self.cached(urls[0]))
+        self.assertIsNone(self.cached(urls[1]))
+        self.assertIsNotNone(self.cached(urls[2]))
+
+    def test_no_eviction_while_in_use(self):
+        self.cache.max_bytes = 150
+        first = self.cache.fetch(self.serve('a', b'a' * 100))
+
+        with self.cache.using():
+            self.cache.fetch(self.serve('b', b'b' * 100))
+            self.assertTrue(first.exists())
+
+        self.cache.evict()
+        self.assertFalse(first.exists())
+
+    def test_remote_validator(self):
+        url = self.serve('evergreen', b'binary')
+        os.utime(str(self.served_dir / 'evergreen'), (0, 0))
+        self.assertEqual(download.remote_validator(url), 'Thu, 01 Jan 1970 00:00:00 GMT')
+
+        self.assertIsNone(download.remote_validator(url + '.missing'))
+        self.assertIsNone(download.remote_validator('http://127.0.0.1:1/evergreen'))
+
+    def test_install(self):
+        url = self.serve('evergreen', b'binary')
+        dest = self.root / 'bin' / 'evergreen'
+
+        download.install(DownloadConfig(url), dest, cache=self.cache)
+
+        self.assertEqual(dest.read_bytes(), b'binary')
+        self.assertListEqual([p.name for p in dest.parent.iterdir()], ['evergreen'])
+
+
+def _make_tarball(top_dir, files, compression='xz'):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=f'w:{compression}') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(f'{top_dir}/{name}')
+            info.size = len(content)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+class ExtractTarballTest(LocalHTTPServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = download.DownloadCache(self.root / 'cache')
+        self.bin_dir = self.root / 'bin'
+
+    def test_streaming_extract(self):
+        for compression in ('xz', 'gz'):
+            with self.subTest(compression=compression):
+                archive = _make_tarball('clang+llvm', {'bin/clang-format': b'#!/bin/sh\n'}, compression)
+                url = self.serve(f'llvm.tar.{compression}', archive)
+                dest = self.bin_dir / f'llvm-{compression}'
+
+                download.extract_tarball(DownloadConfig(url), 'clang+llvm', dest, cache=self.cache)
+
+                self.assertEqual((dest / 'bin' / 'clang-format').read_bytes(), b'#!/bin/sh\n')
+                self.assertTrue(os.access(str(dest / 'bin' / 'clang-format'), os.X_OK))
+
+        # Neither the archive nor temp directories are left behind.
+        self.assertCountEqual([p.name for p in self.bin_dir.iterdir()], ['llvm-xz', 'llvm-gz'])
+        self.assertIsNone(self.cache.get(url, validator=download._probe(url)[2]))
+
+    def test_checksum_mismatch_leaves_nothing_behind(self):
+        url = self.serve('eslint.tar.gz', _make_tarball('eslint-Darwin-x86_64', {'eslint': b'x'}, 'gz'))
+        dc = DownloadConfig(url, sha256=hashlib.sha256(b'something else').hexdigest())
+
+        with self.assertRaises(ChecksumMismatchError):
+            download.extract_tarball(dc, 'eslint-Darwin-x86_64', self.bin_dir / 'eslint', cache=self.cache)
+
+        self.assertListEqual(list(self.bin_dir.iterdir()), [])
+
+    def test_versioned_url_is_pinned_to_first_download(self):
+        url = self.serve('eslint.tar.gz', _make_tarball('eslint-Darwin-x86_64', {'eslint': b'x'}, 'gz'))
+        dc = DownloadConfig(url, versioned=True)
+        download.extract_tarball(dc, 'eslint-Darwin-x86_64', self.bin_dir / 'eslint', cache=self.cache)
+
+        self.serve('eslint.tar.gz', _make_tarball('eslint-Darwin-x86_64', {'eslint': b'y'}, 'gz'))
+        with self.assertRaises(ChecksumMismatchError):
+            download.extract_tarball(dc, 'eslint-Darwin-x86_64', self.bin_dir / 'eslint2', cache=self.cache)
+        self.assertFalse((self.bin_dir / 'eslint2').exists())
+
+    def test_extract_from_cache(self):
+        archive = _make_tarball('eslint-Darwin-x86_64', {'eslint': b'x'}, 'gz')
+        url = self.serve('eslint.tar.gz', archive)
+        mtime = (self.served_dir / 'eslint.tar.gz').stat().st_mtime
+        self.cache.fetch(url)
+        # The server still reports the cached version, so its current contents must not be read.
+        self.serve('eslint.tar.gz', b'not a tarball')
+        os.utime(str(self.served_dir / 'eslint.tar.gz'), (mtime, mtime))
+
+        download.extract_tarball(DownloadConfig(url), 'eslint-Darwin-x86_64', self.bin_dir / 'eslint', cache=self.cache)
+
+        self.assertEqual((self.bin_dir / 'eslint' / 'eslint').read_bytes(), b'x')
+
+
+class SegmentedDownloadTest(LocalHTTPServerTestCase):
+    handler = _RangeHandler
+
+    def setUp(self) -> None:
+        super().setUp()
+        _RangeHandler.accept_ranges = True
+        _RangeHandler.drop_after = None
+        _RangeHandler.requested_ranges = []
+        self.original_min_bytes = config.SEGMENTED_DOWNLOAD_MIN_BYTES
+        config.SEGMENTED_DOWNLOAD_MIN_BYTES = 0
+
+        self.content = os.urandom(1000)
+        self.url = self.serve('toolchain.tar.gz', self.content)
+        self.dest = self.root / 'toolchain.part'
+
+    def tearDown(self) -> None:
+        config.SEGMENTED_DOWNLOAD_MIN_BYTES = self.original_min_bytes
+        super().tearDown()
+
+    def test_segmented(self):
+        download.download_file(self.url, self.dest, segments=4)
+
+        self.assertEqual(self.dest.read_bytes(), self.content)
+        self.assertCountEqual(_RangeHandler.requested_ranges, [(0, 249), (250, 499), (500, 749), (750, 999)])
+        self.assertFalse(self.dest.with_name('toolchain.part.state').exists())
+
+    def test_resume(self):
+        mib = 1024 * 1024
+        content = os.urandom(4 * mib)
+        url = self.serve('large.tar.gz', content)
+
+        # Each segment is 2 MiB; drop the connections after 1.5 MiB.
+        _RangeHandler.drop_after = 3 * mib // 2
+        with self.assertRaises(IncompleteDownloadError):
+            download.download_file(url, self.dest, segments=2)
+        self.assertTrue(self.dest.with_name('toolchain.part.state').exists())
+
+        _RangeHandler.drop_after = None
+        _RangeHandler.requested_ranges = []
+        download.download_file(url, self.dest, segments=2)
+
+        self.assertEqual(self.dest.read_bytes(), content)
+        # Each segment resumed from somewhere after its start; exactly where depends on how much of the
+        # truncated response the HTTP client handed over before raising.
+        resumed = sorted(_RangeHandler.requested_ranges)
+        self.assertEqual(len(resumed), 2)
+        for (start, end), segment_start in zip(resumed, (0, 2 * mib)):
+            self.assertGreaterEqual(start, segment_start + mib)
+            self.assertEqual(end, segment_start + 2 * mib - 1)
+
+    def test_failed_single_stream_leaves_nothing_behind(self):
+        _RangeHandler.accept_ranges = False
+
+        with self.assertRaises(requests.HTTPError):
+            download.download_file(self.url + '.missing', self.dest, segments=4)
+        self.assertFalse(self.dest.exists())
+
+    def test_extract_large_archive_in_segments(self):
+        archive = _make_tarball('clang+llvm', {'bin/clang-format': os.urandom(4096)}, 'gz')
+        url = self.serve('llvm.tar.gz', archive)
+        cache = download.DownloadCache(self.root / 'cache')
+
+        download.extract_tarball(DownloadConfig(url), 'clang+llvm', self.root / 'llvm', cache=cache)
+
+        self.assertTrue((self.root / 'llvm' / 'bin' / 'clang-format').exists())
+        self.assertGreater(len(_RangeHandler.requested_ranges), 1)
+        self.assertListEqual(list(cache.tmp_dir.iterdir()), [])
+
+        # Large archives are kept in the cache, so extracting again doesn't download them.
+        _RangeHandler.requested_ranges = []
+        download.extract_tarball(DownloadConfig(url), 'clang+llvm', self.root / 'llvm2', cache=cache)
+        self.assertTrue((self.root / 'llvm2' / 'bin' / 'clang-format').exists())
+        self.assertListEqual(_RangeHandler.requested_ranges, [])
+
+    def test_fallback_without_range_support(self):
+        _RangeHandler.accept_ranges = False
+        download.download_file(self.url, self.dest, segments=4)
+
+        self.assertEqual(self.dest.read_bytes(), self.content)
+        self.assertListEqual(_RangeHandler.requested_ranges, [])
@@ -0,0 +1,158 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import http.server
+import json
+import logging
+import pathlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from serverworkflowtool import config
+from serverworkflowtool.utils import evergreen, InvalidConfigError
+from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.templates import evergreen_yaml_template
+
+
+class _EvergreenStub(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in for Evergreen's REST API. Serves server.patches, with ETags, and answers the first
+    server.rate_limited requests with 429.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('If-None-Match')))
+            rate_limited = server.rate_limited > 0
+            server.rate_limited -= 1
+
+        if self.headers.get('Api-User') != 'user' or self.headers.get('Api-Key') != 'key':
+            return self.send_error(401)
+        if rate_limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        patch_id = self.path.rsplit('/', 1)[-1]
+        if not self.path.startswith('/api/rest/v2/patches/') or patch_id not in server.patches:
+            return self.send_error(404)
+        status = server.patches[patch_id]
+        etag = f'"{patch_id}-{status}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps({'patch_id': patch_id, 'status': status}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PatchPollerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = pathlib.Path(temp_dir.name)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _EvergreenStub)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.rate_limited = 0
+        self.server.patches = {'p1': 'started', 'p2': 'success', 'p3': 'created'}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # The same file `setup.macos` writes, pointing at the stub.
+        evg_yml = self.root / 'evergreen.yml'
+        evg_yml.write_text(evergreen_yaml_template.format('user', 'key').replace(
+            'https://evergreen.mongodb.com/api', f'http://127.0.0.1:{self.server.server_address[1]}/api'))
+        self.credentials = evergreen.read_credentials(evg_yml)
+
+        for name, value in [('EVG_RETRY_DELAY', 0.01), ('EVG_REQUESTS_PER_SECOND', 1000)]:
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def poll(self, patch_ids, **kwargs):
+        cache = evergreen.PatchStatusCache(self.root / 'cache.json')
+        errors = evergreen.PatchPoller(*self.credentials, cache).poll(patch_ids, **kwargs)
+        cache.save()
+        requests = sorted(self.server.requests, key=lambda r: r[0])
+        self.server.requests.clear()
+        return cache, errors, requests
+
+    def test_read_credentials(self):
+        self.assertEqual(self.credentials[:2], ('user', 'key'))
+        with self.assertRaises(InvalidConfigError):
+            evergreen.read_credentials(self.root / 'missing.yml')
+
+    def test_poll(self):
+        cache, errors, requests = self.poll(['p1', 'p2', 'p3', 'missing', 'p1'])
+        self.assertEqual(cache.get('p1')['patch']['status'], 'started')
+        self.assertTrue(cache.is_finished('p2'))
+        self.assertIn('404', errors.pop('missing'))
+        self.assertDictEqual(errors, {})
+        self.assertEqual(len(requests), 4)
+
+        # Everything is fresh or finished.
+        _, _, requests = self.poll(['p1', 'p2', 'p3'])
+        self.assertListEqual(requests, [])
+
+        # Unfinished patches are fetched again once they're old, conditionally on their ETag.
+        self.server.patches['p1'] = 'failed'
+        with mock.patch.object(config, 'EVG_STATUS_MAX_AGE', 0):
+            cache, errors, requests = self.poll(['p1', 'p2', 'p3'])
+        self.assertListEqual(requests, [('/api/rest/v2/patches/p1', '"p1-started"'),
+                                        ('/api/rest/v2/patches/p3', '"p3-created"')])
+        self.assertEqual(cache.get('p1')['patch']['status'], 'failed')
+        self.assertEqual(cache.get('p3')['patch']['status'], 'created')
+
+    def test_retries(self):
+        self.server.rate_limited = 3
+        cache, errors, requests = self.poll(['p1'])
+        self.assertDictEqual(errors, {})
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(cache.get('p1')['patch']['status'], 'started')
+
+        self.server.rate_limited = config.EVG_MAX_RETRIES + 1
+        _, errors, requests = self.poll(['p2'])
+        self.assertIn('429', errors['p2'])
+        self.assertEqual(len(requests), config.EVG_MAX_RETRIES + 1)
+
+    def test_retain(self):
+        cache, _, _ = self.poll(['p1', 'p2'])
+        cache.retain(['p2'])
+        cache.save()
+        cache = evergreen.PatchStatusCache(self.root / 'cache.json')
+        self.assertIsNone(cache.get('p1'))
+        self.assertIsNotNone(cache.get('p2'))
@@ -0,0 +1,83 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from serverworkflowtool.utils.format_cache import FormatCache, file_digest, formatter_key
+
+
+class FormatCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.temp_dir.name)
+        self.cache_file = self.root / 'cache' / 'format.json'
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        source = self.root / 'a.cpp'
+        source.write_text('int main() {}\n')
+
+        cache = FormatCache(self.cache_file)
+        self.assertFalse(cache.is_formatted('clang-format-1', file_digest(source)))
+        cache.add('clang-format-1', file_digest(source))
+        cache.save()
+
+        cache = FormatCache(self.cache_file)
+        self.assertTrue(cache.is_formatted('clang-format-1', file_digest(source)))
+        self.assertFalse(cache.is_formatted('eslint-1', file_digest(source)))
+
+        source.write_text('int main() { return 0; }\n')
+        self.assertFalse(cache.is_formatted('clang-format-1', file_digest(source)))
+
+    def test_new_formatter_version_replaces_old_entries(self):
+        cache = FormatCache(self.cache_file)
+        cache.add('clang-format-1', 'digest1')
+        cache.add('eslint-1', 'digest1')
+        cache.add('clang-format-2', 'digest2')
+        cache.save()
+
+        cache = FormatCache(self.cache_file)
+        self.assertFalse(cache.is_formatted('clang-format-1', 'digest1'))
+        self.assertTrue(cache.is_formatted('clang-format-2', 'digest2'))
+        self.assertTrue(cache.is_formatted('eslint-1', 'digest1'))
+
+    def test_max_entries(self):
+        cache = FormatCache(self.cache_file, max_entries=2)
+        for digest in ('digest1', 'digest2', 'digest3'):
+            cache.add('eslint-1', digest)
+        cache.save()
+
+        cache = FormatCache(self.cache_file)
+        self.assertFalse(cache.is_formatted('eslint-1', 'digest1'))
+        self.assertTrue(cache.is_formatted('eslint-1', 'digest3'))
+
+    def test_formatter_key_tracks_config_changes(self):
+        style = self.root / '.clang-format'
+        style.write_text('BasedOnStyle: Google\n')
+        key = formatter_key('clang-format', style)
+        self.assertEqual(formatter_key('clang-format', style), key)
+
+        st = style.stat()
+        os.utime(str(style), ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertNotEqual(formatter_key('clang-format', style), key)
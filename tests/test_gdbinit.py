@@ -0,0 +1,98 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from invoke import Config, Context
+
+from serverworkflowtool.utils import venv_cache
+
+GDBINIT = pathlib.Path(__file__).parent.parent / 'gdbinit'
+
+
+def _python_blocks():
+    return re.findall(r'^python\n(.*?)^end$', GDBINIT.read_text(), re.MULTILINE | re.DOTALL)
+
+
+class GdbinitTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.original_path = list(sys.path)
+        self.addCleanup(setattr, sys, 'path', self.original_path)
+
+    def run_block(self, index, gdb_module=None):
+        modules = {'gdb': gdb_module} if gdb_module else {}
+        with mock.patch.dict(sys.modules, modules), mock.patch('builtins.print'):
+            namespace = {}
+            exec(_python_blocks()[index], namespace)
+            return namespace
+
+    def test_venv_paths_are_cached(self):
+        venv = pathlib.Path(self.temp_dir.name) / venv_cache.VENV_DIR_NAME
+        subprocess.run([sys.executable, '-m', 'venv', '--without-pip', str(venv)], check=True)
+        ctx = Context(config=Config(overrides={'run': {'hide': True, 'in_stream': False}}))
+        venv_cache.write_gdb_paths(ctx, venv)
+
+        cache = json.loads((venv / venv_cache.GDB_PATHS_FILE).read_text())
+        self.assertEqual(cache['prefix'], str(venv))
+        site_packages = [p for p in cache['paths'] if p.startswith(str(venv))]
+        self.assertTrue(site_packages)
+
+        env = {'PATH': f'{venv / "bin"}:{os.environ["PATH"]}', 'VIRTUAL_ENV': str(venv)}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch('subprocess.check_output', side_effect=AssertionError('started python')):
+            self.run_block(0)
+        self.assertTrue(set(site_packages) <= set(sys.path))
+
+        # Installing packages invalidates the cache.
+        sys.path[:] = self.original_path
+        os.utime(site_packages[0], ns=(0, 0))
+        with mock.patch.dict(os.environ, env):
+            self.run_block(0)
+        self.assertTrue(set(site_packages) <= set(sys.path))
+        self.assertNotEqual(json.loads((venv / venv_cache.GDB_PATHS_FILE).read_text())['stamps'], cache['stamps'])
+
+    def test_boost_printers_are_loaded_lazily(self):
+        printer = object()
+        gdb = types.ModuleType('gdb')
+        gdb.pretty_printers = []
+        gdb.default_visualizer = lambda val: next(filter(None, (f(val) for f in gdb.pretty_printers)), None)
+
+        boost = types.ModuleType('boost')
+        boost.register_printers = mock.Mock(side_effect=lambda boost_version: gdb.pretty_printers.append(
+            lambda val: printer if val == 'boost::optional' else None))
+
+        with mock.patch.dict(sys.modules, {'boost': boost}):
+            self.run_block(1, gdb)
+            boost.register_printers.assert_not_called()
+            self.assertEqual(len(gdb.pretty_printers), 1)
+
+            self.assertIs(gdb.pretty_printers[0]('boost::optional'), printer)
+            boost.register_printers.assert_called_once()
+            self.assertIsNone(gdb.default_visualizer('int'))
+            self.assertEqual(len(gdb.pretty_printers), 1)
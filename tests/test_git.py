@@ -0,0 +1,254 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import logging
+import os
+import pathlib
+import subprocess
+import tempfile
+import time
+import unittest
+
+from invoke import Config, Context, UnexpectedExit
+
+from serverworkflowtool.utils import git
+from serverworkflowtool.utils.log import get_logger
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test', GIT_AUTHOR_EMAIL='test@example.com',
+               GIT_COMMITTER_NAME='test', GIT_COMMITTER_EMAIL='test@example.com')
+
+
+def _git(cwd, *args):
+    return subprocess.run(['git'] + list(args), cwd=str(cwd), env=GIT_ENV, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode().strip()
+
+
+def make_repo(path, remote_dir=None):
+    """
+    Create a git repo with one commit on master, optionally cloned from a new bare remote.
+    """
+    path.mkdir(parents=True)
+    if remote_dir is None:
+        _git(path, 'init', '-q', '-b', 'master')
+    else:
+        seed = remote_dir.with_name(remote_dir.name + '-seed')
+        make_repo(seed)
+        _git(seed.parent, 'clone', '-q', '--bare', str(seed), str(remote_dir))
+        _git(path.parent, 'clone', '-q', str(remote_dir), str(path))
+        return path
+    (path / 'README').write_text(path.name)
+    _git(path, 'add', 'README')
+    _git(path, 'commit', '-q', '-m', 'initial commit')
+    return path
+
+
+class GitTestCase(unittest.TestCase):
+    """
+    Sets up a mongo repo with the enterprise module nested inside it, both cloned from local bare repos.
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.temp_dir.name)
+
+        self.mongo = make_repo(root / 'mongo', remote_dir=root / 'remotes' / 'mongo.git')
+        self.enterprise = make_repo(self.mongo / git.ent_repo_rel_path,
+                                    remote_dir=root / 'remotes' / 'enterprise.git')
+        (self.mongo / '.git' / 'info' / 'exclude').write_text('src/\n')
+
+        self.ctx = Context(config=Config(overrides={'run': {'hide': True, 'in_stream': False}}))
+        git.invalidate_cache()
+        self.cwd = os.getcwd()
+        os.chdir(str(self.mongo))
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def branches(self):
+        return _git(self.mongo, 'rev-parse', '--abbrev-ref', 'HEAD'), \
+            _git(self.enterprise, 'rev-parse', '--abbrev-ref', 'HEAD')
+
+
+class MultiRepoTest(GitTestCase):
+    def test_new_and_checkout_branch(self):
+        git.new_branch(self.ctx, 'SERVER-1')
+        self.assertEqual(self.branches(), ('SERVER-1', 'SERVER-1'))
+
+        original = git.checkout_branch(self.ctx, 'master')
+        self.assertEqual(original, 'SERVER-1')
+        self.assertEqual(self.branches(), ('master', 'master'))
+
+    def test_checkout_rolls_back_on_failure(self):
+        git.new_branch(self.ctx, 'SERVER-1')
+        _git(self.mongo, 'branch', 'community-only')
+
+        with self.assertRaises(UnexpectedExit):
+            git.checkout_branch(self.ctx, 'community-only')
+
+        self.assertEqual(self.branches(), ('SERVER-1', 'SERVER-1'))
+
+    def test_refresh_repos_without_checkout(self):
+        git.new_branch(self.ctx, 'SERVER-1')
+        for repo in (self.mongo, self.enterprise):
+            _git(repo, 'commit', '-q', '--allow-empty', '-m', 'upstream change')
+            _git(repo, 'push', '-q', 'origin', 'SERVER-1:master')
+            _git(repo, 'reset', '-q', '--hard', 'HEAD~1')
+
+        git.refresh_repos(self.ctx, 'master')
+
+        self.assertEqual(self.branches(), ('SERVER-1', 'SERVER-1'))
+        for repo in (self.mongo, self.enterprise):
+            self.assertEqual(_git(repo, 'log', '-1', '--format=%s', 'master'), 'upstream change')
+
+
+class MetadataReaderTest(GitTestCase):
+    def assert_matches_git(self, ctx, repo):
+        git.invalidate_cache()
+        self.assertEqual(git.cur_branch_name(ctx), _git(repo, 'rev-parse', '--abbrev-ref', 'HEAD'))
+        self.assertEqual(git.rev_parse(ctx), _git(repo, 'rev-parse', 'HEAD'))
+
+    def test_branch_and_detached_head(self):
+        self.assert_matches_git(self.ctx, self.mongo)
+
+        _git(self.mongo, 'checkout', '-q', '-b', 'SERVER-1')
+        self.assert_matches_git(self.ctx, self.mongo)
+
+        _git(self.mongo, 'checkout', '-q', '--detach')
+        self.assert_matches_git(self.ctx, self.mongo)
+
+    def test_nested_enterprise_repo(self):
+        _git(self.enterprise, 'checkout', '-q', '-b', 'ent-branch')
+        with self.ctx.cd(git.ent_repo_rel_path):
+            self.assert_matches_git(self.ctx, self.enterprise)
+
+    def test_packed_refs(self):
+        _git(self.mongo, 'pack-refs', '--all')
+        self.assertFalse((self.mongo / '.git' / 'refs' / 'heads' / 'master').exists())
+
+        self.assert_matches_git(self.ctx, self.mongo)
+        self.assertEqual(git.rev_parse(self.ctx, 'origin/master'), _git(self.mongo, 'rev-parse', 'origin/master'))
+
+    def test_worktree(self):
+        worktree = self.mongo.parent / 'mongo-v80'
+        _git(self.mongo, 'worktree', 'add', '-q', '-b', 'v8.0', str(worktree))
+        _git(self.mongo, 'pack-refs', '--all')
+
+        with self.ctx.cd(str(worktree)):
+            self.assert_matches_git(self.ctx, worktree)
+
+    def test_cache_invalidated_by_branch_operations(self):
+        self.assertEqual(git.cur_branch_name(self.ctx), 'master')
+        git.new_branch(self.ctx, 'SERVER-2')
+        self.assertEqual(git.cur_branch_name(self.ctx), 'SERVER-2')
+
+
+class StaleBranchesTest(GitTestCase):
+    def commit_on(self, repo, branch, message):
+        _git(repo, 'checkout', '-q', '-B', branch, 'master')
+        _git(repo, 'commit', '-q', '--allow-empty', '-m', message)
+        _git(repo, 'checkout', '-q', 'master')
+
+    def test_find_stale_branches(self):
+        for repo in (self.mongo, self.enterprise):
+            self.commit_on(repo, 'SERVER-1', 'merged')
+            _git(repo, 'merge', '-q', '--no-ff', '-m', 'merge', 'SERVER-1')
+            self.commit_on(repo, 'SERVER-2', 'in progress')
+            # Just started.
+            _git(repo, 'branch', 'SERVER-3')
+        # Merged in one repo only.
+        self.commit_on(self.mongo, 'SERVER-4', 'community change')
+        _git(self.mongo, 'merge', '-q', '--no-ff', '-m', 'merge', 'SERVER-4')
+        self.commit_on(self.enterprise, 'SERVER-4', 'enterprise change')
+        # Merged and deleted upstream.
+        self.commit_on(self.mongo, 'SERVER-5', 'pushed')
+        _git(self.mongo, 'push', '-q', '-u', 'origin', 'SERVER-5')
+        _git(self.mongo, 'push', '-q', 'origin', '--delete', 'SERVER-5')
+        _git(self.mongo, 'fetch', '-q', '--prune')
+        # Not a ticket branch.
+        self.commit_on(self.mongo, 'scratch', 'merged')
+        _git(self.mongo, 'merge', '-q', '--no-ff', '-m', 'merge', 'scratch')
+
+        branches = {'SERVER-1', 'SERVER-2', 'SERVER-3', 'SERVER-4', 'SERVER-5', 'SERVER-6'}
+        stale, community_branches = git.find_stale_branches(self.ctx, branches, {'master'}, 90)
+        self.assertDictEqual({branch: reason for branch, (_, reason) in stale.items()},
+                             {'SERVER-1': 'merged', 'SERVER-5': 'remote branch deleted'})
+        self.assertEqual(stale['SERVER-1'][0], _git(self.mongo, 'rev-parse', 'SERVER-1'))
+        self.assertNotIn('SERVER-6', community_branches)
+
+        stale, _ = git.find_stale_branches(self.ctx, branches, {'master'}, 90, now=time.time() + 91 * 24 * 60 * 60)
+        self.assertDictEqual({branch: reason for branch, (_, reason) in stale.items()},
+                             {'SERVER-1': 'merged', 'SERVER-2': 'no commits for 90 days',
+                              'SERVER-4': 'merged', 'SERVER-5': 'remote branch deleted'})
+
+        git.run_in_repos(self.ctx, lambda repo_ctx: git.delete_branches(repo_ctx, stale))
+        for repo in (self.mongo, self.enterprise):
+            self.assertNotIn('SERVER-1', _git(repo, 'branch'))
+            self.assertIn('SERVER-3', _git(repo, 'branch'))
+        self.assertIn('scratch', _git(self.mongo, 'branch'))
+
+    def test_new_branch_from_old_base_is_not_stale(self):
+        _git(self.mongo, 'branch', 'SERVER-1')
+        # master moves on, so SERVER-1 is now merged into it without having any commits of its own.
+        _git(self.mongo, 'commit', '-q', '--allow-empty', '-m', 'someone else')
+
+        stale, _ = git.stale_branches(self.ctx, {'SERVER-1'}, {'master'}, 90, now=time.time() + 91 * 24 * 60 * 60)
+        self.assertDictEqual(stale, {})
+
+        _git(self.mongo, 'checkout', '-q', 'SERVER-1')
+        _git(self.mongo, 'commit', '-q', '--allow-empty', '-m', 'work')
+        _git(self.mongo, 'checkout', '-q', 'master')
+        _git(self.mongo, 'merge', '-q', '--no-ff', '-m', 'merge', 'SERVER-1')
+        stale, _ = git.stale_branches(self.ctx, {'SERVER-1'}, {'master'}, 90)
+        self.assertListEqual(list(stale), ['SERVER-1'])
+
+    def test_delete_branches_checked_out_in_worktree(self):
+        for branch in ('SERVER-1', 'SERVER-2'):
+            self.commit_on(self.mongo, branch, branch)
+        worktree = self.mongo.parent / 'mongo-SERVER-2'
+        _git(self.mongo, 'worktree', 'add', '-q', str(worktree), 'SERVER-2')
+
+        self.assertDictEqual(git.worktree_branches(self.ctx), {'master': str(self.mongo), 'SERVER-2': str(worktree)})
+        self.assertSetEqual(git.delete_branches(self.ctx, {'SERVER-1', 'SERVER-2'}), {'SERVER-2'})
+        self.assertNotIn('SERVER-1', _git(self.mongo, 'branch'))
+
+
+class CloneProgressTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def test_logs_every_step(self):
+        progress = git.CloneProgress('mongo')
+        with self.assertLogs('workflow', level='INFO') as logs:
+            progress.write("Cloning into 'mongo'...\nReceiving objects:   0% (1/1000)\rReceiving ob")
+            progress.write('jects:   5% (50/1000)\rReceiving objects:  30% (300/1000)\r')
+            progress.write('Receiving objects: 100% (1000/1000), done.\nResolving deltas: 100% (10/10), done.\n')
+
+        self.assertListEqual([line.split(':', 2)[2] for line in logs.output], [
+            "mongo: Cloning into 'mongo'...",
+            'mongo: Receiving objects:   0% (1/1000)',
+            'mongo: Receiving objects:  30% (300/1000)',
+            'mongo: Receiving objects: 100% (1000/1000), done.',
+            'mongo: Resolving deltas: 100% (10/10), done.',
+        ])
@@ -0,0 +1,213 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import contextlib
+import io
+import os
+import pathlib
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import jira_credentials
+from tests.test_git import _git, make_repo
+
+# Records its name and arguments, and fails if a file named after it exists.
+CHECK_SCRIPT = '''
+import os, sys
+name = os.path.basename(sys.argv[0])
+with open('calls.log', 'a') as fh:
+    fh.write(' '.join([name] + [os.path.basename(a) for a in sys.argv[1:]]) + chr(10))
+sys.exit(1 if os.path.exists(name + '.fail') else 0)
+'''
+
+
+class CredentialAgentTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        agent_dir = os.path.join(temp_dir.name, 'agent')
+        for name, value in [('AGENT_DIR', agent_dir),
+                            ('AGENT_SOCKET', os.path.join(agent_dir, 'agent.sock')),
+                            ('AGENT_CLIENT_TIMEOUT', 0.1)]:
+            patcher = mock.patch.object(jira_credentials, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Never start a real agent or keyring daemon.
+        patcher = mock.patch.object(jira_credentials, '_start_agent')
+        self.start_agent = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.system_keyring = mock.Mock()
+        self.system_keyring.get_password.return_value = 'token'
+        patcher = mock.patch.object(jira_credentials, '_system_keyring', return_value=self.system_keyring)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self):
+        thread = threading.Thread(target=jira_credentials.run_agent, args=(None, []))
+        thread.start()
+        while not jira_credentials._agent_alive():
+            time.sleep(0.01)
+        return thread
+
+    def stop(self, thread):
+        self.assertEqual(jira_credentials._agent_request({'op': 'stop'}, start=False), {})
+        thread.join()
+        self.assertFalse(os.path.exists(jira_credentials.AGENT_SOCKET))
+        self.assertFalse(jira_credentials._agent_alive())
+
+    def test_not_running(self):
+        self.assertIsNone(jira_credentials._agent_request({'op': 'get'}, start=False))
+        self.start_agent.assert_not_called()
+
+        # Without an agent, credentials still come from the system keyring.
+        self.assertEqual(jira_credentials.AgentKeyring().get_password('https://jira', 'user'), 'token')
+        self.start_agent.assert_called_once()
+
+    def test_stale_socket_is_not_running(self):
+        # Left behind by an agent that didn't exit cleanly.
+        os.makedirs(jira_credentials.AGENT_DIR)
+        pathlib.Path(jira_credentials.AGENT_SOCKET).touch()
+
+        self.assertFalse(jira_credentials._agent_alive())
+        thread = self.start()
+        try:
+            self.assertTrue(jira_credentials._agent_alive())
+            self.assertEqual(jira_credentials._agent_request({'op': 'get'}), {'password': None})
+            self.start_agent.assert_not_called()
+        finally:
+            self.stop(thread)
+
+    def test_silent_client_does_not_block_others(self):
+        thread = self.start()
+        try:
+            with socket.socket(socket.AF_UNIX) as silent:
+                silent.connect(jira_credentials.AGENT_SOCKET)
+                self.assertEqual(jira_credentials._agent_request({'op': 'get'}, start=False), {'password': None})
+        finally:
+            self.stop(thread)
+
+    def test_agent_dir_is_made_private(self):
+        os.makedirs(jira_credentials.AGENT_DIR, mode=0o755)
+        os.chmod(jira_credentials.AGENT_DIR, 0o755)
+
+        thread = self.start()
+        self.stop(thread)
+        self.assertEqual(os.stat(jira_credentials.AGENT_DIR).st_mode & 0o777, 0o700)
+
+    def test_caches_credentials(self):
+        thread = self.start()
+        try:
+            backend = jira_credentials.AgentKeyring()
+            self.assertEqual(backend.get_password('https://jira', 'user'), 'token')
+            self.assertEqual(backend.get_password('https://jira', 'user'), 'token')
+            self.system_keyring.get_password.assert_called_once_with('https://jira', 'user')
+
+            backend.set_password('https://jira', 'other', 'new-token')
+            self.system_keyring.set_password.assert_called_once_with('https://jira', 'other', 'new-token')
+            self.assertEqual(backend.get_password('https://jira', 'other'), 'new-token')
+
+            backend.delete_password('https://jira', 'other')
+            self.system_keyring.get_password.return_value = None
+            self.assertIsNone(backend.get_password('https://jira', 'other'))
+            self.start_agent.assert_not_called()
+        finally:
+            self.stop(thread)
+
+
+class PreUploadChecksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        root = pathlib.Path(temp_dir.name)
+
+        patcher = mock.patch.object(jira_credentials, 'PRE_UPLOAD_CACHE_FILE', str(root / 'cache.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.repo = make_repo(root / 'mongo')
+        (self.repo / 'buildscripts').mkdir()
+        for name in ['clang_format.py', 'eslint.py']:
+            (self.repo / 'buildscripts' / name).write_text(CHECK_SCRIPT)
+        (self.repo / '.gitignore').write_text('calls.log\n*.fail\n')
+        _git(self.repo, 'add', '.')
+        _git(self.repo, 'commit', '-q', '-m', 'add checks')
+        _git(self.repo, 'checkout', '-q', '-b', 'SERVER-123')
+        (self.repo / 'README').write_text('changed')
+        os.chdir(str(self.repo / 'buildscripts'))
+
+    def run_checks(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return jira_credentials.run_pre_upload_checks('master', **kwargs)
+
+    def calls(self):
+        log = self.repo / 'calls.log'
+        calls = sorted(log.read_text().splitlines()) if log.exists() else []
+        if log.exists():
+            log.unlink()
+        return calls
+
+    def test_cached_by_diff(self):
+        # There's no todo_check.py, so upload.py is left to check TODOs.
+        self.assertEqual(self.run_checks(), {'--check-clang-format', '--check-eslint'})
+        self.assertListEqual(self.calls(), ['clang_format.py lint-patch pre-upload.patch',
+                                            'eslint.py lint-patch pre-upload.patch'])
+
+        self.assertEqual(self.run_checks(), {'--check-clang-format', '--check-eslint'})
+        self.assertListEqual(self.calls(), [])
+
+        self.assertEqual(self.run_checks(recheck=True), {'--check-clang-format', '--check-eslint'})
+        self.assertEqual(len(self.calls()), 2)
+
+        # A different diff or a different check script are checked again.
+        (self.repo / 'README').write_text('changed again')
+        (self.repo / 'buildscripts' / 'todo_check.py').write_text(CHECK_SCRIPT)
+        self.assertEqual(self.run_checks(), {'--check-clang-format', '--check-eslint', '--check-todos'})
+        self.assertListEqual(self.calls(), ['clang_format.py lint-patch pre-upload.patch',
+                                            'eslint.py lint-patch pre-upload.patch',
+                                            'todo_check.py --ticket SERVER-123'])
+
+    def test_failure_is_not_cached(self):
+        (self.repo / 'eslint.py.fail').touch()
+        self.assertIsNone(self.run_checks())
+        self.assertEqual(len(self.calls()), 2)
+
+        (self.repo / 'eslint.py.fail').unlink()
+        self.assertEqual(self.run_checks(), {'--check-clang-format', '--check-eslint'})
+        self.assertListEqual(self.calls(), ['eslint.py lint-patch pre-upload.patch'])
+
+    def test_patch_is_removed(self):
+        self.run_checks()
+        self.assertFalse((self.repo / '.git' / 'pre-upload.patch').exists())
+
+    def test_revision_args_leave_checks_to_upload(self):
+        self.assertFalse(jira_credentials._may_select_revision(['--jira_user=me', '-y', '--title=Fix it']))
+        self.assertTrue(jira_credentials._may_select_revision(['--rev=HEAD~2']))
+        self.assertTrue(jira_credentials._may_select_revision(['--rev', 'HEAD~2']))
+        self.assertTrue(jira_credentials._may_select_revision(['HEAD~2']))
+        self.assertTrue(jira_credentials._may_select_revision(['-i', '12345', 'src/mongo/db']))
+
+    def test_option_values_are_not_revisions(self):
+        self.assertFalse(jira_credentials._may_select_revision(['-i', '12345', '-m', 'address comments']))
+        self.assertFalse(jira_credentials._may_select_revision(['--issue', '12345', '-r', 'me', '--cc=you']))
@@ -0,0 +1,61 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import json
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from serverworkflowtool import __main__ as main
+
+# Modules that are expensive to import and are only needed by some subcommands. Import time itself is
+# measured by benchmarks/bench_startup.py rather than asserted here.
+HEAVY_MODULES = ['requests', 'yaml', 'pkg_resources', 'serverworkflowtool.setupenv', 'serverworkflowtool.helpers']
+
+
+def _run_python(code, *flags):
+    return subprocess.run([sys.executable] + list(flags) + ['-c', code], check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class StartupTest(unittest.TestCase):
+    def test_requested_collections(self):
+        self.assertListEqual(main._requested_collections(['helpers.f']), ['helpers'])
+        self.assertListEqual(main._requested_collections(['-d', 'setup.macos', '--jobs', '2']), ['setup'])
+        self.assertListEqual(main._requested_collections(['--version']), [])
+        self.assertListEqual(main._requested_collections(['--help']), list(main.COLLECTIONS))
+        self.assertListEqual(main._requested_collections([]), list(main.COLLECTIONS))
+
+    def test_entry_point_does_not_import_subcommands(self):
+        res = _run_python('import json, sys; import serverworkflowtool.__main__ as main; '
+                          'main.build_namespace(["--version"]); '
+                          'print(json.dumps(sorted(sys.modules)))')
+        loaded = json.loads(res.stdout.decode())
+
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, loaded)
+
+    def test_namespace_imports_only_requested_collections(self):
+        from_module = mock.Mock(side_effect=lambda module, name, config: main.Collection(name))
+        with mock.patch('importlib.import_module') as import_module, \
+                mock.patch.object(main.Collection, 'from_module', from_module):
+            main.build_namespace(['build.run', '--jobs', '4'])
+
+        import_module.assert_called_once_with('serverworkflowtool.build')
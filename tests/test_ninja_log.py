@@ -0,0 +1,89 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import pathlib
+import tempfile
+import unittest
+
+from serverworkflowtool.utils import ninja_log
+
+# Two builds: a full one and an incremental one that only rebuilt a.o and the binary.
+LOG = """# ninja log v5
+0\t1000\t0\tbuild/opt/mongo/db/a.o\taaaa
+100\t1500\t0\tbuild/opt/mongo/util/c.o\tcccc
+0\t3000\t0\tbuild/opt/mongo/db/b.o\tbbbb
+3000\t4000\t0\tbuild/opt/mongo/mongod\tdddd
+3000\t4000\t0\tbuild/opt/mongo/mongod.debug\tdddd
+0\t2000\t0\tbuild/opt/mongo/db/a.o\taaab
+2000\t2500\t0\tbuild/opt/mongo/mongod\tdddd
+"""
+
+
+class NinjaLogTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / '.ninja_log'
+        self.path.write_text(LOG)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_runs(self):
+        self.assertEqual(ninja_log.count_runs(self.path), 2)
+        self.assertListEqual([run for run, _ in ninja_log.iter_entries(self.path)], [0, 0, 0, 0, 0, 1, 1])
+
+    def test_not_a_ninja_log(self):
+        self.path.write_text('hello\n')
+        with self.assertRaises(ValueError):
+            ninja_log.count_runs(self.path)
+
+    def test_analyze(self):
+        stats = ninja_log.analyze(self.path, run=0, top=2)
+        # The second output of the link command is not counted twice.
+        self.assertEqual(stats.targets, 4)
+        self.assertEqual(stats.cpu_ms, 1000 + 3000 + 1400 + 1000)
+        self.assertEqual(stats.wall_ms, 4000)
+        self.assertListEqual(stats.slowest(), [(3000, 'build/opt/mongo/db/b.o'), (1400, 'build/opt/mongo/util/c.o')])
+        self.assertListEqual(stats.critical_path(), [('build/opt/mongo/db/b.o', 3000), ('build/opt/mongo/mongod', 1000)])
+        self.assertListEqual(stats.slowest_dirs(), [('build/opt/mongo/db', 4000), ('build/opt/mongo/util', 1400),
+                                                    ('build/opt/mongo', 1000)])
+
+        latest = ninja_log.analyze(self.path)
+        self.assertEqual(latest.targets, 2)
+        self.assertListEqual(latest.critical_path(), [('build/opt/mongo/db/a.o', 2000), ('build/opt/mongo/mongod', 500)])
+
+        with self.assertRaises(ValueError):
+            ninja_log.analyze(self.path, run=-3)
+
+    def test_depth(self):
+        stats = ninja_log.analyze(self.path, run=0, depth=3)
+        self.assertListEqual(stats.slowest_dirs(1), [('build/opt/mongo', 6400)])
+
+    def test_diff(self):
+        base = ninja_log.analyze(self.path, run=0)
+        current = ninja_log.analyze(self.path, run=1)
+        dirs, targets = ninja_log.diff(base, current, n=2)
+        self.assertListEqual(dirs, [(-2000, 4000, 2000, 'build/opt/mongo/db'),
+                                    (-1400, 1400, 0, 'build/opt/mongo/util')])
+        self.assertListEqual(targets, [(-3000, 3000, 0, 'build/opt/mongo/db/b.o'),
+                                       (-1400, 1400, 0, 'build/opt/mongo/util/c.o')])
+
+    def test_parse_ccache_stats(self):
+        text = 'stats_zeroed_timestamp\t0\ndirect_cache_hit\t30\npreprocessed_cache_hit\t10\ncache_miss\t60\n'
+        self.assertEqual(ninja_log.parse_ccache_stats(text), (40, 60))
+        self.assertIsNone(ninja_log.parse_ccache_stats('ccache: invalid option'))
@@ -0,0 +1,132 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import logging
+import threading
+import time
+import unittest
+
+from invoke import Context
+
+from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.utils.scheduler import Step, run_steps, split_jobs
+
+
+class SchedulerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.ctx = Context()
+        self.order = []
+        self.lock = threading.Lock()
+
+    def record(self, name, delay=0):
+        def func(ctx):
+            time.sleep(delay)
+            with self.lock:
+                self.order.append(name)
+        return func
+
+    def test_dependencies_respected(self):
+        steps = [
+            Step('c', 'C', self.record('c'), deps=['a', 'b']),
+            Step('a', 'A', self.record('a', delay=0.05)),
+            Step('b', 'B', self.record('b')),
+        ]
+        run_steps(self.ctx, steps)
+
+        self.assertEqual(self.order[-1], 'c')
+        self.assertCountEqual(self.order, ['a', 'b', 'c'])
+
+    def test_interactive_steps_run_first(self):
+        steps = [
+            Step('auto', 'Auto', self.record('auto')),
+            Step('prompt1', 'Prompt 1', self.record('prompt1'), interactive=True),
+            Step('prompt2', 'Prompt 2', self.record('prompt2'), interactive=True),
+        ]
+        run_steps(self.ctx, steps)
+
+        self.assertListEqual(self.order, ['prompt1', 'prompt2', 'auto'])
+
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        steps = [
+            Step('a', 'A', lambda ctx: barrier.wait()),
+            Step('b', 'B', lambda ctx: barrier.wait()),
+        ]
+        # Would raise BrokenBarrierError if the steps were run one after another.
+        run_steps(self.ctx, steps, max_workers=2)
+
+    def test_steps_get_separate_contexts(self):
+        seen = []
+
+        def func(ctx):
+            with ctx.cd('/tmp'):
+                time.sleep(0.05)
+                seen.append(list(ctx.command_cwds))
+
+        run_steps(self.ctx, [Step('a', 'A', func), Step('b', 'B', func)], max_workers=2)
+
+        self.assertListEqual(seen, [['/tmp'], ['/tmp']])
+        self.assertListEqual(self.ctx.command_cwds, [])
+
+    def test_failure_skips_dependents(self):
+        def fail(ctx):
+            raise RuntimeError('boom')
+
+        steps = [
+            Step('a', 'A', fail),
+            Step('b', 'B', self.record('b'), deps=['a']),
+        ]
+        with self.assertRaises(RuntimeError):
+            run_steps(self.ctx, steps)
+
+        self.assertListEqual(self.order, [])
+
+    def test_invalid_graphs(self):
+        noop = self.record('noop')
+        with self.assertRaises(ValueError):
+            run_steps(self.ctx, [Step('a', 'A', noop, deps=['b']), Step('b', 'B', noop, deps=['a'])])
+        with self.assertRaises(ValueError):
+            run_steps(self.ctx, [Step('a', 'A', noop, deps=['missing'])])
+        with self.assertRaises(ValueError):
+            run_steps(self.ctx, [Step('a', 'A', noop), Step('b', 'B', noop, deps=['a'], interactive=True)])
+
+    def test_keep_going_runs_independent_steps(self):
+        def fail(ctx):
+            raise RuntimeError('boom')
+
+        steps = [
+            Step('a', 'A', fail),
+            Step('b', 'B', self.record('b'), deps=['a']),
+            Step('c', 'C', self.record('c'), deps=['b']),
+            Step('d', 'D', self.record('d')),
+        ]
+        with self.assertRaises(RuntimeError):
+            run_steps(self.ctx, steps, keep_going=True)
+
+        self.assertListEqual(self.order, ['d'])
+
+    def test_split_jobs(self):
+        self.assertListEqual(split_jobs(32, 3), [11, 11, 10])
+        self.assertListEqual(split_jobs(8, 2), [4, 4])
+        # Every task gets at least one job.
+        self.assertListEqual(split_jobs(2, 3), [1, 1, 1])
@@ -0,0 +1,109 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import logging
+import pathlib
+import tempfile
+import unittest
+
+from invoke import Context
+
+from serverworkflowtool.utils import step_state
+from serverworkflowtool.utils.log import get_logger
+from serverworkflowtool.utils.scheduler import Step, run_steps
+from serverworkflowtool.utils.step_state import StepState
+
+
+class StepStateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.temp_dir.name)
+        self.state_file = self.root / 'state' / 'setup-state.json'
+        self.ctx = Context()
+        self.runs = []
+        self.url = 'https://example.com/tool-1.0.tar.gz'
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def install(self, ctx):
+        self.runs.append(self.url)
+        output = self.root / 'tool'
+        if not output.exists():
+            output.write_text(self.url)
+
+    def run_install(self, **kwargs):
+        step = Step('tool', 'Install Tool', self.install, fingerprint=lambda: step_state.fingerprint(self.url),
+                    outputs=[self.root / 'tool'], **kwargs)
+        # A new StepState each time, like separate invocations of the tool.
+        run_steps(self.ctx, [step], state=StepState(self.state_file))
+
+    def test_skips_unchanged_steps(self):
+        self.run_install()
+        self.run_install()
+        self.assertEqual(len(self.runs), 1)
+
+    def test_reruns_and_cleans_when_inputs_change(self):
+        self.run_install(clean=True)
+        self.url = 'https://example.com/tool-2.0.tar.gz'
+        self.run_install(clean=True)
+        self.assertEqual(len(self.runs), 2)
+        self.assertEqual((self.root / 'tool').read_text(), self.url)
+
+        self.run_install(clean=True)
+        self.assertEqual(len(self.runs), 2)
+
+    def test_reruns_when_outputs_are_missing(self):
+        self.run_install()
+        (self.root / 'tool').unlink()
+        self.run_install()
+        self.assertEqual(len(self.runs), 2)
+
+    def test_failed_steps_are_not_recorded(self):
+        def fail(ctx):
+            self.runs.append('fail')
+            raise RuntimeError('failed')
+
+        step = Step('tool', 'Install Tool', fail, fingerprint=lambda: 'same')
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                run_steps(self.ctx, [step], state=StepState(self.state_file))
+        self.assertEqual(len(self.runs), 2)
+
+    def test_clear(self):
+        self.run_install()
+        StepState(self.state_file).clear()
+        self.run_install()
+        self.assertEqual(len(self.runs), 2)
+
+    def test_requirements_digest_follows_includes(self):
+        (self.root / 'requirements').mkdir()
+        top = self.root / 'requirements' / 'dev.txt'
+        included = self.root / 'requirements' / 'core.txt'
+        top.write_text('-r core.txt\nregex\n')
+        included.write_text('pymongo==3.7\n')
+
+        before = step_state.requirements_digest(top)
+        included.write_text('pymongo==3.8\n')
+        self.assertNotEqual(step_state.requirements_digest(top), before)
+        self.assertIsNone(step_state.requirements_digest(self.root / 'missing.txt'))
@@ -0,0 +1,75 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+import pathlib
+from unittest import mock
+
+from serverworkflowtool.utils import ticket_status
+from serverworkflowtool.utils.ticket_status import AheadBehindCache, RepoStatus
+from tests.test_git import GitTestCase, _git
+
+
+class TicketStatusTest(GitTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache_path = pathlib.Path(self.temp_dir.name) / 'status.json'
+
+        for repo in (self.mongo, self.enterprise):
+            _git(repo, 'branch', 'SERVER-1')
+            _git(repo, 'checkout', '-q', '-b', 'SERVER-2')
+            _git(repo, 'commit', '-q', '--allow-empty', '-m', 'work')
+            _git(repo, 'checkout', '-q', 'master')
+            _git(repo, 'commit', '-q', '--allow-empty', '-m', 'upstream')
+            _git(repo, 'branch', 'SERVER-3')
+        # The enterprise repo doesn't have SERVER-4, and SERVER-5's base branch doesn't exist.
+        _git(self.mongo, 'checkout', '-q', '-b', 'SERVER-4')
+        (self.mongo / 'README').write_text('modified')
+        _git(self.mongo, 'branch', 'SERVER-5')
+        self.tickets = {'SERVER-1': 'master', 'SERVER-2': 'master', 'SERVER-3': 'master', 'SERVER-4': 'master',
+                        'SERVER-5': 'v8.0'}
+
+    def collect(self):
+        cache = AheadBehindCache(self.cache_path)
+        with mock.patch.object(ticket_status, '_count', wraps=ticket_status._count) as count:
+            statuses = ticket_status.collect(self.ctx, self.tickets, cache)
+        cache.save()
+        return statuses, count.call_count
+
+    def test_collect(self):
+        (community, enterprise), counted = self.collect()
+        self.assertDictEqual(community, {
+            'SERVER-1': RepoStatus(True, 0, 1, False),
+            'SERVER-2': RepoStatus(True, 1, 1, False),
+            'SERVER-3': RepoStatus(True, 0, 0, False),
+            'SERVER-4': RepoStatus(True, 0, 0, True),
+            'SERVER-5': RepoStatus(True, None, None, False),
+        })
+        self.assertEqual(enterprise['SERVER-2'], RepoStatus(True, 1, 1, False))
+        self.assertEqual(enterprise['SERVER-4'], RepoStatus(False, None, None, False))
+        # SERVER-3 and SERVER-4 point to the same commits in the community repo.
+        self.assertEqual(counted, 3 + 3)
+
+        # Nothing is counted again until a branch moves.
+        (community, _), counted = self.collect()
+        self.assertEqual(counted, 0)
+        self.assertEqual(community['SERVER-2'], RepoStatus(True, 1, 1, False))
+
+        _git(self.mongo, 'commit', '-q', '--allow-empty', '-m', 'more work')
+        (community, _), counted = self.collect()
+        self.assertEqual(counted, 1)
+        self.assertEqual(community['SERVER-4'], RepoStatus(True, 1, 0, True))
@@ -0,0 +1,106 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from invoke import Config, Context, UnexpectedExit
+
+from serverworkflowtool.utils import trace
+from serverworkflowtool.utils.log import log_func
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tracer = trace.enable()
+        self.ctx = Context(config=Config(overrides={
+            'run': {'hide': True, 'in_stream': False},
+            'runners': {'local': trace.TracingLocal},
+        }))
+
+    def tearDown(self) -> None:
+        trace.disable()
+
+    def events(self, cat=None):
+        return [e for e in self.tracer.to_json()['traceEvents'] if e['ph'] == 'X' and cat in (None, e['cat'])]
+
+    def test_disabled_by_default(self):
+        trace.disable()
+        with trace.span('noop') as args:
+            self.assertEqual(args, {})
+        self.ctx.run('true')
+        self.assertIsNone(trace._tracer)
+
+    def test_commands_record_exit_status(self):
+        self.ctx.run('true')
+        self.ctx.run('exit 3', warn=True)
+        with self.assertRaises(UnexpectedExit):
+            self.ctx.run('exit 4')
+
+        events = self.events('subprocess')
+        self.assertEqual([e['args']['exited'] for e in events], [0, 3, 4])
+        self.assertEqual(events[2]['args']['error'], 'UnexpectedExit')
+        for event in events:
+            self.assertIn('child_user_ms', event['args'])
+            self.assertGreater(event['dur'], 0)
+
+    def test_task_spans_nest_commands(self):
+        log_func(lambda: self.ctx.run('sleep 0.05'), 'Sleepy Task')
+
+        task, = self.events('task')
+        command, = self.events('subprocess')
+        self.assertEqual(task['name'], 'Sleepy Task')
+        self.assertIn('cpu_ms', task['args'])
+        self.assertGreaterEqual(task['dur'], 50 * 1000)
+        self.assertLessEqual(task['ts'], command['ts'])
+        self.assertGreaterEqual(task['ts'] + task['dur'], command['ts'] + command['dur'])
+
+    def test_concurrent_commands_skip_child_cpu(self):
+        barrier = threading.Barrier(2)
+
+        def work():
+            with self.tracer.subprocess_span('cmd'):
+                barrier.wait()
+
+        threads = [threading.Thread(target=work, name=f'worker-{i}') for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        events = self.events('subprocess')
+        self.assertEqual(len(events), 2)
+        for event in events:
+            self.assertNotIn('child_user_ms', event['args'])
+        self.assertEqual(len({e['tid'] for e in events}), 2)
+
+    def test_write(self):
+        self.ctx.run('true')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'trace.json')
+            self.tracer.write(path)
+            with open(path) as fh:
+                data = json.load(fh)
+
+        names = [e['args']['name'] for e in data['traceEvents'] if e['ph'] == 'M']
+        self.assertIn('MainThread', names)
+        self.assertEqual(data['otherData']['cpu_count'], os.cpu_count())
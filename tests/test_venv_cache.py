@@ -0,0 +1,118 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from invoke import Config, Context
+
+import serverworkflowtool.config as config
+from serverworkflowtool.utils import venv_cache
+from serverworkflowtool.utils.log import get_logger
+
+
+def _fake_build(ctx, repo_dir, python, template, extra_packages):
+    # A venv without pip is enough to check the copies work, and doesn't need the network.
+    subprocess.run([sys.executable, '-m', 'venv', '--without-pip', str(template)], check=True)
+    (template / 'lib' / 'marker.txt').write_text('installed')
+    (template / venv_cache._COMPLETE_MARKER).touch()
+
+
+class VenvCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.temp_dir.name)
+        self.original_cache_dir = config.VENV_CACHE_DIR
+        config.VENV_CACHE_DIR = self.root / 'cache' / 'venvs'
+
+        self.ctx = Context(config=Config(overrides={'run': {'hide': True, 'in_stream': False}}))
+        self.repos = [self.make_repo('mongo'), self.make_repo('mongo-v80')]
+
+        patcher = mock.patch.object(venv_cache, '_build_template', side_effect=_fake_build)
+        self.build = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        config.VENV_CACHE_DIR = self.original_cache_dir
+        self.temp_dir.cleanup()
+
+    def make_repo(self, name):
+        repo = self.root / name
+        (repo / 'etc' / 'pip').mkdir(parents=True)
+        (repo / venv_cache.REQUIREMENTS_FILE).write_text('regex\n')
+        return repo
+
+    def provision(self, repo):
+        venv_cache.provision(self.ctx, repo, python=sys.executable)
+
+    def test_worktrees_share_template(self):
+        for repo in self.repos:
+            self.provision(repo)
+        self.assertEqual(self.build.call_count, 1)
+
+        template, = [p for p in config.VENV_CACHE_DIR.iterdir() if p.is_dir()]
+        for repo in self.repos:
+            venv = repo / venv_cache.VENV_DIR_NAME
+            # Files are shared with the template.
+            self.assertTrue(os.path.samefile(str(venv / 'lib' / 'marker.txt'), str(template / 'lib' / 'marker.txt')))
+
+            # Scripts refer to their own venv.
+            activate = (venv / 'bin' / 'activate').read_text()
+            self.assertIn(str(venv), activate)
+            self.assertNotIn(str(template), activate)
+
+            res = subprocess.run([str(venv / 'bin' / 'python'), '-c', 'import sys; print(sys.prefix)'],
+                                 check=True, stdout=subprocess.PIPE)
+            self.assertEqual(res.stdout.decode().strip(), str(venv))
+
+        self.assertIn(str(template), (template / 'bin' / 'activate').read_text())
+
+    def test_recreated_when_requirements_change(self):
+        repo = self.repos[0]
+        self.provision(repo)
+        self.provision(repo)
+        self.assertEqual(self.build.call_count, 1)
+
+        (repo / venv_cache.REQUIREMENTS_FILE).write_text('regex\npymongo\n')
+        self.provision(repo)
+        self.assertEqual(self.build.call_count, 2)
+        self.assertEqual((repo / venv_cache.VENV_DIR_NAME / venv_cache._DIGEST_FILE).read_text(),
+                         venv_cache.lock_digest(repo, sys.executable))
+
+    def test_evicts_least_recently_used(self):
+        for i in range(config.VENV_CACHE_MAX_ENTRIES + 2):
+            (self.repos[0] / venv_cache.REQUIREMENTS_FILE).write_text(f'regex=={i}\n')
+            self.provision(self.repos[0])
+
+        templates = [p for p in config.VENV_CACHE_DIR.iterdir() if p.is_dir()]
+        self.assertEqual(len(templates), config.VENV_CACHE_MAX_ENTRIES)
+        self.assertIn(config.VENV_CACHE_DIR / venv_cache.lock_digest(self.repos[0], sys.executable), templates)
+        # Lock files of evicted templates are removed with them.
+        lock_files = [p for p in config.VENV_CACHE_DIR.iterdir() if p.name.endswith('.lock')]
+        self.assertCountEqual([p.with_suffix('') for p in lock_files], templates)
@@ -0,0 +1,158 @@
+#  Copyright 2019 MongoDB Inc.
+#
+#  Licensed to the Apache Software Foundation (ASF) under one
+#  or more contributor license agreements.  See the NOTICE file
+#  distributed with this work for additional information
+#  regarding copyright ownership.  The ASF licenses this file
+#  to you under the Apache License, Version 2.0 (the
+#  "License"); you may not use this file except in compliance
+#  with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an
+#  "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#  KIND, either express or implied.  See the License for the
+#  specific language governing permissions and limitations
+#  under the License.
+
+import errno
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from invoke import Config, Context
+
+import serverworkflowtool.config as config
+from serverworkflowtool.utils import InvalidConfigError, git, watcher
+from serverworkflowtool.utils.log import get_logger
+from tests.test_git import _git, make_repo
+
+
+@unittest.skipUnless(watcher.is_supported(), 'inotify is only available on Linux')
+class ChangedFilesWatcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        get_logger(logging.INFO)
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.temp_dir.name)
+
+        self.original_config_path = config.CONFIG_FILE
+        config.CONFIG_FILE = root / 'config.db'
+        conf = config.reload_config()
+        ticket = config.TicketConfig()
+        ticket.base_branch = 'master'
+        conf.in_progress_tickets['SERVER-1'] = ticket
+        conf.dump()
+
+        self.repo = make_repo(root / 'mongo')
+        (self.repo / 'src').mkdir()
+        (self.repo / 'src' / 'a.cpp').write_text('int a;\n')
+        _git(self.repo, 'add', 'src')
+        _git(self.repo, 'commit', '-q', '-m', 'add source')
+        _git(self.repo, 'checkout', '-q', '-b', 'SERVER-1')
+
+        self.ctx = Context(config=Config(overrides={'run': {'hide': True, 'in_stream': False}}))
+        git.invalidate_cache()
+        self.cwd = os.getcwd()
+        os.chdir(str(self.repo))
+
+        self.watcher = None
+        self.thread = None
+
+    def tearDown(self) -> None:
+        if self.watcher:
+            self.watcher.stop()
+            self.thread.join()
+        os.chdir(self.cwd)
+        config.CONFIG_FILE = self.original_config_path
+        config._ConfigImpl.instance = None
+        self.temp_dir.cleanup()
+
+    def start_watcher(self):
+        self.watcher = watcher.ChangedFilesWatcher(self.ctx)
+        self.thread = threading.Thread(target=self.watcher.run, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.wait_for(lambda: watcher.read_index(self.ctx) is not None)
+
+    def wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail('Timed out waiting for the watcher')
+            time.sleep(0.02)
+
+    def indexed_files(self):
+        return (watcher.read_index(self.ctx) or {}).get('files', [])
+
+    def test_falls_back_to_git_without_watcher(self):
+        (self.repo / 'src' / 'a.cpp').write_text('int b;\n')
+        self.assertEqual(watcher.changed_files(self.ctx, 'master'), ['src/a.cpp'])
+
+    def test_tracks_modified_and_new_files(self):
+        (self.repo / 'README').write_text('changed before the watcher started\n')
+        self.start_watcher()
+        self.assertEqual(self.indexed_files(), ['README'])
+
+        (self.repo / 'src' / 'a.cpp').write_text('int b;\n')
+        (self.repo / 'src' / 'new').mkdir()
+        (self.repo / 'src' / 'new' / 'b.cpp').write_text('int c;\n')
+        self.wait_for(lambda: len(self.indexed_files()) == 3)
+
+        # The index is used directly instead of asking git.
+        self.ctx.run = None
+        self.assertEqual(watcher.changed_files(self.ctx, 'master'), ['README', 'src/a.cpp', 'src/new/b.cpp'])
+
+    def test_index_is_ignored_for_other_branches(self):
+        self.start_watcher()
+        (self.repo / 'src' / 'a.cpp').write_text('int b;\n')
+        self.wait_for(lambda: self.indexed_files() == ['src/a.cpp'])
+
+        # Checking out another branch makes the watcher rebuild its index from git.
+        _git(self.repo, 'stash', '-q')
+        _git(self.repo, 'checkout', '-q', 'master')
+        self.wait_for(lambda: (watcher.read_index(self.ctx) or {}).get('branch') == 'master')
+        self.assertIsNone(watcher.read_index(self.ctx)['base_branch'])
+        self.assertEqual(watcher.changed_files(self.ctx, 'master'), [])
+
+    def test_index_removed_on_exit(self):
+        self.start_watcher()
+        self.watcher.stop()
+        self.thread.join()
+        self.watcher = None
+        self.assertIsNone(watcher.read_index(self.ctx))
+
+    def test_generated_directories_are_not_watched(self):
+        (self.repo / 'src' / '__pycache__').mkdir()
+        (self.repo / 'build' / 'opt').mkdir(parents=True)
+        w = watcher.ChangedFilesWatcher(self.ctx)
+        w.inotify = mock.Mock()
+        w.inotify.add_watch.side_effect = range(100)
+
+        w._watch_tree(str(self.repo))
+
+        watched = {os.path.relpath(d, str(self.repo)) for d in w.dirs.values()}
+        self.assertSetEqual(watched, {'.', 'src'})
+
+    def test_out_of_watches(self):
+        for i in range(5):
+            (self.repo / 'src' / str(i)).mkdir()
+        w = watcher.ChangedFilesWatcher(self.ctx)
+        w.inotify = mock.Mock()
+        w.inotify.add_watch.side_effect = [1, OSError(errno.ENOSPC, 'No space left on device')] + [OSError()] * 10
+
+        with self.assertLogs('workflow', level='WARNING') as logs, self.assertRaises(InvalidConfigError):
+            w._watch_tree(str(self.repo))
+
+        self.assertEqual(w.inotify.add_watch.call_count, 2)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('fs.inotify.max_user_watches', logs.output[0])
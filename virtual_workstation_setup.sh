@@ -133,6 +133,53 @@ BLOCK
     set -o nounset
 }
 
+# Create python3-venv in the current directory. The packages are installed once per poetry.lock into a
+# template venv under ~/.cache/server-workflow-tool/venvs, and each checkout's venv is a hardlinked copy of
+# it. Only the files that contain the venv's own path are copied. See serverworkflowtool/utils/venv_cache.py.
+setup_venv() {
+    local python=/opt/mongodbtoolchain/v4/bin/python3
+    local cache_dir="$HOME/.cache/server-workflow-tool"
+    # Declared separately so a failing command fails the assignment instead of being masked by `local`.
+    local digest
+    local python_version
+    python_version=$("$python" --version 2>&1)
+    digest=$(cat poetry.lock pyproject.toml <(echo "$python_version") | sha256sum | cut -c1-16)
+    if [[ ! "$digest" =~ ^[0-9a-f]{16}$ ]]; then
+        echo "Could not compute the shared virtualenv name from poetry.lock and pyproject.toml"
+        return 1
+    fi
+    local template="$cache_dir/venvs/vw-$digest"
+
+    if [[ ! -f "$template/.workflow-complete" ]]; then
+        echo "Building shared virtualenv $template, this only happens once per poetry.lock..."
+        rm -rf "$template"
+        "$python" -m venv "$template"
+        (
+            # virtualenv doesn't like nounset
+            set +o nounset
+            source "$template/bin/activate"
+            set -o nounset
+
+            export PIP_CACHE_DIR="$cache_dir/pip"
+            export POETRY_CACHE_DIR="$cache_dir/poetry"
+
+            python -m pip install "pip==21.0.1"
+
+            python -m pip install 'poetry==1.5.1'
+            # PYTHON_KEYRING_BACKEND is needed to make poetry install work
+            # See guide https://wiki.corp.mongodb.com/display/KERNEL/Virtual+Workstation
+            export PYTHON_KEYRING_BACKEND=keyring.backends.null.Keyring
+            python -m poetry install --no-root --sync
+        )
+        touch "$template/.workflow-complete"
+    fi
+
+    cp -al "$template" python3-venv
+    rm python3-venv/.workflow-complete
+    # sed -i replaces the files instead of writing through the hardlinks, so the template is untouched.
+    grep -rlI --null "$template" python3-venv/bin python3-venv/pyvenv.cfg | xargs -0 -r sed -i "s|$template|$PWD/python3-venv|g"
+}
+
 setup_master() {
     echo "################################################################################"
     echo "Setting up the mongo repo..."
@@ -143,21 +190,13 @@ setup_master() {
 
     git clone git@github.com:10gen/mongo.git
     pushd "$workdir/mongo"
-        /opt/mongodbtoolchain/v4/bin/python3 -m venv python3-venv
+        setup_venv
 
         # virtualenv doesn't like nounset
         set +o nounset
         source python3-venv/bin/activate
         set -o nounset
 
-            python -m pip install "pip==21.0.1"
-
-            python -m pip install 'poetry==1.5.1'
-            # PYTHON_KEYRING_BACKEND is needed to make poetry install work
-            # See guide https://wiki.corp.mongodb.com/display/KERNEL/Virtual+Workstation
-            export PYTHON_KEYRING_BACKEND=keyring.backends.null.Keyring
-            python -m poetry install --no-root --sync
-
             python buildscripts/scons.py --variables-files=etc/scons/mongodbtoolchain_stable_clang.vars compiledb -j$(grep -c ^processor /proc/cpuinfo)
 
             buildninjaic
@@ -183,21 +222,13 @@ setup_80() {
     popd
 
     pushd "$workdir/mongo-v80"
-        /opt/mongodbtoolchain/v4/bin/python3 -m venv python3-venv
+        setup_venv
 
         # virtualenv doesn't like nounset
         set +o nounset
         source python3-venv/bin/activate
         set -o nounset
 
-            python -m pip install "pip==21.0.1"
-
-            python -m pip install 'poetry==1.5.1'
-            # PYTHON_KEYRING_BACKEND is needed to make poetry install work
-            # See guide https://wiki.corp.mongodb.com/display/KERNEL/Virtual+Workstation
-            export PYTHON_KEYRING_BACKEND=keyring.backends.null.Keyring
-            python -m poetry install --no-root --sync
-
             python buildscripts/scons.py --variables-files=etc/scons/mongodbtoolchain_stable_clang.vars compiledb -j$(grep -c ^processor /proc/cpuinfo)
 
             buildninjaic